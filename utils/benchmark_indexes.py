@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""Benchmark the page, ticket and slot lookups with and without the
+indexes added by pages 0003, tickets 0003 and schedule 0006.
+
+A temporary sqlite database is migrated to just before those migrations
+and filled with synthetic rows. The lookups are timed, the migrations are
+applied, and they're timed again. The query plans are shown for both.
+
+Usage: python utils/benchmark_indexes.py [rows (default 100000)] [runs]
+"""
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wafer.settings')
+
+# (app, the migration before the indexes were added)
+BEFORE = [
+    ('pages', '0002_page_people'),
+    ('tickets', '0002_auto_20150813_1926'),
+    ('schedule', '0005_schedulefinding_person'),
+]
+
+BATCH_SIZE = 500
+
+# Slots per day
+SLOTS = 100
+
+# Pages per parent
+CHILDREN = 100
+
+
+def populate(rows):
+    from wafer.pages.models import Page
+    from wafer.schedule.models import Day, Slot
+    from wafer.tickets.models import Ticket, TicketType
+
+    parents = [Page.objects.create(name='Parent %d' % i, slug='parent-%d' % i)
+               for i in range(rows // CHILDREN)]
+    Page.objects.bulk_create(
+        (Page(name='Page %d' % i, slug='page-%d' % (i % CHILDREN),
+              parent=parents[i // CHILDREN])
+         for i in range(len(parents) * CHILDREN)),
+        batch_size=BATCH_SIZE)
+
+    ticket_type = TicketType.objects.create(name='Benchmark')
+    Ticket.objects.bulk_create(
+        (Ticket(barcode=i, email='user%d@example.com' % i, type=ticket_type)
+         for i in range(rows)),
+        batch_size=BATCH_SIZE)
+
+    start = datetime.date(2016, 1, 1)
+    days = [Day.objects.create(date=start + datetime.timedelta(days=i))
+            for i in range(rows // SLOTS)]
+    slots = []
+    for i in range(len(days) * SLOTS):
+        day = days[i // SLOTS]
+        minutes = i % SLOTS * 10
+        start_time = datetime.time(minutes // 60, minutes % 60)
+        end_time = datetime.time((minutes + 9) // 60, (minutes + 9) % 60)
+        slots.append(Slot(day=day, effective_day=day, start_time=start_time,
+                          effective_start_time=start_time,
+                          end_time=end_time, _order=i % SLOTS))
+    # Insert them out of order, so the sort isn't free
+    slots.reverse()
+    Slot.objects.bulk_create(slots, batch_size=BATCH_SIZE)
+    return parents, days
+
+
+def get_queries(rows, parents, days):
+    from wafer.pages.models import Page
+    from wafer.schedule.models import Slot
+    from wafer.tickets.models import Ticket
+
+    parent = parents[len(parents) // 2]
+    day = days[len(days) // 2]
+    return [
+        ('page by (parent, slug)',
+         Page.objects.filter(parent=parent, slug='page-%d' % (CHILDREN // 2))),
+        ('ticket by email',
+         Ticket.objects.filter(email='user%d@example.com' % (rows // 2))),
+        ('slots for a day by end',
+         Slot.objects.filter(effective_day=day).order_by('end_time')),
+    ]
+
+
+def query_plan(queryset):
+    from django.db import connection
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return '; '.join(row[-1] for row in cursor.fetchall())
+
+
+def run(queries, runs):
+    results = []
+    for label, queryset in queries:
+        # Evaluate a fresh copy each time, so the result cache isn't used
+        seconds = timeit.timeit(lambda: list(queryset.all()), number=runs)
+        results.append((label, seconds * 1000 / runs, query_plan(queryset)))
+    return results
+
+
+def main(rows=100000, runs=50):
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    tmpdir = tempfile.mkdtemp()
+    settings.DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(tmpdir, 'benchmark.db'),
+    }
+    settings.DEBUG = False
+    django.setup()
+    try:
+        call_command('migrate', verbosity=0)
+        call_command('createcachetable', verbosity=0)
+        for app, migration in BEFORE:
+            call_command('migrate', app, migration, verbosity=0)
+        print('Populating %d rows per table' % rows)
+        parents, days = populate(rows)
+        queries = get_queries(rows, parents, days)
+        before = run(queries, runs)
+        call_command('migrate', verbosity=0)
+        after = run(queries, runs)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print('Mean of %d runs, before -> after:' % runs)
+    for (label, old, old_plan), (_, new, new_plan) in zip(before, after):
+        print('  %-24s %8.3fms -> %8.3fms' % (label, old, new))
+        print('    before: %s' % old_plan)
+        print('    after:  %s' % new_plan)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
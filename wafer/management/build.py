@@ -0,0 +1,381 @@
+"""Build the static site from the renderers, optionally in parallel.
+
+django_medusa.renderers must be imported before wafer.management.static,
+since the configured renderer class is looked up when it's imported.
+
+Incremental builds
+------------------
+
+Each build records a manifest, next to the deploy directory, of the
+rendered paths, the hash of their output and what they depend on.
+Renderers declare the dependencies with a get_dependencies() method,
+returning a dictionary of path -> list of model instances, (model, pk)
+tuples and model classes. A path depending on an instance is re-rendered
+when that row (or its many to many relations) changes, and a path
+depending on a class (a page listing the objects, say) is re-rendered
+when any row is added, changed or deleted. Paths without declared
+dependencies are always rendered.
+
+Everything is re-rendered when the site or menus change, since they are
+on every page. Changes to the templates or the code aren't tracked, so
+a full build is needed after an upgrade.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from django_medusa.renderers import StaticSiteRenderer
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.db import connections
+from django.test.client import Client
+from django.utils.encoding import force_bytes, force_text
+
+from wafer.management.compress import SUFFIXES, compress_output
+from wafer.menu import generate_menu
+from wafer.utils import STATIC_SITE_HEADER
+
+
+MANIFEST_VERSION = 1
+
+# Fields which change without changing anything that's displayed
+IGNORED_FIELDS = ('last_login', 'password')
+
+
+# The renderer used by each worker process of a parallel build
+_worker_renderer = None
+
+
+def _make_client():
+    return Client(**{STATIC_SITE_HEADER: '1'})
+
+
+def _init_worker():
+    global _worker_renderer
+    _worker_renderer = StaticSiteRenderer()
+    _worker_renderer.client = _make_client()
+
+
+def _render_path(task):
+    index, path = task
+    _worker_renderer.render_path(path=path)
+    return index
+
+
+def _close_connections():
+    """Close the database connections before starting the workers, so
+       each worker opens its own, rather than sharing ours.
+
+       In-memory sqlite databases (as used by the tests) can't be
+       reopened, so they're left alone. The forked workers get a copy."""
+    for connection in connections.all():
+        if (connection.vendor == 'sqlite' and connection.is_in_memory_db(
+                connection.settings_dict['NAME'])):
+            continue
+        connection.close()
+
+
+def _make_output_dirs(paths):
+    """Create the output directories up front, so the workers don't race
+       to create them."""
+    for path in paths:
+        output_dir = os.path.join(settings.MEDUSA_DEPLOY_DIR,
+                                  os.path.dirname(path.lstrip('/')))
+        try:
+            os.makedirs(output_dir)
+        except OSError:
+            # Either it exists, or a page is in the way, which is
+            # reported when the path is rendered
+            pass
+
+
+def _hash(data):
+    return hashlib.sha1(force_bytes(data)).hexdigest()
+
+
+def _dependency_model(dependency):
+    if isinstance(dependency, tuple):
+        dependency = dependency[0]
+    return dependency._meta.model
+
+
+def _model_label(model):
+    opts = model._meta
+    return '%s.%s' % (opts.app_label, opts.model_name)
+
+
+def _dependency_key(dependency):
+    """The manifest key for an instance or (model, pk) tuple
+       ('app.model:pk'), or a model class ('app.model')."""
+    label = _model_label(_dependency_model(dependency))
+    if isinstance(dependency, type):
+        return label
+    if isinstance(dependency, tuple):
+        return '%s:%s' % (label, dependency[1])
+    return '%s:%s' % (label, dependency.pk)
+
+
+def _model_fingerprints(model):
+    """Return a dictionary of pk -> hash of the model's rows, including
+       the pks of their many to many relations."""
+    fields = [field.attname for field in model._meta.concrete_fields
+              if not field.primary_key and
+              field.attname not in IGNORED_FIELDS]
+    manager = model._default_manager
+    related = {}
+    for field in model._meta.many_to_many:
+        for pk, other in manager.order_by().values_list('pk', field.name):
+            if other is not None:
+                related.setdefault((pk, field.name), []).append(other)
+    fingerprints = {}
+    for row in manager.order_by().values_list('pk', *fields):
+        pk = row[0]
+        relations = [sorted(related.get((pk, field.name), []))
+                     for field in model._meta.many_to_many]
+        fingerprints[force_text(pk)] = _hash(repr((row, relations)))
+    return fingerprints
+
+
+def _site_fingerprint():
+    """Hash what's shown on every page: the site details and the
+       menus."""
+    site = Site.objects.get_current()
+    return _hash(json.dumps([site.name, site.domain, generate_menu().items],
+                            sort_keys=True, default=force_text))
+
+
+def _output_files(path):
+    """Return the files written for path, if they exist."""
+    realpath = os.path.join(settings.MEDUSA_DEPLOY_DIR, path.lstrip('/'))
+    if not path.endswith('/'):
+        return [realpath] if os.path.isfile(realpath) else []
+    if not os.path.isdir(realpath):
+        return []
+    # The extension depends on the content type
+    return sorted(os.path.join(realpath, name)
+                  for name in os.listdir(realpath)
+                  if name.startswith('index.'))
+
+
+def _output_hash(path):
+    """Hash the output for path, or return None if there isn't any."""
+    files = _output_files(path)
+    if not files:
+        return None
+    sha = hashlib.sha1()
+    for name in files:
+        with open(name, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def _prune(path):
+    """Remove the output for a path which is no longer part of the site,
+       and any directories left empty."""
+    for name in _output_files(path):
+        os.unlink(name)
+        for suffix in SUFFIXES:
+            if os.path.exists(name + suffix):
+                os.unlink(name + suffix)
+    deploy_dir = os.path.abspath(settings.MEDUSA_DEPLOY_DIR)
+    directory = os.path.dirname(os.path.abspath(
+        os.path.join(deploy_dir, path.lstrip('/'))))
+    while directory.startswith(deploy_dir + os.sep):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            # Not empty
+            break
+        directory = os.path.dirname(directory)
+
+
+class BuildManifest(object):
+    """What was rendered by the last build, and from what.
+
+       paths maps each path to the hash of its output and the keys of its
+       dependencies. objects maps each model label to the fingerprints of
+       its rows, and site is the fingerprint of the site and menus."""
+
+    def __init__(self, paths=None, objects=None, site=None):
+        self.paths = paths or {}
+        self.objects = objects or {}
+        self.site = site
+
+    @classmethod
+    def filename(cls):
+        deploy_dir = os.path.normpath(settings.MEDUSA_DEPLOY_DIR)
+        return deploy_dir + '.manifest.json'
+
+    @classmethod
+    def load(cls):
+        """Return the manifest of the last build, or an empty manifest if
+           there isn't a usable one."""
+        try:
+            with open(cls.filename()) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return cls()
+        if data.get('version') != MANIFEST_VERSION:
+            return cls()
+        return cls(data['paths'], data['objects'], data['site'])
+
+    def save(self):
+        data = {
+            'version': MANIFEST_VERSION,
+            'paths': self.paths,
+            'objects': self.objects,
+            'site': self.site,
+        }
+        with open(self.filename(), 'w') as f:
+            json.dump(data, f, sort_keys=True)
+
+    def changed(self, key, objects):
+        """Has the dependency with the given key changed since this
+           manifest was recorded?"""
+        label, _, pk = key.partition(':')
+        old = self.objects.get(label)
+        if old is None:
+            return True
+        if not pk:
+            return old != objects[label]
+        return old.get(pk) != objects[label].get(pk)
+
+
+class StaticSiteBuilder(object):
+    """Render the paths from a list of static site renderer classes.
+
+       With jobs > 1, the paths from all the renderers are shared out
+       between a pool of worker processes. The files written are the same
+       as for a serial build.
+
+       With incremental, only the paths whose dependencies have changed
+       since the last build are rendered, and the output for paths which
+       have gone is removed.
+
+       With compress, precompressed copies of the files are written (see
+       wafer.management.compress)."""
+
+    def __init__(self, renderers, jobs=1, stdout=None, incremental=False,
+                 compress=False):
+        self.renderers = renderers
+        self.jobs = jobs
+        self.stdout = stdout or sys.stdout
+        self.incremental = incremental
+        self.compress = compress
+
+    def _report(self, renderer, count, elapsed):
+        skipped = len(renderer.paths) - count
+        message = '%s: rendered %d paths in %.1fs' % (
+            renderer.__class__.__name__, count, elapsed)
+        if skipped:
+            message += ' (%d unchanged)' % skipped
+        self.stdout.write(message + '\n')
+
+    def build(self):
+        StaticSiteRenderer.initialize_output()
+        renderers = [renderer() for renderer in self.renderers]
+        dependencies = self._get_dependencies(renderers)
+        manifest = self._new_manifest(dependencies)
+        previous = BuildManifest.load()
+        old = previous
+        if not self.incremental or previous.site != manifest.site:
+            # Everything needs rendering
+            old = BuildManifest()
+        todo = [[path for path in renderer.paths
+                 if self._needs_render(path, old, manifest)]
+                for renderer in renderers]
+        if self.jobs > 1:
+            self._build_parallel(renderers, todo)
+        else:
+            self._build_serial(renderers, todo)
+        rendered = set(path for paths in todo for path in paths)
+        for path, entry in manifest.paths.items():
+            if path in rendered:
+                entry['hash'] = _output_hash(path)
+            else:
+                entry['hash'] = old.paths[path]['hash']
+        for path in set(previous.paths) - set(manifest.paths):
+            _prune(path)
+        manifest.save()
+        if self.compress:
+            start = time.time()
+            compressed, unchanged = compress_output(self.jobs)
+            self.stdout.write('Compressed %d files in %.1fs (%d unchanged)\n'
+                              % (compressed, time.time() - start, unchanged))
+        StaticSiteRenderer.finalize_output()
+
+    def _get_dependencies(self, renderers):
+        """Return a dictionary of path -> dependencies (or None, if the
+           renderer doesn't declare them)."""
+        dependencies = {}
+        for renderer in renderers:
+            declared = {}
+            if hasattr(renderer, 'get_dependencies'):
+                declared = renderer.get_dependencies()
+            for path in renderer.paths:
+                dependencies[path] = declared.get(path)
+        return dependencies
+
+    def _new_manifest(self, dependencies):
+        """Start the manifest for this build, fingerprinting the models
+           the paths depend on."""
+        models = {}
+        paths = {}
+        for path, deps in dependencies.items():
+            keys = None
+            if deps is not None:
+                for dep in deps:
+                    model = _dependency_model(dep)
+                    models[_model_label(model)] = model
+                keys = sorted(set(_dependency_key(dep) for dep in deps))
+            paths[path] = {'deps': keys, 'hash': None}
+        objects = dict((label, _model_fingerprints(model))
+                       for label, model in models.items())
+        return BuildManifest(paths, objects, _site_fingerprint())
+
+    def _needs_render(self, path, old, manifest):
+        entry = old.paths.get(path)
+        keys = manifest.paths[path]['deps']
+        if entry is None or keys is None or entry['deps'] != keys:
+            return True
+        if entry['hash'] is None or entry['hash'] != _output_hash(path):
+            # The output is missing, or has been modified
+            return True
+        return any(old.changed(key, manifest.objects) for key in keys)
+
+    def _build_serial(self, renderers, todo):
+        client = _make_client()
+        for renderer, paths in zip(renderers, todo):
+            start = time.time()
+            renderer.client = client
+            for path in paths:
+                renderer.render_path(path=path)
+            self._report(renderer, len(paths), time.time() - start)
+
+    def _build_parallel(self, renderers, todo):
+        tasks = [(index, path) for index, paths in enumerate(todo)
+                 for path in paths]
+        _make_output_dirs(path for _, path in tasks)
+        remaining = [len(paths) for paths in todo]
+        for renderer, count in zip(renderers, remaining):
+            if count == 0:
+                self._report(renderer, 0, 0)
+        start = time.time()
+        _close_connections()
+        pool = multiprocessing.Pool(self.jobs, initializer=_init_worker)
+        try:
+            for index in pool.imap_unordered(_render_path, tasks,
+                                             chunksize=4):
+                remaining[index] -= 1
+                if remaining[index] == 0:
+                    self._report(renderers[index], len(todo[index]),
+                                 time.time() - start)
+        finally:
+            # All the paths have been rendered, unless something went
+            # wrong, so there's nothing to wait for
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,33 @@
+import multiprocessing
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django_medusa.utils import get_static_renderers
+
+from wafer.management.build import StaticSiteBuilder
+
+
+class Command(BaseCommand):
+    help = ("Generate the static version of the site, like staticsitegen,"
+            " optionally rendering the pages with several processes, only"
+            " rendering what has changed, or precompressing the files.")
+
+    option_list = BaseCommand.option_list + tuple([
+        make_option('--jobs', '-j', type='int', default=1,
+                    help="Number of processes to render with (0 for one"
+                    " per cpu)"),
+        make_option('--incremental', action='store_true', default=False,
+                    help="Only render the paths which have changed since"
+                    " the last build"),
+        make_option('--compress', action='store_true', default=False,
+                    help="Write compressed copies of the files, for the"
+                    " web server to send"),
+    ])
+
+    def handle(self, *args, **options):
+        jobs = options['jobs'] or multiprocessing.cpu_count()
+        builder = StaticSiteBuilder(get_static_renderers(), jobs=jobs,
+                                    stdout=self.stdout,
+                                    incremental=options['incremental'],
+                                    compress=options['compress'])
+        builder.build()
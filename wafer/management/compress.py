@@ -0,0 +1,187 @@
+"""Write precompressed copies of the files in the static site.
+
+Servers and CDNs can send these directly, rather than compressing each
+response (nginx's gzip_static, for example). Gzip is always available,
+while brotli and zstandard are used if their libraries are installed.
+
+A hashes.json file, mapping each file to the hash of its contents, is
+written alongside, for cache-busting. Files which haven't changed since
+it was last written are skipped, and files with the same contents share
+their compressed copies, as hard links.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+HASHES_FILE = 'hashes.json'
+
+# The suffixes of the compressed copies, in any of the formats
+SUFFIXES = ('.gz', '.br', '.zst')
+
+# Files which are already compressed
+COMPRESSED_EXTENSIONS = ('.gz', '.br', '.zst', '.png', '.jpg', '.jpeg',
+                         '.gif', '.ico', '.zip', '.pdf')
+
+
+def _gzip(data):
+    out = io.BytesIO()
+    # A fixed mtime, so the output only depends on the input
+    with gzip.GzipFile(filename='', mode='wb', fileobj=out, mtime=0,
+                       compresslevel=9) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def get_compressors():
+    """Return a list of (suffix, compress function) for the available
+       formats."""
+    compressors = [('.gz', _gzip)]
+    if brotli is not None:
+        compressors.append(('.br', brotli.compress))
+    if zstandard is not None:
+        compressors.append(
+            ('.zst', zstandard.ZstdCompressor(level=19).compress))
+    return compressors
+
+
+def _replace(name, data):
+    """Replace the file atomically, with a new inode, so other names for
+       the old file are left alone."""
+    tmp = name + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.rename(tmp, name)
+
+
+def _link(source, name):
+    tmp = name + '.tmp'
+    try:
+        os.link(source, tmp)
+    except OSError:
+        # The filesystem may not support hard links
+        with open(source, 'rb') as f:
+            data = f.read()
+        with open(tmp, 'wb') as f:
+            f.write(data)
+    os.rename(tmp, name)
+
+
+def _compress_group(task):
+    """Compress a group of files with the same contents, linking all
+       their compressed copies to the same files.
+
+       task is (source, names), where source is a file with the same
+       contents which has already been compressed, or None."""
+    source, names = task
+    if source is None:
+        source = names[0]
+        names = names[1:]
+        with open(source, 'rb') as f:
+            data = f.read()
+        for suffix, compress in get_compressors():
+            _replace(source + suffix, compress(data))
+    for name in names:
+        for suffix, _ in get_compressors():
+            _link(source + suffix, name + suffix)
+    return len(task[1])
+
+
+def _hash_file(name):
+    sha = hashlib.sha1()
+    with open(name, 'rb') as f:
+        sha.update(f.read())
+    return sha.hexdigest()
+
+
+def _find_files(root, old_hashes):
+    """Return a list of the files under root, relative to root, other
+       than the compressed copies.
+
+       Copies of the files in old_hashes (the files compressed by the
+       last run) which have gone are removed, along with copies in
+       formats which are no longer available, since they'd be stale."""
+    available = [suffix for suffix, _ in get_compressors()]
+    files = []
+    for dirpath, _, filenames in os.walk(root):
+        present = set(filenames)
+        for filename in filenames:
+            name = os.path.relpath(os.path.join(dirpath, filename), root)
+            base, suffix = os.path.splitext(filename)
+            if suffix in SUFFIXES:
+                compressed = os.path.splitext(name)[0].replace(os.sep, '/')
+                if compressed in old_hashes:
+                    if base not in present or suffix not in available:
+                        os.unlink(os.path.join(root, name))
+                    continue
+                if (base in present and
+                        not base.endswith(COMPRESSED_EXTENSIONS)):
+                    continue
+            files.append(name)
+    return sorted(name for name in files if name != HASHES_FILE)
+
+
+def _load_hashes(root):
+    try:
+        with open(os.path.join(root, HASHES_FILE)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def compress_output(jobs=1):
+    """Compress the files in the static site, with jobs processes.
+
+       Returns the number of files compressed and the number which were
+       unchanged."""
+    root = settings.MEDUSA_DEPLOY_DIR
+    old_hashes = _load_hashes(root)
+    suffixes = [suffix for suffix, _ in get_compressors()]
+    hashes = {}
+    # hash -> names of the files which need compressing
+    groups = {}
+    # hash -> an unchanged file, whose compressed copies can be reused
+    sources = {}
+    unchanged = 0
+    for name in _find_files(root, old_hashes):
+        path = os.path.join(root, name)
+        key = name.replace(os.sep, '/')
+        hashes[key] = digest = _hash_file(path)
+        if name.endswith(COMPRESSED_EXTENSIONS):
+            continue
+        if (old_hashes.get(key) == digest and
+                all(os.path.exists(path + suffix) for suffix in suffixes)):
+            sources[digest] = path
+            unchanged += 1
+        else:
+            groups.setdefault(digest, []).append(path)
+    tasks = [(sources.get(digest), names)
+             for digest, names in groups.items()]
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            compressed = sum(pool.map(_compress_group, tasks))
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        compressed = sum(_compress_group(task) for task in tasks)
+    _replace(os.path.join(root, HASHES_FILE),
+             json.dumps(hashes, indent=1, sort_keys=True).encode('utf-8'))
+    return compressed, unchanged
@@ -22,7 +22,13 @@ class WaferDiskStaticSiteRenderer(DiskStaticSiteRenderer):
             # This is a hack because dajngo_medusa doens't understand 301
             if path == '/':
                 DEPLOY_DIR = settings.MEDUSA_DEPLOY_DIR
-                # Also copy to index, as specified by the pages url
+                # Also link to index, as specified by the pages url
                 outpath = os.path.join(DEPLOY_DIR, 'index')
                 inpath = os.path.join(DEPLOY_DIR, 'index.html')
-                shutil.copyfile(inpath, outpath)
+                if os.path.exists(outpath):
+                    os.unlink(outpath)
+                try:
+                    os.link(inpath, outpath)
+                except OSError:
+                    # Hard links aren't supported everywhere
+                    shutil.copyfile(inpath, outpath)
@@ -1,27 +1,62 @@
 import copy
+import uuid
 
-from django.core.cache import cache
+from django.core.cache import caches
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils import six
 
 CACHE_KEY = "WAFER_MENU_CACHE"
+VERSION_KEY = "WAFER_MENU_VERSION"
+
+# The (version, items) of the menus last used by this process. The
+# version is kept in the WAFER_CACHE, so changes made by any process
+# invalidate it.
+_local_menus = None
+
+
+def _get_menu_version():
+    cache = caches[settings.WAFER_CACHE]
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = _new_menu_version()
+    return version
+
+
+def _new_menu_version():
+    version = uuid.uuid4().hex
+    cache = caches[settings.WAFER_CACHE]
+    cache.set(VERSION_KEY, version, None)
+    return version
 
 
 def get_cached_menus():
-    """Return the menus from the cache or generate them if needed."""
-    items = cache.get(CACHE_KEY)
-    if items is None:
-        menu = generate_menu()
-        cache.set(CACHE_KEY, menu.items)
+    """Return the menus from the cache or generate them if needed.
+
+    The menus are kept in this process until the version in the
+    WAFER_CACHE changes. They are then fetched from the WAFER_CACHE, so
+    they're only generated once for each version. Each caller gets its
+    own copy, which it's free to change.
+    """
+    global _local_menus
+    version = _get_menu_version()
+    if _local_menus is not None and _local_menus[0] == version:
+        return Menu(copy.deepcopy(_local_menus[1]))
+    cache = caches[settings.WAFER_CACHE]
+    cached = cache.get(CACHE_KEY)
+    if cached is not None and cached[0] == version:
+        items = cached[1]
     else:
-        menu = Menu(items)
-    return menu
+        items = generate_menu().items
+        cache.set(CACHE_KEY, (version, items), None)
+    _local_menus = (version, items)
+    return Menu(copy.deepcopy(items))
 
 
 def clear_menu_cache():
-    """Clear the cached version of the menu (if any)."""
-    cache.delete(CACHE_KEY)
+    """Clear the cached version of the menu (if any), in all the
+    processes."""
+    _new_menu_version()
 
 
 def refresh_menu_cache(**kwargs):
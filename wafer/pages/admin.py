@@ -1,11 +1,36 @@
 from django.contrib import admin
+from django.utils.translation import ugettext_lazy as _
 
 from wafer.pages.models import File, Page
 
 
+class ScheduleListFilter(admin.SimpleListFilter):
+    title = _('in schedule')
+    parameter_name = 'schedule'
+
+    def lookups(self, request, model_admin):
+        return (
+            ('in', _('Allocated to schedule')),
+            ('out', _('Not allocated')),
+            )
+
+    def queryset(self, request, queryset):
+        # The queryset is annotated by PageAdmin.get_queryset
+        if self.value() == 'in':
+            return queryset.filter(num_schedule_items__gt=0)
+        elif self.value() == 'out':
+            return queryset.filter(num_schedule_items=0)
+        return queryset
+
+
 class PageAdmin(admin.ModelAdmin):
     prepopulated_fields = {"slug": ("name",)}
     list_display = ('name', 'slug', 'get_people_display_names', 'get_in_schedule')
+    list_filter = (ScheduleListFilter,)
+
+    def get_queryset(self, request):
+        qs = super(PageAdmin, self).get_queryset(request)
+        return qs.with_counts().prefetch_related('people__userprofile')
 
 
 admin.site.register(Page, PageAdmin)
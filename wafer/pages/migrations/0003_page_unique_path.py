@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0002_page_people'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='page',
+            unique_together=set([('parent', 'slug')]),
+        ),
+    ]
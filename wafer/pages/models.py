@@ -4,13 +4,15 @@ logger = logging.getLogger(__name__)
 from django.utils.translation import ugettext_lazy as _
 from django.core.urlresolvers import reverse
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.utils.encoding import python_2_unicode_compatible
 
 
 from markitup.fields import MarkupField
 from wafer.menu import MenuError, refresh_menu_cache
+from wafer.utils import cache_result
 
 
 @python_2_unicode_compatible
@@ -24,6 +26,16 @@ class File(models.Model):
         return u'%s' % (self.name,)
 
 
+class PageQuerySet(models.QuerySet):
+
+    def with_counts(self):
+        """Annotate the pages with the number of schedule items
+           (num_schedule_items), so get_in_schedule doesn't need a query
+           per page."""
+        return self.annotate(
+            num_schedule_items=models.Count('scheduleitem', distinct=True))
+
+
 @python_2_unicode_compatible
 class Page(models.Model):
     """An extra page for the site."""
@@ -49,24 +61,30 @@ class Page(models.Model):
         help_text=_("People associated with this page for display in the"
                     " schedule (Session chairs, panelists, etc.)"))
 
+    objects = PageQuerySet.as_manager()
+
     def __str__(self):
         return u'%s' % (self.name,)
 
     def get_path(self):
-        path, parent = [self.slug], self.parent
-        while parent is not None:
-            path.insert(0, parent.slug)
-            parent = parent.parent
-        return path
+        if self.parent_id is None:
+            return [self.slug]
+        # The ancestors come from the cache, rather than a query per
+        # level, but we use our own slug, in case it's been changed
+        parent_path = get_page_paths()['by_id'].get(self.parent_id)
+        if parent_path is None:
+            # Not in the cache (yet), so walk the tree
+            parent_path = self.parent.get_path()
+        return parent_path + [self.slug]
 
     def get_absolute_url(self):
         url = "/".join(self.get_path())
         return reverse('wafer_page', args=(url,))
 
     def get_in_schedule(self):
-        if self.scheduleitem_set.all():
-            return True
-        return False
+        if hasattr(self, 'num_schedule_items'):
+            return self.num_schedule_items > 0
+        return self.scheduleitem_set.exists()
 
     def get_people_display_names(self):
         names = [person.userprofile.display_name()
@@ -79,13 +97,69 @@ class Page(models.Model):
 
     get_in_schedule.short_description = 'Added to schedule'
     get_in_schedule.boolean = True
+    get_in_schedule.admin_order_field = 'num_schedule_items'
 
     get_people_display_names.short_description = 'People'
 
-    class Model:
+    def validate_unique(self, exclude=None):
+        """Ensure top level pages have different slugs, too.
+
+           unique_together doesn't cover them, since their parents are
+           all NULL."""
+        super(Page, self).validate_unique(exclude=exclude)
+        if exclude and ('slug' in exclude or 'parent' in exclude):
+            return
+        if self.parent_id is None:
+            pages = Page.objects.filter(parent=None, slug=self.slug)
+            if self.pk is not None:
+                pages = pages.exclude(pk=self.pk)
+            if pages.exists():
+                raise ValidationError({'slug': _(
+                    "There is already a top level page with this slug.")})
+
+    class Meta:
         unique_together = (('parent', 'slug'),)
 
 
+@cache_result('wafer_page_paths', 60*60)
+def get_page_paths():
+    """Return the paths of all the pages, built with a single query.
+
+       The result is a dictionary with by_id (page id -> list of slugs)
+       and by_path (the slugs joined with '/' -> page id). Paths shared
+       by several pages, such as top level pages created with the same
+       slug without being validated, map to None."""
+    pages = dict((page_id, (parent_id, slug)) for page_id, parent_id, slug
+                 in Page.objects.values_list('id', 'parent_id', 'slug'))
+    by_id = {}
+
+    def build(page_id, seen):
+        if page_id not in by_id:
+            parent_id, slug = pages[page_id]
+            if parent_id is None or parent_id in seen:
+                # seen guards against loops in the tree
+                by_id[page_id] = [slug]
+            else:
+                seen.add(page_id)
+                by_id[page_id] = build(parent_id, seen) + [slug]
+        return by_id[page_id]
+
+    for page_id in pages:
+        build(page_id, set())
+    by_path = {}
+    for page_id, path in by_id.items():
+        path = '/'.join(path)
+        by_path[path] = None if path in by_path else page_id
+    return {'by_id': by_id, 'by_path': by_path}
+
+
+def invalidate_page_paths(**kwargs):
+    """Clear the cached page paths.
+
+       Takes **kwargs, so it can be used as a signal handler."""
+    get_page_paths.invalidate()
+
+
 def page_menus(root_menu):
     """Add page menus."""
     for page in Page.objects.filter(include_in_menu=True):
@@ -98,4 +172,7 @@ def page_menus(root_menu):
                          % (e, page.slug))
 
 
+post_save.connect(invalidate_page_paths, sender=Page)
+post_delete.connect(invalidate_page_paths, sender=Page)
 post_save.connect(refresh_menu_cache, sender=Page)
+post_delete.connect(refresh_menu_cache, sender=Page)
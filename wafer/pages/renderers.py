@@ -1,21 +1,40 @@
 from django_medusa.renderers import StaticSiteRenderer
-from wafer.pages.models import Page
+from wafer.pages.models import File, Page, get_page_paths
+from wafer.utils import reverse_formatter
 
 
 class PagesRenderer(StaticSiteRenderer):
-    def get_paths(self):
-        paths = []
+    def _iter_pages(self):
+        """Yield (url, page id) for the pages in the static site.
 
-        items = Page.objects.all()
-        for item in items:
-            if item.exclude_from_static:
-                # Container page
-                continue
-            url = item.get_absolute_url()
+           The urls are built from the cached page paths, so the pages
+           aren't loaded."""
+        page_url = reverse_formatter('wafer_page')
+        paths = get_page_paths()['by_id']
+        # Container pages are excluded
+        items = (Page.objects.filter(exclude_from_static=False)
+                 .values_list('id', flat=True))
+        for page_id in items.iterator():
+            if page_id not in paths:
+                # The page was added without sending post_save
+                get_page_paths.invalidate()
+                paths = get_page_paths()['by_id']
+            url = page_url('/'.join(paths[page_id]))
             # FIXME: Can we introspect this easily from urls?
             if url == '/index' or url == '/index.html':
                 url = '/'
-            paths.append(url)
-        return paths
+            yield url, page_id
+
+    def iter_paths(self):
+        for url, _ in self._iter_pages():
+            yield url
+
+    def get_paths(self):
+        return list(self.iter_paths())
+
+    def get_dependencies(self):
+        # Pages can link to any of the files
+        return dict((url, [(Page, page_id), File])
+                    for url, page_id in self._iter_pages())
 
 renderers = [PagesRenderer, ]
@@ -4,8 +4,11 @@ from django.test import Client, TestCase
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 
 from wafer.pages.models import Page
+from wafer.utils import QueryTracker
 
 
 class PageEditTests(TestCase):
@@ -88,3 +91,61 @@ class PageEditTests(TestCase):
         templates = [x.name for x in response.templates]
         self.assertTrue('wafer.pages/page_form.html' in templates)
         self.assertEqual(response.status_code, 200)
+
+
+class PageModelTests(TestCase):
+
+    def test_unique_path(self):
+        """Pages with the same parent must have different slugs."""
+        parent = Page.objects.create(name="parent", slug="parent")
+        Page.objects.create(name="child", slug="child", parent=parent)
+        # The same slug is fine under a different parent
+        Page.objects.create(name="child", slug="child")
+        with transaction.atomic():
+            self.assertRaises(IntegrityError, Page.objects.create,
+                              name="child 2", slug="child", parent=parent)
+
+    def test_unique_root_path(self):
+        """Top level pages must have different slugs too."""
+        page = Page.objects.create(name="page", slug="page")
+        page.full_clean()
+        other = Page(name="other", slug="page")
+        self.assertRaises(ValidationError, other.full_clean)
+        # unique_together doesn't catch this, since the parents are NULL
+        other.save()
+        c = Client()
+        self.assertRaises(Page.MultipleObjectsReturned, c.get, '/page')
+        other.slug = 'other'
+        other.save()
+        self.assertEqual(c.get('/page').context['object'], page)
+
+    def test_paths(self):
+        """Check the page paths, and that they don't need a query per
+           level."""
+        a = Page.objects.create(name="a", slug="a")
+        b = Page.objects.create(name="b", slug="b", parent=a)
+        c = Page.objects.create(name="c", slug="c", parent=b)
+        self.assertEqual(c.get_absolute_url(), '/a/b/c')
+        c = Page.objects.get(pk=c.pk)
+        with QueryTracker() as tracker:
+            self.assertEqual(c.get_path(), ['a', 'b', 'c'])
+            # Only the cache lookup
+            self.assertEqual(len(tracker.queries), 1)
+        # Changing an ancestor updates the paths
+        a.slug = 'z'
+        a.save()
+        self.assertEqual(c.get_absolute_url(), '/z/b/c')
+        b.delete()
+        self.assertEqual(a.get_absolute_url(), '/z')
+
+    def test_resolve(self):
+        a = Page.objects.create(name="a", slug="a")
+        b = Page.objects.create(name="b", slug="b", parent=a)
+        Page.objects.create(name="b", slug="b")
+        c = Client()
+        response = c.get('/a/b')
+        self.assertEqual(response.context['object'], b)
+        response = c.get('/a/c')
+        self.assertEqual(response.status_code, 404)
+        response = c.get('/b/a')
+        self.assertEqual(response.status_code, 404)
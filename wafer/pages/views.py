@@ -2,7 +2,7 @@ from django.http import Http404
 from django.core.exceptions import PermissionDenied
 from django.views.generic import DetailView, TemplateView, UpdateView
 
-from wafer.pages.models import Page
+from wafer.pages.models import Page, get_page_paths
 from wafer.pages.forms import PageForm
 
 
@@ -19,18 +19,19 @@ class EditPage(UpdateView):
 
 def slug(request, url):
     """Look up a page by url (which is a tree of slugs)"""
-    page = None
-    for slug in url.split('/'):
-        if not slug:
-            continue
-        try:
-            page = Page.objects.get(slug=slug, parent=page)
-        except Page.DoesNotExist:
+    path = '/'.join(slug for slug in url.split('/') if slug)
+    if path:
+        by_path = get_page_paths()['by_path']
+        if path not in by_path:
             raise Http404
-
-    if page is None:
+        page_id = by_path[path]
+        if page_id is None:
+            raise Page.MultipleObjectsReturned(
+                "More than one page has the path %r" % path)
+    else:
         try:
-            page = Page.objects.get(slug='index')
+            page_id = Page.objects.values_list('id', flat=True).get(
+                slug='index')
         except Page.DoesNotExist:
             return TemplateView.as_view(
                 template_name='wafer/index.html')(request)
@@ -38,6 +39,6 @@ def slug(request, url):
     if 'edit' in request.GET:
         if not request.user.has_perm('pages.change_page'):
             raise PermissionDenied
-        return EditPage.as_view()(request, pk=page.id)
+        return EditPage.as_view()(request, pk=page_id)
 
-    return ShowPage.as_view()(request, pk=page.id)
+    return ShowPage.as_view()(request, pk=page_id)
@@ -0,0 +1 @@
+default_app_config = 'wafer.schedule.apps.ScheduleConfig'
@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class ScheduleConfig(AppConfig):
+    name = 'wafer.schedule'
+    label = 'schedule'
+
+    def ready(self):
+        # Connect the signal handlers which keep the schedule validation
+        # up to date
+        import wafer.schedule.validation  # noqa
@@ -0,0 +1,121 @@
+"""Export the schedule as iCalendar (RFC 5545) feeds.
+
+The events are generated once from a ScheduleGrid. The whole schedule,
+venue and speaker feeds are then just different selections of these
+events.
+"""
+
+import datetime
+
+import pytz
+
+from django.utils import timezone
+
+
+def escape(text):
+    """Escape text for use in a property value."""
+    return (text.replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\r\n', '\\n')
+            .replace('\n', '\\n'))
+
+
+def fold(line):
+    """Fold a content line, so no line is longer than 75 octets."""
+    octets = line.encode('utf-8')
+    lines = []
+    limit = 75
+    while len(octets) > limit:
+        cut = limit
+        # Don't split utf-8 sequences
+        while octets[cut:cut + 1] and (ord(octets[cut:cut + 1]) & 0xC0
+                                       == 0x80):
+            cut -= 1
+        lines.append(octets[:cut])
+        octets = octets[cut:]
+        # The continuation lines start with a space
+        limit = 74
+    lines.append(octets)
+    return b'\r\n '.join(lines)
+
+
+def format_datetime(value):
+    """Format an aware datetime in UTC."""
+    return value.astimezone(pytz.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+class CalendarEvents(object):
+    """The schedule items as iCalendar events.
+
+       grid is the ScheduleGrid for the schedule, or None for an empty
+       schedule. site provides the conference name and domain, for the
+       event uids and urls. stamp is the time the schedule was last
+       modified."""
+
+    def __init__(self, grid, site, stamp):
+        self.name = site.name
+        tz = timezone.get_default_timezone()
+        # item pk -> [item, first slot, last slot]
+        items = {}
+        slots = grid.slots if grid is not None else []
+        for slot in slots:
+            for item in grid.get_items(slot):
+                if item.pk not in items:
+                    items[item.pk] = [item, slot, slot]
+                else:
+                    items[item.pk][2] = slot
+        # (venue pk, speaker usernames, event lines)
+        self.events = []
+        for pk in sorted(items):
+            item, first, last = items[pk]
+            start = timezone.make_aware(datetime.datetime.combine(
+                first.get_day().date, first.get_start_time()), tz)
+            end = timezone.make_aware(datetime.datetime.combine(
+                last.get_day().date, last.end_time), tz)
+            speakers = []
+            if item.talk:
+                speakers = list(item.talk.authors.all())
+            elif item.page:
+                speakers = list(item.page.people.all())
+            lines = [
+                'BEGIN:VEVENT',
+                'UID:schedule-item-%d@%s' % (item.pk, site.domain),
+                'DTSTAMP:%s' % format_datetime(stamp),
+                'DTSTART:%s' % format_datetime(start),
+                'DTEND:%s' % format_datetime(end),
+                'SUMMARY:%s' % escape(item.get_details()),
+                'LOCATION:%s' % escape(item.venue.name),
+            ]
+            if speakers:
+                lines.append('DESCRIPTION:%s' % escape(', '.join(
+                    person.userprofile.display_name()
+                    for person in speakers)))
+            url = item.get_url()
+            if url:
+                lines.append('URL:https://%s%s' % (site.domain, url))
+            lines.append('END:VEVENT')
+            self.events.append((
+                item.venue_id,
+                set(person.username for person in speakers),
+                b'\r\n'.join(fold(line) for line in lines)))
+
+    def render(self, name=None, venue=None, speaker=None):
+        """Return the calendar (as utf-8 encoded bytes) of the events,
+           restricted to those in venue (a pk) or by speaker (a
+           username) if given."""
+        title = self.name
+        if name:
+            title = u'%s: %s' % (self.name, name)
+        lines = [
+            fold('BEGIN:VCALENDAR'),
+            fold('VERSION:2.0'),
+            fold('PRODID:-//wafer//schedule//EN'),
+            fold('X-WR-CALNAME:%s' % escape(title)),
+        ]
+        for venue_id, speakers, event in self.events:
+            if venue is not None and venue_id != venue:
+                continue
+            if speaker is not None and speaker not in speakers:
+                continue
+            lines.append(event)
+        lines.append(fold('END:VCALENDAR'))
+        return b'\r\n'.join(lines) + b'\r\n'
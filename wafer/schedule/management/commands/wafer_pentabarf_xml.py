@@ -0,0 +1,36 @@
+import sys
+from optparse import make_option
+
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand
+
+from wafer.schedule.admin import check_schedule
+from wafer.schedule.pentabarf import PentabarfExporter
+from wafer.schedule.views import ScheduleGrid
+
+
+class Command(BaseCommand):
+    help = ("Export the schedule in the pentabarf XML format. The speakers'"
+            " contact details are only included if --contact is given.")
+
+    args = '[output file (default stdout)]'
+
+    option_list = BaseCommand.option_list + tuple([
+        make_option('--contact', action='store_true', default=False,
+                    help="Include the speakers' contact details"),
+    ])
+
+    def handle(self, *args, **options):
+        grid = None
+        if check_schedule():
+            grid = ScheduleGrid()
+        else:
+            self.stderr.write("The schedule is not valid, so it will be"
+                              " empty")
+        exporter = PentabarfExporter(grid, Site.objects.get_current(),
+                                     include_contact=options['contact'])
+        if args:
+            with open(args[0], 'wb') as f:
+                exporter.write(f)
+        else:
+            exporter.write(getattr(sys.stdout, 'buffer', sys.stdout))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from wafer.schedule.models import rebuild_slot_timeline
+
+
+class Command(BaseCommand):
+    help = ("Recalculate the effective day and start time of all the slots."
+            " This is needed after loading slots with loaddata or"
+            " editing them directly in the database.")
+
+    def handle(self, *args, **options):
+        updated = rebuild_slot_timeline()
+        self.stdout.write("Updated %d slots" % updated)
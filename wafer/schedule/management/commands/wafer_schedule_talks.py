@@ -0,0 +1,28 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from wafer.schedule.solver import ScheduleSolver
+
+
+class Command(BaseCommand):
+    help = ("Place the accepted talks which aren't in the schedule into the"
+            " free slots, avoiding clashes between speakers.")
+
+    option_list = BaseCommand.option_list + tuple([
+        make_option('--dry-run', action='store_true', default=False,
+                    help="Show where talks would be placed, without"
+                    " changing the schedule"),
+    ])
+
+    def handle(self, *args, **options):
+        result = ScheduleSolver().solve()
+        for talk, venue, slot in result.placed:
+            self.stdout.write(u'%s: %s, %s' % (talk.title, venue, slot))
+        for talk, reason in result.unplaced:
+            self.stdout.write(u'Could not place %s: %s' % (talk.title,
+                                                           reason))
+        if not options['dry_run']:
+            result.apply()
+        self.stdout.write("Placed %d talks, %d could not be placed" % (
+            len(result.placed), len(result.unplaced)))
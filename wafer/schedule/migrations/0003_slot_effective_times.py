@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+def resolve_slot_times(apps, schema_editor):
+    """Fill in the effective day and start time of the existing slots."""
+    Slot = apps.get_model('schedule', 'Slot')
+    following = {}
+    slots = {}
+    for slot in Slot.objects.all():
+        slots[slot.pk] = slot
+        following.setdefault(slot.previous_slot_id, []).append(slot.pk)
+    todo = [(pk, slots[pk].day_id, slots[pk].start_time)
+            for pk in following.get(None, [])]
+    while todo:
+        pk, day_id, start = todo.pop()
+        Slot.objects.filter(pk=pk).update(effective_day=day_id,
+                                          effective_start_time=start)
+        todo.extend((next_pk, day_id, slots[pk].end_time)
+                    for next_pk in following.get(pk, []))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0002_auto_20140909_1403'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slot',
+            name='effective_day',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.PROTECT, blank=True, editable=False, to='schedule.Day', null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='slot',
+            name='effective_start_time',
+            field=models.TimeField(db_index=True, null=True, editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(resolve_slot_times,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+def mark_stale(apps, schema_editor):
+    """Existing schedules need to be validated in full once."""
+    Slot = apps.get_model('schedule', 'Slot')
+    ScheduleItem = apps.get_model('schedule', 'ScheduleItem')
+    ScheduleFinding = apps.get_model('schedule', 'ScheduleFinding')
+    if Slot.objects.exists() or ScheduleItem.objects.exists():
+        ScheduleFinding.objects.create(rule='stale')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0003_slot_effective_times'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleFinding',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('rule', models.CharField(max_length=32, choices=[('clashes', 'Clash'), ('duplicates', 'Duplicate'), ('validation', 'Validation error'), ('overlaps', 'Overlapping slot'), ('non_contiguous', 'Non-contiguous slots'), ('venues', 'Venue not available'), ('stale', 'Needs revalidation')])),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, blank=True, to='schedule.ScheduleItem', null=True)),
+                ('slot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, blank=True, to='schedule.Slot', null=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.RunPython(mark_stale, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+def mark_stale(apps, schema_editor):
+    """Existing schedules need to be checked for double-booked speakers."""
+    ScheduleItem = apps.get_model('schedule', 'ScheduleItem')
+    ScheduleFinding = apps.get_model('schedule', 'ScheduleFinding')
+    if (ScheduleItem.objects.exists() and
+            not ScheduleFinding.objects.filter(rule='stale').exists()):
+        ScheduleFinding.objects.create(rule='stale')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('schedule', '0004_schedulefinding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schedulefinding',
+            name='person',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, blank=True, to=settings.AUTH_USER_MODEL, null=True),
+        ),
+        migrations.AlterField(
+            model_name='schedulefinding',
+            name='rule',
+            field=models.CharField(max_length=32, choices=[('clashes', 'Clash'), ('duplicates', 'Duplicate'), ('validation', 'Validation error'), ('overlaps', 'Overlapping slot'), ('non_contiguous', 'Non-contiguous slots'), ('venues', 'Venue not available'), ('speakers', 'Speaker double-booked'), ('stale', 'Needs revalidation')]),
+        ),
+        migrations.RunPython(mark_stale, migrations.RunPython.noop),
+    ]
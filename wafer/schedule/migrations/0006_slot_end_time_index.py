@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0005_schedulefinding_person'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='slot',
+            name='end_time',
+            field=models.TimeField(help_text='Slot end time', null=True, db_index=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='slot',
+            index_together=set([('effective_day', 'end_time')]),
+        ),
+    ]
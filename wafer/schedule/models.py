@@ -1,16 +1,24 @@
 import datetime
+import threading
+import uuid
 
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.core.cache import caches
 from django.utils.translation import ugettext_lazy as _
 from django.core.urlresolvers import reverse
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models.signals import post_save, post_delete
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 
 from wafer.snippets.markdown_field import MarkdownTextField
 
-from wafer.talks.models import Talk
+from wafer.talks.models import Talk, TalkType
 from wafer.pages.models import Page
+from wafer.users.models import UserProfile
 
 
 @python_2_unicode_compatible
@@ -67,15 +75,27 @@ class Slot(models.Model):
     start_time = models.TimeField(null=True, blank=True,
                                   help_text=_("Start time (if no"
                                               " previous slot)"))
-    end_time = models.TimeField(null=True, help_text=_("Slot end time"))
+    end_time = models.TimeField(null=True, db_index=True,
+                                help_text=_("Slot end time"))
 
     name = models.CharField(max_length=1024, null=True, blank=True,
                             help_text=_("Identifier for use in the admin"
                                         " panel"))
 
+    # The day and start time of the slot, resolved by following the
+    # previous_slot chain. These are maintained by save(), so we
+    # don't need to walk the chain when displaying the schedule.
+    effective_day = models.ForeignKey(Day, null=True, blank=True,
+                                      editable=False, related_name='+',
+                                      on_delete=models.PROTECT)
+    effective_start_time = models.TimeField(null=True, blank=True,
+                                            editable=False, db_index=True)
+
     class Meta:
         order_with_respect_to = 'day'
         ordering = ['day', 'end_time', 'start_time']
+        # The schedule views list the slots for a day by end time
+        index_together = [('effective_day', 'end_time')]
 
     def __str__(self):
         if self.name:
@@ -87,9 +107,7 @@ class Slot(models.Model):
         return u'%s: %s: %s - %s' % (slot, self.get_day(), start, end)
 
     def get_start_time(self):
-        if self.previous_slot:
-            return self.previous_slot.end_time
-        return self.start_time
+        return self.effective_start_time
 
     def get_duration(self):
         """Return the duration of the slot as hours and minutes.
@@ -105,19 +123,103 @@ class Slot(models.Model):
         return result
 
     def get_day(self):
-        if self.previous_slot:
-            return self.previous_slot.get_day()
-        return self.day
+        return self.effective_day
+
+    def resolve_timeline(self):
+        """Set the effective day and start time from the previous slot
+           (or our own day and start time if there's no previous slot)."""
+        if self.previous_slot_id is not None:
+            self.effective_day = self.previous_slot.effective_day
+            self.effective_start_time = self.previous_slot.end_time
+        else:
+            self.effective_day = self.day
+            self.effective_start_time = self.start_time
+
+    def save(self, *args, **kwargs):
+        """Save the slot, and update the resolved timeline for all the
+           slots which follow it."""
+        self.resolve_timeline()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | set(
+                ['effective_day', 'effective_start_time'])
+        with transaction.atomic():
+            # The following slots only depend on our end time and day, so
+            # we update them first. This ensures the timeline is
+            # consistent by the time the post_save signal is sent.
+            if self.pk is not None:
+                update_following_slots(self)
+            super(Slot, self).save(*args, **kwargs)
 
     def clean(self):
         """Ensure we have start_time < end_time"""
         if not self.previous_slot and not self.start_time:
             raise ValidationError("Slots must have a start time"
                                   " or previous slot set")
+        self.resolve_timeline()
         if self.get_start_time() >= self.end_time:
             raise ValidationError("Start time must be before end time")
 
 
+def update_following_slots(slot):
+    """Update the resolved timeline for the slots following the given slot.
+
+       We walk down the previous_slot chain a level at a time, and stop
+       following a branch once we reach a slot that is already correct.
+       Deleting a slot deletes the slots that follow it, so this is only
+       needed when saving."""
+    ends = {slot.pk: slot.end_time}
+    day_id = slot.effective_day_id
+    seen = set([slot.pk])
+    while ends:
+        following = Slot.objects.filter(
+            previous_slot__in=list(ends)).values_list(
+            'pk', 'previous_slot_id', 'end_time', 'effective_day_id',
+            'effective_start_time')
+        next_ends = {}
+        for pk, prev_id, end_time, cur_day_id, cur_start in following:
+            if pk in seen:
+                # previous_slot loop
+                continue
+            seen.add(pk)
+            start = ends[prev_id]
+            if cur_day_id == day_id and cur_start == start:
+                # Everything after this is already up to date
+                continue
+            Slot.objects.filter(pk=pk).update(effective_day=day_id,
+                                              effective_start_time=start)
+            next_ends[pk] = end_time
+        ends = next_ends
+
+
+def rebuild_slot_timeline():
+    """Recalculate the effective day and start time of every slot.
+
+       Returns the number of slots that needed to be updated."""
+    slots = {}
+    following = {}
+    for values in Slot.objects.values_list(
+            'pk', 'previous_slot_id', 'day_id', 'start_time', 'end_time',
+            'effective_day_id', 'effective_start_time'):
+        slots[values[0]] = values
+        following.setdefault(values[1], []).append(values[0])
+    updated = 0
+    with transaction.atomic():
+        # Start from the slots without a previous slot, and work along
+        # the chains. Slots in a previous_slot loop are never reached
+        todo = [(pk, slots[pk][2], slots[pk][3])
+                for pk in following.get(None, [])]
+        while todo:
+            pk, day_id, start = todo.pop()
+            _, _, _, _, end, cur_day_id, cur_start = slots[pk]
+            if (cur_day_id, cur_start) != (day_id, start):
+                Slot.objects.filter(pk=pk).update(
+                    effective_day=day_id, effective_start_time=start)
+                updated += 1
+            todo.extend((next_pk, day_id, end)
+                        for next_pk in following.get(pk, []))
+    return updated
+
+
 @python_2_unicode_compatible
 class ScheduleItem(models.Model):
 
@@ -204,9 +306,118 @@ class ScheduleItem(models.Model):
         return result
 
 
+@python_2_unicode_compatible
+class ScheduleFinding(models.Model):
+    """A problem with the schedule, found by the schedule validation.
+
+       These are kept up to date incrementally as the schedule is edited
+       (see wafer.schedule.validation), so checking whether the schedule
+       is valid doesn't require validating the whole schedule."""
+
+    # The rule names match the keys used for the errors in the admin
+    CLASHES = 'clashes'
+    DUPLICATES = 'duplicates'
+    VALIDATION = 'validation'
+    OVERLAPS = 'overlaps'
+    NON_CONTIGUOUS = 'non_contiguous'
+    VENUES = 'venues'
+    SPEAKERS = 'speakers'
+    # Marks the findings as out of date (after loading fixtures, etc.)
+    STALE = 'stale'
+
+    RULES = (
+        (CLASHES, _('Clash')),
+        (DUPLICATES, _('Duplicate')),
+        (VALIDATION, _('Validation error')),
+        (OVERLAPS, _('Overlapping slot')),
+        (NON_CONTIGUOUS, _('Non-contiguous slots')),
+        (VENUES, _('Venue not available')),
+        (SPEAKERS, _('Speaker double-booked')),
+        (STALE, _('Needs revalidation')),
+    )
+
+    rule = models.CharField(max_length=32, choices=RULES)
+    item = models.ForeignKey(ScheduleItem, null=True, blank=True,
+                             on_delete=models.CASCADE)
+    slot = models.ForeignKey(Slot, null=True, blank=True,
+                             on_delete=models.CASCADE)
+    # The speaker, for double-booked speakers
+    person = models.ForeignKey(settings.AUTH_USER_MODEL, null=True,
+                               blank=True, on_delete=models.CASCADE)
+
+    def __str__(self):
+        return u'%s: %s' % (self.get_rule_display(), self.item or self.slot)
+
+
+SCHEDULE_VERSION_KEY = 'wafer_schedule_version'
+
+
+def _get_schedule_stamp():
+    cache = caches[settings.WAFER_CACHE]
+    stamp = cache.get(SCHEDULE_VERSION_KEY)
+    if stamp is None:
+        stamp = _new_schedule_stamp()
+    return stamp
+
+
+def _new_schedule_stamp():
+    # The modification time is truncated to match the resolution of the
+    # Last-Modified header
+    stamp = (uuid.uuid4().hex, timezone.now().replace(microsecond=0))
+    cache = caches[settings.WAFER_CACHE]
+    cache.set(SCHEDULE_VERSION_KEY, stamp, None)
+    return stamp
+
+
+def get_schedule_version():
+    """Return the current version of the schedule.
+
+       This changes whenever the schedule changes, so it can be used in
+       the cache keys for anything rendered from the schedule."""
+    return _get_schedule_stamp()[0]
+
+
+def get_schedule_last_modified():
+    """Return the time the schedule was last changed.
+
+       If the version has been dropped from the cache, this is the time
+       a new version was started."""
+    return _get_schedule_stamp()[1]
+
+
+def bump_schedule_version(*args, **kw):
+    """Start a new version of the schedule."""
+    return _new_schedule_stamp()[0]
+
+
+def _people_changed(sender, action, **kw):
+    if action.startswith('post_'):
+        bump_schedule_version()
+
+
+def _shown_object_saved(sender, created, update_fields=None, **kw):
+    # New objects can't have been shown yet. The default site is created
+    # by migrate, and users may be, before the cache table exists.
+    if created:
+        return
+    # Logging in only updates last_login, which isn't shown
+    if update_fields and set(update_fields) == set(['last_login']):
+        return
+    bump_schedule_version()
+
+
+# Tracks changes to the schedule that are being made in bulk. See
+# wafer.schedule.validation.deferred_validation
+deferred_updates = threading.local()
+
+
 def invalidate_check_schedule(*args, **kw):
+    if getattr(deferred_updates, 'depth', 0):
+        deferred_updates.invalidate = True
+        return
     from wafer.schedule.admin import check_schedule
     check_schedule.invalidate()
+    bump_schedule_version()
 
 
 post_save.connect(invalidate_check_schedule, sender=Day)
@@ -218,3 +429,20 @@ post_delete.connect(invalidate_check_schedule, sender=Day)
 post_delete.connect(invalidate_check_schedule, sender=Venue)
 post_delete.connect(invalidate_check_schedule, sender=Slot)
 post_delete.connect(invalidate_check_schedule, sender=ScheduleItem)
+
+# The rendered schedule includes the talk and page titles, the talk
+# types, the names of the speakers and the site
+post_save.connect(bump_schedule_version, sender=Talk)
+post_save.connect(bump_schedule_version, sender=Page)
+post_save.connect(_shown_object_saved, sender=TalkType)
+post_save.connect(_shown_object_saved, sender=User)
+post_save.connect(_shown_object_saved, sender=UserProfile)
+post_save.connect(_shown_object_saved, sender=Site)
+post_delete.connect(bump_schedule_version, sender=Talk)
+post_delete.connect(bump_schedule_version, sender=Page)
+post_delete.connect(bump_schedule_version, sender=TalkType)
+post_delete.connect(bump_schedule_version, sender=User)
+post_delete.connect(bump_schedule_version, sender=UserProfile)
+post_delete.connect(bump_schedule_version, sender=Site)
+m2m_changed.connect(_people_changed, sender=Talk.authors.through)
+m2m_changed.connect(_people_changed, sender=Page.people.through)
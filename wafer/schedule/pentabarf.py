@@ -0,0 +1,183 @@
+"""Export the schedule in the pentabarf XML format.
+
+This is the format used by ConfClerk, Giggity and similar apps. The
+schedule is walked once, and the XML is generated incrementally, so it
+can be streamed to the client or written to a file.
+"""
+
+import io
+from xml.sax.saxutils import XMLGenerator
+
+
+class PentabarfExporter(object):
+    """Generate the pentabarf XML for the schedule.
+
+       grid is the ScheduleGrid for the schedule, or None for an empty
+       schedule. site provides the conference name and domain.
+       include_contact adds the speakers' contact details, which should
+       only be shown to staff."""
+
+    def __init__(self, grid, site, include_contact=False):
+        self.grid = grid
+        self.site = site
+        self.include_contact = include_contact
+
+    def write(self, out):
+        """Write the XML to the binary file out."""
+        for chunk in self.generate():
+            out.write(chunk)
+
+    def generate(self):
+        """Generate the XML as a sequence of (utf-8 encoded) chunks."""
+        self._buf = io.BytesIO()
+        self._xml = XMLGenerator(self._buf, 'utf-8')
+        self._xml.startDocument()
+        schedule_days, durations = [], {}
+        if self.grid is not None:
+            schedule_days = self.grid.get_schedule_days()
+            durations = self._get_durations(self.grid)
+        self._start('schedule', level=0)
+        self._conference(schedule_days)
+        yield self._flush()
+        for index, schedule_day in enumerate(schedule_days, 1):
+            for chunk in self._day(schedule_day, index, durations):
+                yield chunk
+        self._end('schedule', level=0)
+        self._xml.endDocument()
+        self._buf.write(b'\n')
+        yield self._flush()
+
+    def _flush(self):
+        chunk = self._buf.getvalue()
+        self._buf.seek(0)
+        self._buf.truncate()
+        return chunk
+
+    def _newline(self, level):
+        self._xml.ignorableWhitespace(u'\n' + u'  ' * level)
+
+    def _start(self, name, attrs=None, level=None):
+        if level is not None:
+            self._newline(level)
+        self._xml.startElement(name, attrs or {})
+
+    def _end(self, name, level=None):
+        if level is not None:
+            self._newline(level)
+        self._xml.endElement(name)
+
+    def _element(self, name, text=None, attrs=None, level=None):
+        self._start(name, attrs, level)
+        if text:
+            self._xml.characters(u'%s' % text)
+        self._end(name)
+
+    def _conference(self, schedule_days):
+        self._start('conference', level=1)
+        self._element('title', self.site.name, level=2)
+        if schedule_days:
+            self._element('start', schedule_days[0].day.date.isoformat(),
+                          level=2)
+            self._element('end', schedule_days[-1].day.date.isoformat(),
+                          level=2)
+            self._element('days', len(schedule_days), level=2)
+        self._element('day_change', '00:00', level=2)
+        self._element('timeslot_duration', '00:15', level=2)
+        self._end('conference', level=1)
+
+    def _get_durations(self, grid):
+        """Total up the duration (in minutes) of each item.
+
+           This is the sum of all the slot durations."""
+        # This will do the wrong thing if the slots aren't contiguous,
+        # as with ScheduleItem.get_duration
+        durations = {}
+        for slot in grid.slots:
+            duration = slot.get_duration()
+            minutes = duration['hours'] * 60 + duration['minutes']
+            for item in grid.get_items(slot):
+                durations[item.pk] = durations.get(item.pk, 0) + minutes
+        return durations
+
+    def _day(self, schedule_day, index, durations):
+        # Each item is listed at its first slot
+        events = dict((venue, []) for venue in schedule_day.venues)
+        for row in schedule_day.rows:
+            for venue, scheditem in row.items.items():
+                if venue in events:
+                    events[venue].append((scheditem['item'], row.slot))
+        date = schedule_day.day.date.isoformat()
+        self._start('day', {'date': date, 'index': str(index)}, level=1)
+        for venue in schedule_day.venues:
+            self._start('room', {'name': venue.name}, level=2)
+            for item, slot in events[venue]:
+                self._event(date, venue, item, slot, durations[item.pk])
+                yield self._flush()
+            self._end('room', level=2)
+        self._end('day', level=1)
+        yield self._flush()
+
+    def _event(self, date, venue, item, slot, duration):
+        # The event id is the ScheduleItem pk, which should be unique
+        # enough
+        self._start('event', {'id': str(item.pk)}, level=3)
+        start = slot.get_start_time()
+        # Not sure what to do about timezones here
+        self._element('date', '%sT%s+00:00' % (date,
+                                               start.strftime('%H:%M:%S')),
+                      level=4)
+        self._element('start', start.strftime('%H:%M'), level=4)
+        self._element('duration', '%02d:%02d' % divmod(duration, 60),
+                      level=4)
+        self._element('room', venue.name, level=4)
+        # Confclerk needs this to import the conference. We set this to
+        # the same as the room name, since there doesn't seem a better
+        # choice
+        self._element('track', venue.name, level=4)
+        # Both confclerk and Giggity lump the abstract and description
+        # together, and summit only outputs the description, so we follow
+        # summit's pattern and leave the abstract blank
+        self._element('abstract', level=4)
+        people = []
+        if item.talk:
+            self._element('title', item.get_title(), level=4)
+            # The raw markdown seems to match what summit does
+            self._element('description', item.talk.abstract.raw, level=4)
+            self._element('type', item.talk.talk_type, level=4)
+            people = item.talk.authors.all()
+        else:
+            self._element('title', item.get_details(), level=4)
+            self._element('type', level=4)
+            if item.page:
+                people = item.page.people.all()
+            if people:
+                # If there are people, we care about the description
+                self._element('description', item.page.content.raw,
+                              level=4)
+            else:
+                self._element('description', level=4)
+        if item.talk or people:
+            self._persons(people)
+        url = item.get_url()
+        self._element('conf_url', url, level=4)
+        # The pentabarf format isn't that well standardised, so we add
+        # our own full_conf_url tag for the full url
+        self._element('full_conf_url', url and 'https://%s%s' % (
+            self.site.domain, url), level=4)
+        self._element('released', 'True', level=4)
+        self._end('event', level=3)
+
+    def _persons(self, people):
+        self._start('persons', level=4)
+        for person in people:
+            # person id is the user pk
+            attrs = {'id': str(person.pk)}
+            if self.include_contact:
+                profile = person.userprofile
+                if profile.twitter_handle:
+                    attrs['twitter'] = ('https://twitter.com/%s' %
+                                        profile.twitter_handle)
+                attrs['contact'] = person.email
+            self._element('person', person.userprofile.display_name(),
+                          attrs, level=5)
+        self._end('persons', level=4)
@@ -1,15 +1,33 @@
+from django.contrib.auth import get_user_model
 from django_medusa.renderers import StaticSiteRenderer
-from wafer.schedule.models import Venue
+from wafer.pages.models import Page
+from wafer.schedule.models import Day, ScheduleItem, Slot, Venue
+from wafer.talks.models import Talk
+from wafer.users.models import UserProfile
+from wafer.utils import reverse_formatter
 
 
 class ScheduleRenderer(StaticSiteRenderer):
-    def get_paths(self):
-        paths = ["/schedule/", "/schedule/pentabarf.xml"]
+    def iter_paths(self):
+        for path in ["/schedule/", "/schedule/pentabarf.xml",
+                     "/schedule/schedule.json", "/schedule/schedule.ics"]:
+            yield path
 
         # Add the venues
-        items = Venue.objects.all()
-        for item in items:
-            paths.append(item.get_absolute_url())
-        return paths
+        venue_url = reverse_formatter('wafer_venue')
+        venue_ical_url = reverse_formatter('wafer_venue_ical', 'venue_pk')
+        items = Venue.objects.values_list('id', flat=True)
+        for venue_id in items.iterator():
+            yield venue_url(str(venue_id))
+            yield venue_ical_url(str(venue_id))
+
+    def get_paths(self):
+        return list(self.iter_paths())
+
+    def get_dependencies(self):
+        # Every part of the schedule is generated from the whole schedule
+        deps = [Day, Venue, Slot, ScheduleItem, Talk, Page,
+                get_user_model(), UserProfile]
+        return dict((path, deps) for path in self.paths)
 
 renderers = [ScheduleRenderer, ]
@@ -1,8 +1,10 @@
+from django.db import connection, transaction
 from rest_framework import serializers
 
 from wafer.talks.models import Talk
 from wafer.pages.models import Page
 from wafer.schedule.models import ScheduleItem, Venue, Slot
+from wafer.schedule.validation import deferred_validation, update_findings
 
 
 class ScheduleItemSerializer(serializers.HyperlinkedModelSerializer):
@@ -39,3 +41,214 @@ class ScheduleItemSerializer(serializers.HyperlinkedModelSerializer):
         return super(ScheduleItemSerializer, self).create(validated_data)
 
 
+class ScheduleBatchSerializer(serializers.Serializer):
+    """A list of changes to the schedule, applied in one transaction.
+
+       Each operation is one of:
+         {"action": "assign", "venue": id, "slots": [ids],
+          "talk": id, "page": id, "replace": false}
+             Schedule the talk or page in the slots in the venue. As when
+             creating a schedule item, an existing item in the venue and
+             slots is reused. If it already has a different talk or page,
+             the operation is rejected, unless replace is true.
+         {"action": "move", "id": id, "venue": id, "slots": [ids]}
+             Move an item to a different venue and / or slots.
+         {"action": "remove", "id": id}
+             Remove an item from the schedule.
+
+       The schedule is validated once, after all the changes have been
+       made."""
+
+    operations = serializers.ListField(child=serializers.DictField())
+
+    # field -> (model, required for actions)
+    FIELDS = {
+        'id': (ScheduleItem, ('move', 'remove')),
+        'venue': (Venue, ('assign',)),
+        'slots': (Slot, ('assign',)),
+        'talk': (Talk, ()),
+        'page': (Page, ()),
+    }
+
+    def _clean_id(self, value, index, field):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise serializers.ValidationError(
+                'Operation %d: invalid %s %r' % (index, field, value))
+
+    def validate_operations(self, operations):
+        cleaned = []
+        for index, op in enumerate(operations):
+            action = op.get('action')
+            if action not in ('assign', 'move', 'remove'):
+                raise serializers.ValidationError(
+                    'Operation %d: unknown action %r' % (index, action))
+            clean = {'action': action, 'replace': op.get('replace') is True}
+            for field, (model, required) in self.FIELDS.items():
+                value = op.get(field)
+                if value in (None, '', []):
+                    if action in required:
+                        raise serializers.ValidationError(
+                            'Operation %d: %s is required' % (index, field))
+                    continue
+                if field == 'slots':
+                    if not isinstance(value, list):
+                        value = [value]
+                    clean[field] = [self._clean_id(x, index, field)
+                                    for x in value]
+                else:
+                    clean[field] = self._clean_id(value, index, field)
+            cleaned.append(clean)
+        return cleaned
+
+    def validate(self, data):
+        # Look up everything the operations refer to in bulk
+        objects = {}
+        for field, (model, required) in self.FIELDS.items():
+            pks = set()
+            for op in data['operations']:
+                value = op.get(field)
+                if field == 'slots':
+                    pks.update(value or [])
+                elif value is not None:
+                    pks.add(value)
+            objects[field] = model.objects.in_bulk(pks)
+            missing = pks - set(objects[field])
+            if missing:
+                raise serializers.ValidationError(
+                    'Invalid %s: %s' % (field, ', '.join(
+                        str(pk) for pk in sorted(missing))))
+        data['objects'] = objects
+        return data
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            with deferred_validation():
+                return self._apply(validated_data['operations'],
+                                   validated_data['objects'])
+
+    def _apply(self, operations, objects):
+        """Apply the operations, returning the changed schedule items."""
+        through = ScheduleItem.slots.through
+        items = objects['id']
+        # The items already in the slots, and all the slots of the items
+        # we're changing
+        items.update(ScheduleItem.objects.in_bulk(
+            through.objects.filter(slot__in=list(objects['slots']))
+            .values_list('scheduleitem_id', flat=True)))
+        item_slots = dict((pk, set()) for pk in items)
+        for item_id, slot_id in through.objects.filter(
+                scheduleitem__in=list(items)).values_list(
+                'scheduleitem_id', 'slot_id'):
+            item_slots[item_id].add(slot_id)
+        old_slots = set()
+        for slots in item_slots.values():
+            old_slots.update(slots)
+        positions = {}
+        for pk, slots in item_slots.items():
+            for slot_id in slots:
+                positions[(items[pk].venue_id, slot_id)] = pk
+
+        def move(item, key, venue_id, slots):
+            for slot_id in item_slots.get(key, ()):
+                positions.pop((item.venue_id, slot_id), None)
+            item.venue_id = venue_id
+            item_slots[key] = set(slots)
+            for slot_id in slots:
+                positions[(venue_id, slot_id)] = key
+
+        # The current values of the existing items, so only the items
+        # that change are updated
+        original = dict((pk, (item.venue_id, item.talk_id, item.page_id))
+                        for pk, item in items.items())
+        # New items are given negative keys until they're created
+        new_keys = []
+        removed = set()
+        changed = set()
+        for index, op in enumerate(operations):
+            if op['action'] == 'remove':
+                item = items[op['id']]
+                move(item, item.pk, item.venue_id, ())
+                removed.add(item.pk)
+                continue
+            if op['action'] == 'move':
+                key = op['id']
+                item = items[key]
+                if key in removed:
+                    raise serializers.ValidationError(
+                        'Item %d has been removed' % key)
+                move(item, key, op.get('venue', item.venue_id),
+                     op.get('slots', item_slots[key]))
+            else:
+                key = None
+                for slot_id in op['slots']:
+                    key = positions.get((op['venue'], slot_id))
+                    if key is not None:
+                        break
+                if key is None:
+                    key = -1 - len(new_keys)
+                    new_keys.append(key)
+                    items[key] = ScheduleItem(venue_id=op['venue'])
+                item = items[key]
+                content = (item.talk_id, item.page_id)
+                if (content != (None, None) and
+                        content != (op.get('talk'), op.get('page')) and
+                        not op['replace']):
+                    existing = ('item %d' % key if key > 0 else
+                                'an item added by this batch')
+                    raise serializers.ValidationError(
+                        'Operation %d: %s is already in venue %d, slot %d.'
+                        ' Set replace to replace its talk or page.'
+                        % (index, existing, op['venue'], slot_id))
+                item.talk_id = op.get('talk')
+                item.page_id = op.get('page')
+                move(item, key, op['venue'], op['slots'])
+            changed.add(key)
+
+        changed -= removed
+        ScheduleItem.objects.filter(pk__in=removed).delete()
+        # Update the existing items with one query for each new venue,
+        # and each new talk and page
+        venue_updates = {}
+        content_updates = {}
+        for key in changed:
+            if key > 0:
+                item = items[key]
+                venue_id, talk_id, page_id = original[key]
+                if item.venue_id != venue_id:
+                    venue_updates.setdefault(item.venue_id, []).append(key)
+                if (item.talk_id, item.page_id) != (talk_id, page_id):
+                    content_updates.setdefault(
+                        (item.talk_id, item.page_id), []).append(key)
+        for venue_id, pks in venue_updates.items():
+            ScheduleItem.objects.filter(pk__in=pks).update(venue=venue_id)
+        for (talk_id, page_id), pks in content_updates.items():
+            ScheduleItem.objects.filter(pk__in=pks).update(
+                talk=talk_id, page=page_id)
+        # The new items need their pks for the slots. bulk_create only
+        # sets them on databases that can return the ids of the inserted
+        # rows, so elsewhere the items are inserted one by one.
+        new_items = [items[key] for key in new_keys]
+        if getattr(connection.features, 'can_return_ids_from_bulk_insert',
+                   False):
+            ScheduleItem.objects.bulk_create(new_items)
+        else:
+            for item in new_items:
+                item.save()
+        for key, item in zip(new_keys, new_items):
+            changed.remove(key)
+            changed.add(item.pk)
+            items[item.pk] = item
+            item_slots[item.pk] = item_slots.pop(key)
+        # Replace the slots of all the changed items at once. This
+        # doesn't send m2m_changed, so we update the validation directly
+        through.objects.filter(scheduleitem__in=changed).delete()
+        through.objects.bulk_create(
+            through(scheduleitem_id=pk, slot_id=slot_id)
+            for pk in changed for slot_id in item_slots[pk])
+        new_slots = set()
+        for pk in changed:
+            new_slots.update(item_slots[pk])
+        update_findings(items=changed, slots=old_slots | new_slots)
+        return [items[pk] for pk in sorted(changed)]
@@ -0,0 +1,200 @@
+"""Place unscheduled talks into the free parts of the schedule.
+
+The solver respects the same constraints as the schedule validation:
+talks are only placed in venues on the days the venues are available,
+never in a (venue, slot) that already has an item, and each talk gets a
+single slot, so its slots are trivially contiguous. It also ensures no
+speaker is in two places at once.
+
+Talks are placed greedily, most constrained first. Talks that can't be
+placed are then repaired with a local search, which tries to move an
+already placed talk out of the way.
+"""
+
+from django.db import transaction
+
+from wafer.schedule.models import ScheduleItem, Slot, Venue
+from wafer.schedule.validation import (
+    deferred_validation, find_overlapping_slot_pairs, update_findings)
+from wafer.talks.models import Talk, ACCEPTED
+
+
+class SolverResult(object):
+    """The result of running the solver.
+
+       placed is a list of (talk, venue, slot) tuples, and unplaced is a
+       list of (talk, reason) tuples."""
+
+    def __init__(self, placed, unplaced):
+        self.placed = placed
+        self.unplaced = unplaced
+
+    def apply(self):
+        """Create the schedule items for the placed talks."""
+        through = ScheduleItem.slots.through
+        with transaction.atomic():
+            with deferred_validation():
+                links = []
+                for talk, venue, slot in self.placed:
+                    item = ScheduleItem(venue=venue, talk=talk)
+                    item.save()
+                    links.append(through(scheduleitem_id=item.pk,
+                                         slot_id=slot.pk))
+                # bulk_create doesn't send m2m_changed, so we update the
+                # validation directly
+                through.objects.bulk_create(links)
+                update_findings(
+                    items=[link.scheduleitem_id for link in links],
+                    slots=[slot.pk for _, _, slot in self.placed])
+
+
+class ScheduleSolver(object):
+    """Assign unscheduled accepted talks to free (venue, slot) cells.
+
+       talks restricts the talks to place (by default, all the accepted
+       talks which aren't in the schedule). Slots holding items that
+       aren't talks (breaks, keynotes spanning the venues and so on) are
+       left alone."""
+
+    def __init__(self, talks=None):
+        if talks is None:
+            talks = Talk.objects.all()
+        self.talks = list(talks.filter(status=ACCEPTED, scheduleitem=None)
+                          .prefetch_related('authors')
+                          .order_by('talk_id'))
+        self._load_schedule()
+
+    def _load_schedule(self):
+        slots = list(Slot.objects.select_related('effective_day'))
+        slots = [slot for slot in slots
+                 if slot.effective_day_id is not None and
+                 slot.get_start_time() is not None]
+        slots.sort(key=lambda slot: (slot.effective_day.date,
+                                     slot.get_start_time(), slot.end_time))
+        # Slots which are at the same time as each slot (including
+        # itself)
+        self.concurrent = dict((slot.pk, set([slot.pk])) for slot in slots)
+        for slot, other in find_overlapping_slot_pairs(slots):
+            self.concurrent[slot.pk].add(other.pk)
+            self.concurrent[other.pk].add(slot.pk)
+
+        occupied = set()
+        blocked_slots = set()
+        # speaker pk -> slot pks they are already busy in
+        self.busy = {}
+        for item in (ScheduleItem.objects
+                     .select_related('talk')
+                     .prefetch_related('slots', 'talk__authors',
+                                       'page__people')):
+            slot_pks = [slot.pk for slot in item.slots.all()]
+            occupied.update((item.venue_id, pk) for pk in slot_pks)
+            if item.talk:
+                people = item.talk.authors.all()
+            else:
+                blocked_slots.update(slot_pks)
+                people = item.page.people.all() if item.page else []
+            for person in people:
+                self.busy.setdefault(person.pk, set()).update(slot_pks)
+
+        venues = list(Venue.objects.prefetch_related('days'))
+        venue_days = dict((venue.pk, set(day.pk for day in venue.days.all()))
+                          for venue in venues)
+        self.cells = []
+        for slot in slots:
+            if slot.pk in blocked_slots:
+                continue
+            for venue in venues:
+                if (venue.pk, slot.pk) in occupied:
+                    continue
+                if slot.effective_day_id not in venue_days[venue.pk]:
+                    continue
+                self.cells.append((venue, slot))
+
+    def _speakers(self, talk):
+        return [author.pk for author in talk.authors.all()]
+
+    def _fits(self, talk, slot, ignore=None):
+        """Can all of the talk's speakers be in the slot?
+
+           ignore is a talk whose placement should be ignored."""
+        concurrent = self.concurrent[slot.pk]
+        for speaker in self._speakers(talk):
+            for other_slot in self.busy.get(speaker, ()):
+                if other_slot in concurrent:
+                    return False
+            for other_talk in self.speaker_talks.get(speaker, ()):
+                if other_talk is ignore:
+                    continue
+                if self.assignment[other_talk][1].pk in concurrent:
+                    return False
+        return True
+
+    def _place(self, talk, cell):
+        self.assignment[talk] = cell
+        self.cell_talk[cell] = talk
+        for speaker in self._speakers(talk):
+            self.speaker_talks.setdefault(speaker, set()).add(talk)
+
+    def _unplace(self, talk):
+        cell = self.assignment.pop(talk)
+        del self.cell_talk[cell]
+        for speaker in self._speakers(talk):
+            self.speaker_talks[speaker].discard(talk)
+        return cell
+
+    def _free_cell(self, talk, ignore=None):
+        for cell in self.cells:
+            if cell not in self.cell_talk and self._fits(talk, cell[1],
+                                                         ignore):
+                return cell
+        return None
+
+    def _repair(self, talk):
+        """Try to place the talk by moving a placed talk to another free
+           cell."""
+        for cell in self.cells:
+            other = self.cell_talk.get(cell)
+            if other is None or not self._fits(talk, cell[1], ignore=other):
+                continue
+            self._unplace(other)
+            self._place(talk, cell)
+            new_cell = self._free_cell(other)
+            if new_cell is not None:
+                self._place(other, new_cell)
+                return True
+            self._unplace(talk)
+            self._place(other, cell)
+        return False
+
+    def solve(self):
+        """Run the solver, returning a SolverResult."""
+        self.assignment = {}
+        self.cell_talk = {}
+        self.speaker_talks = {}
+        # Place the talks whose speakers have the most talks first
+        counts = {}
+        for talk in self.talks:
+            for speaker in self._speakers(talk):
+                counts[speaker] = counts.get(speaker, 0) + 1
+        talks = sorted(self.talks, key=lambda talk: -sum(
+            counts[speaker] + len(self.busy.get(speaker, ()))
+            for speaker in self._speakers(talk)))
+        failed = []
+        for talk in talks:
+            cell = self._free_cell(talk)
+            if cell is None:
+                failed.append(talk)
+            else:
+                self._place(talk, cell)
+        unplaced = []
+        for talk in failed:
+            # Moving a talk out of the way needs somewhere to move it to
+            if len(self.cell_talk) == len(self.cells):
+                unplaced.append((talk, 'No free slots'))
+            elif not self._repair(talk):
+                unplaced.append(
+                    (talk, 'The speakers are busy in all the free slots'))
+        placed = [(talk, venue, slot) for talk, (venue, slot)
+                  in sorted(self.assignment.items(),
+                            key=lambda x: x[0].talk_id)]
+        return SolverResult(placed, unplaced)
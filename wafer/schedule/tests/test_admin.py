@@ -1,15 +1,17 @@
 import datetime as D
+import random
 
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 from django.http import HttpRequest
 
 from wafer.pages.models import Page
-from wafer.schedule.admin import (
-    SlotAdmin, find_overlapping_slots, validate_items,
+from wafer.schedule.admin import SlotAdmin
+from wafer.schedule.models import Day, Venue, Slot, ScheduleItem
+from wafer.schedule.validation import (
+    find_overlapping_slots, find_overlapping_slot_pairs, validate_items,
     find_duplicate_schedule_items, find_clashes, find_invalid_venues,
     find_non_contiguous)
-from wafer.schedule.models import Day, Venue, Slot, ScheduleItem
 from wafer.talks.models import Talk, ACCEPTED, REJECTED, PENDING
 
 
@@ -130,6 +132,65 @@ class SlotAdminTests(TestCase):
         self.assertEqual(slot4.day, slot.day)
 
 
+class CountingTime(D.time):
+    """A time which counts how often times are compared."""
+    comparisons = 0
+
+    def _count(op):
+        def compare(self, other):
+            CountingTime.comparisons += 1
+            return getattr(D.time, op)(self, other)
+        return compare
+
+    __eq__ = _count('__eq__')
+    __ne__ = _count('__ne__')
+    __lt__ = _count('__lt__')
+    __le__ = _count('__le__')
+    __gt__ = _count('__gt__')
+    __ge__ = _count('__ge__')
+    __hash__ = D.time.__hash__
+    del _count
+
+
+def counting_time(value):
+    return CountingTime(value.hour, value.minute)
+
+
+def make_synthetic_slots(days, per_day):
+    """Make unsaved one minute slots for the overlap benchmark, with
+       CountingTimes.
+
+       Every 100th slot runs a minute long, so it overlaps the slot
+       after it."""
+    slots = []
+    for day in range(days):
+        for minute in range(per_day):
+            start = D.datetime(2013, 9, 22, 0, 0) + D.timedelta(
+                minutes=minute)
+            end = start + D.timedelta(minutes=2 if minute % 100 == 0 else 1)
+            slot = Slot(pk=len(slots) + 1, effective_day_id=day,
+                        effective_start_time=counting_time(start.time()),
+                        end_time=counting_time(end.time()))
+            slots.append(slot)
+    random.shuffle(slots)
+    return slots
+
+
+def brute_force_overlaps(slots):
+    """The straight-forward N^2 overlap check, for comparison"""
+    overlaps = set()
+    for slot in slots:
+        for other in slots:
+            if other is slot:
+                continue
+            if other.effective_day_id != slot.effective_day_id:
+                continue
+            if slot.get_start_time() < other.end_time and (
+                    other.get_start_time() < slot.end_time):
+                overlaps.add(frozenset([id(slot), id(other)]))
+    return overlaps
+
+
 class ValidationTests(TestCase):
 
     def test_slot(self):
@@ -187,6 +248,59 @@ class ValidationTests(TestCase):
         overlaps = find_overlapping_slots()
         assert overlaps == set([slot3, slot4, slot5])
 
+    def test_slot_pairs(self):
+        """Test that we report which slots overlap each other"""
+        day1 = Day.objects.create(date=D.date(2013, 9, 22))
+        day2 = Day.objects.create(date=D.date(2013, 9, 23))
+        slot1 = Slot.objects.create(start_time=D.time(10, 0, 0),
+                                    end_time=D.time(12, 0, 0), day=day1)
+        slot2 = Slot.objects.create(start_time=D.time(11, 0, 0),
+                                    end_time=D.time(11, 30, 0), day=day1)
+        slot3 = Slot.objects.create(previous_slot=slot2,
+                                    end_time=D.time(13, 0, 0))
+        # Same times on a different day
+        Slot.objects.create(start_time=D.time(10, 0, 0),
+                            end_time=D.time(12, 0, 0), day=day2)
+        # Ends when slot1 starts
+        Slot.objects.create(start_time=D.time(9, 0, 0),
+                            end_time=D.time(10, 0, 0), day=day1)
+
+        pairs = find_overlapping_slot_pairs()
+        assert set(frozenset(pair) for pair in pairs) == set([
+            frozenset([slot1, slot2]), frozenset([slot1, slot3])])
+
+    def test_slot_overlaps_match_brute_force(self):
+        """Compare the sweep against checking every pair of slots"""
+        rand = random.Random(42)
+        slots = []
+        for x in range(300):
+            start = rand.randrange(0, 600)
+            end = start + rand.randrange(1, 60)
+            slots.append(Slot(
+                effective_day_id=rand.randrange(3),
+                effective_start_time=D.time(start // 60, start % 60),
+                end_time=D.time(end // 60, end % 60)))
+        pairs = find_overlapping_slot_pairs(slots)
+        found = set(frozenset([id(a), id(b)]) for a, b in pairs)
+        assert len(found) == len(pairs)
+        assert found == brute_force_overlaps(slots)
+
+    def test_slot_overlap_benchmark(self):
+        """Check overlap detection over 10k slots needs far fewer
+           comparisons than the N^2 approach"""
+        slots = make_synthetic_slots(10, 1000)
+        assert len(slots) == 10000
+        CountingTime.comparisons = 0
+        pairs = find_overlapping_slot_pairs(slots)
+        comparisons = CountingTime.comparisons
+        assert len(pairs) == 100
+        assert len(find_overlapping_slots(slots)) == 200
+        # Sorting each day's 1000 slots needs about 1000 * log2(1000)
+        # comparisons, while comparing every pair of slots on each day
+        # needs 10 * 1000 * 1000 / 2
+        assert comparisons < 10 * 1000 * 50, (
+            'Overlap detection needed %d comparisons' % comparisons)
+
     def test_clashes(self):
         """Test that we can detect clashes correctly"""
         day1 = Day.objects.create(date=D.date(2013, 9, 22))
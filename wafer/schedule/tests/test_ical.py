@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import datetime as D
+
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase
+
+from wafer.pages.models import Page
+from wafer.schedule.ical import fold
+from wafer.schedule.models import Day, Venue, Slot, ScheduleItem
+from wafer.talks.models import Talk, ACCEPTED
+from wafer.utils import QueryTracker
+
+
+class IcalTests(TestCase):
+
+    def setUp(self):
+        # Schedule is
+        #         Venue 1     Venue 2
+        # 10-11   Talk        Page
+        # 11-12   Talk        --
+        day = Day.objects.create(date=D.date(2013, 9, 22))
+        self.venue1 = Venue.objects.create(order=1, name='Venue 1')
+        self.venue2 = Venue.objects.create(order=2, name='Venue 2')
+        self.venue1.days.add(day)
+        self.venue2.days.add(day)
+        slot1 = Slot.objects.create(day=day, start_time=D.time(10, 0, 0),
+                                    end_time=D.time(11, 0, 0))
+        slot2 = Slot.objects.create(previous_slot=slot1,
+                                    end_time=D.time(12, 0, 0))
+
+        self.user = get_user_model().objects.create_user(
+            'john', 'best@wafer.test', 'johnpassword')
+        talk = Talk.objects.create(title="Test talk, with comma",
+                                   status=ACCEPTED,
+                                   corresponding_author_id=self.user.id)
+        talk.authors.add(self.user)
+        page = Page.objects.create(name="Test page", slug="test")
+
+        self.item1 = ScheduleItem.objects.create(venue=self.venue1,
+                                                 talk=talk)
+        self.item1.slots.add(slot1, slot2)
+        self.item2 = ScheduleItem.objects.create(venue=self.venue2,
+                                                 page=page)
+        self.item2.slots.add(slot1)
+
+    def get_events(self, url):
+        response = Client().get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'],
+                         'text/calendar; charset=utf-8')
+        content = response.content.decode('utf-8')
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertTrue(content.endswith('END:VCALENDAR\r\n'))
+        events = content.split('BEGIN:VEVENT\r\n')[1:]
+        return [dict(line.split(':', 1) for line in
+                     event.split('END:VEVENT')[0].splitlines())
+                for event in events]
+
+    def test_schedule(self):
+        event1, event2 = self.get_events('/schedule/schedule.ics')
+        # Africa/Johannesburg is UTC+2
+        self.assertEqual(event1['DTSTART'], '20130922T080000Z')
+        self.assertEqual(event1['DTEND'], '20130922T100000Z')
+        self.assertEqual(event1['SUMMARY'], 'Test talk\\, with comma')
+        self.assertEqual(event1['LOCATION'], 'Venue 1')
+        self.assertEqual(event1['DESCRIPTION'], 'john')
+        self.assertTrue(event1['UID'].startswith(
+            'schedule-item-%d@' % self.item1.pk))
+        self.assertEqual(event2['DTEND'], '20130922T090000Z')
+        self.assertEqual(event2['SUMMARY'], 'Test page')
+
+    def test_venue(self):
+        [event] = self.get_events('/schedule/venue/%d/schedule.ics'
+                                  % self.venue2.pk)
+        self.assertEqual(event['SUMMARY'], 'Test page')
+        response = Client().get('/schedule/venue/%d/schedule.ics'
+                                % (self.venue2.pk + 10))
+        self.assertEqual(response.status_code, 404)
+
+    def test_speaker(self):
+        [event] = self.get_events('/schedule/speaker/john/schedule.ics')
+        self.assertEqual(event['LOCATION'], 'Venue 1')
+        response = Client().get('/schedule/speaker/nobody/schedule.ics')
+        self.assertEqual(response.status_code, 404)
+
+    def test_cached(self):
+        """Check that the feeds are only generated once for each version
+           of the schedule."""
+        self.get_events('/schedule/schedule.ics')
+        with QueryTracker() as tracker:
+            self.get_events('/schedule/schedule.ics')
+            for query in tracker.queries:
+                self.assertIn('wafer_cache_table', query['sql'])
+        # Other feeds reuse the generated events
+        with QueryTracker() as tracker:
+            self.get_events('/schedule/venue/%d/schedule.ics'
+                            % self.venue1.pk)
+            for query in tracker.queries:
+                self.assertNotIn('"schedule_slot"', query['sql'])
+
+    def test_fold(self):
+        line = u'SUMMARY:' + u'\xe9' * 80
+        folded = fold(line).split(b'\r\n ')
+        for part in folded:
+            self.assertTrue(len(part) <= 75)
+        self.assertEqual(b''.join(folded).decode('utf-8'), line)
@@ -1,8 +1,11 @@
 import datetime as D
 
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils.six import StringIO
 
-from wafer.schedule.models import Day
+from wafer.schedule.models import Day, Slot
+from wafer.utils import QueryTracker
 
 
 class DayTests(TestCase):
@@ -16,3 +19,89 @@ class DayTests(TestCase):
         output = ["%s" % x for x in Day.objects.all()]
 
         assert output == ["Sep 22 (Sun)", "Sep 23 (Mon)"]
+
+
+class SlotTimelineTests(TestCase):
+    def setUp(self):
+        self.day1 = Day.objects.create(date=D.date(2013, 9, 22))
+        self.day2 = Day.objects.create(date=D.date(2013, 9, 23))
+        self.slots = [Slot.objects.create(day=self.day1,
+                                          start_time=D.time(10, 0, 0),
+                                          end_time=D.time(11, 0, 0))]
+        for hour in range(12, 16):
+            self.slots.append(Slot.objects.create(
+                previous_slot=self.slots[-1], end_time=D.time(hour, 0, 0)))
+
+    def _times(self):
+        return [(slot.effective_day, slot.effective_start_time)
+                for slot in Slot.objects.filter(
+                    pk__in=[x.pk for x in self.slots]).order_by('end_time')]
+
+    def test_chain(self):
+        """Test that slots in a chain get their day and start time from
+           the previous slot."""
+        self.assertEqual(self._times(), [
+            (self.day1, D.time(10, 0, 0)),
+            (self.day1, D.time(11, 0, 0)),
+            (self.day1, D.time(12, 0, 0)),
+            (self.day1, D.time(13, 0, 0)),
+            (self.day1, D.time(14, 0, 0)),
+        ])
+        last = Slot.objects.get(pk=self.slots[-1].pk)
+        with QueryTracker() as tracker:
+            self.assertEqual(last.get_start_time(), D.time(14, 0, 0))
+            self.assertEqual(len(tracker.queries), 0)
+        with QueryTracker() as tracker:
+            self.assertEqual(last.get_day(), self.day1)
+            self.assertEqual(len(tracker.queries), 1)
+
+    def test_save_updates_chain(self):
+        """Test that changing a slot updates the slots following it."""
+        first = self.slots[0]
+        first.day = self.day2
+        first.end_time = D.time(10, 30, 0)
+        first.save()
+        self.assertEqual(self._times(), [
+            (self.day2, D.time(10, 0, 0)),
+            (self.day2, D.time(10, 30, 0)),
+            (self.day2, D.time(12, 0, 0)),
+            (self.day2, D.time(13, 0, 0)),
+            (self.day2, D.time(14, 0, 0)),
+        ])
+
+        # Splitting the chain
+        middle = Slot.objects.get(pk=self.slots[2].pk)
+        middle.previous_slot = None
+        middle.day = self.day1
+        middle.start_time = D.time(11, 30, 0)
+        middle.save()
+        self.assertEqual(self._times(), [
+            (self.day2, D.time(10, 0, 0)),
+            (self.day2, D.time(10, 30, 0)),
+            (self.day1, D.time(11, 30, 0)),
+            (self.day1, D.time(13, 0, 0)),
+            (self.day1, D.time(14, 0, 0)),
+        ])
+
+    def test_delete(self):
+        """Test that deleting a slot removes the slots following it."""
+        Slot.objects.get(pk=self.slots[3].pk).delete()
+        self.assertEqual(self._times(), [
+            (self.day1, D.time(10, 0, 0)),
+            (self.day1, D.time(11, 0, 0)),
+            (self.day1, D.time(12, 0, 0)),
+        ])
+
+    def test_rebuild_command(self):
+        """Test that the management command repairs the timeline."""
+        Slot.objects.update(effective_day=None, effective_start_time=None)
+        out = StringIO()
+        call_command('wafer_rebuild_slot_timeline', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Updated 5 slots')
+        self.assertEqual(self._times(), [
+            (self.day1, D.time(10, 0, 0)),
+            (self.day1, D.time(11, 0, 0)),
+            (self.day1, D.time(12, 0, 0)),
+            (self.day1, D.time(13, 0, 0)),
+            (self.day1, D.time(14, 0, 0)),
+        ])
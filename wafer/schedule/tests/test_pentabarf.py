@@ -0,0 +1,121 @@
+import datetime as D
+import os
+import shutil
+import tempfile
+from xml.etree import ElementTree
+
+from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
+from django.core.management import call_command
+from django.test import Client, TestCase
+
+from wafer.pages.models import Page
+from wafer.schedule.models import Day, Venue, Slot, ScheduleItem
+from wafer.schedule.pentabarf import PentabarfExporter
+from wafer.schedule.views import ScheduleGrid
+from wafer.talks.models import Talk, TalkType, ACCEPTED
+
+
+class PentabarfTests(TestCase):
+
+    def setUp(self):
+        # Schedule is
+        #         Venue 1     Venue 2
+        # 10-11   Talk        Page
+        # 11-12   Talk        --
+        day = Day.objects.create(date=D.date(2013, 9, 22))
+        self.venue1 = Venue.objects.create(order=1, name='Venue 1')
+        self.venue2 = Venue.objects.create(order=2, name='Venue 2')
+        self.venue1.days.add(day)
+        self.venue2.days.add(day)
+        slot1 = Slot.objects.create(day=day, start_time=D.time(10, 0, 0),
+                                    end_time=D.time(11, 0, 0))
+        slot2 = Slot.objects.create(previous_slot=slot1,
+                                    end_time=D.time(12, 0, 0))
+
+        self.user = get_user_model().objects.create_user(
+            'john', 'best@wafer.test', 'johnpassword')
+        self.user.userprofile.twitter_handle = 'john'
+        self.user.userprofile.save()
+        talk_type = TalkType.objects.create(name='Long talk')
+        self.talk = Talk.objects.create(
+            title="Test talk", status=ACCEPTED, abstract="An *abstract*",
+            talk_type=talk_type, corresponding_author_id=self.user.id)
+        self.talk.authors.add(self.user)
+        page = Page.objects.create(name="Test page", slug="test",
+                                   content="Page & content")
+        page.people.add(self.user)
+
+        self.item1 = ScheduleItem.objects.create(venue=self.venue1,
+                                                 talk=self.talk)
+        self.item1.slots.add(slot1, slot2)
+        self.item2 = ScheduleItem.objects.create(venue=self.venue2,
+                                                 page=page)
+        self.item2.slots.add(slot1)
+
+    def export(self, include_contact=False):
+        exporter = PentabarfExporter(ScheduleGrid(),
+                                     Site.objects.get_current(),
+                                     include_contact=include_contact)
+        return ElementTree.fromstring(b''.join(exporter.generate()))
+
+    def test_export(self):
+        schedule = self.export()
+        conference = schedule.find('conference')
+        self.assertEqual(conference.find('start').text, '2013-09-22')
+        self.assertEqual(conference.find('days').text, '1')
+        [day] = schedule.findall('day')
+        self.assertEqual(day.get('date'), '2013-09-22')
+        room1, room2 = day.findall('room')
+        self.assertEqual(room1.get('name'), 'Venue 1')
+
+        [event] = room1.findall('event')
+        self.assertEqual(event.get('id'), str(self.item1.pk))
+        self.assertEqual(event.find('date').text, '2013-09-22T10:00:00+00:00')
+        self.assertEqual(event.find('start').text, '10:00')
+        self.assertEqual(event.find('duration').text, '02:00')
+        self.assertEqual(event.find('title').text, 'Test talk')
+        self.assertEqual(event.find('description').text, 'An *abstract*')
+        self.assertEqual(event.find('type').text, 'Long talk')
+        self.assertEqual(event.find('conf_url').text,
+                         self.talk.get_absolute_url())
+        [person] = event.find('persons').findall('person')
+        self.assertEqual(person.text, 'john')
+        self.assertEqual(person.attrib, {'id': str(self.user.pk)})
+
+        [event] = room2.findall('event')
+        self.assertEqual(event.find('duration').text, '01:00')
+        self.assertEqual(event.find('title').text, 'Test page')
+        self.assertEqual(event.find('description').text, 'Page & content')
+        [person] = event.find('persons').findall('person')
+        self.assertEqual(person.text, 'john')
+
+    def test_contact(self):
+        schedule = self.export(include_contact=True)
+        for person in schedule.iter('person'):
+            self.assertEqual(person.get('contact'), 'best@wafer.test')
+            self.assertEqual(person.get('twitter'),
+                             'https://twitter.com/john')
+
+    def test_view(self):
+        c = Client()
+        response = c.get('/schedule/pentabarf.xml')
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content)
+        self.assertEqual(ElementTree.tostring(self.export()),
+                         ElementTree.tostring(
+                             ElementTree.fromstring(content)))
+        # The second request is served from the cache
+        response = c.get('/schedule/pentabarf.xml')
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content, content)
+
+    def test_command(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'pentabarf.xml')
+            call_command('wafer_pentabarf_xml', filename)
+            schedule = ElementTree.parse(filename).getroot()
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(len(list(schedule.iter('event'))), 2)
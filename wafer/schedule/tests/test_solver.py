@@ -0,0 +1,192 @@
+import datetime as D
+
+import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.utils.six import StringIO
+
+from wafer.pages.models import Page
+from wafer.schedule.models import Day, Venue, Slot, ScheduleItem
+from wafer.schedule.solver import ScheduleSolver
+from wafer.schedule.validation import schedule_is_valid
+from wafer.talks.models import Talk, ACCEPTED, PENDING
+
+
+def make_slots(day, n, start=D.time(9, 0, 0)):
+    """Make n contiguous half hour slots."""
+    slots = []
+    start = D.datetime.combine(day.date, start)
+    for x in range(n):
+        end = start + D.timedelta(minutes=30)
+        slots.append(Slot.objects.create(day=day, start_time=start.time(),
+                                         end_time=end.time()))
+        start = end
+    return slots
+
+
+class SolverTests(TestCase):
+
+    def setUp(self):
+        self.day1 = Day.objects.create(date=D.date(2013, 9, 22))
+        self.day2 = Day.objects.create(date=D.date(2013, 9, 23))
+        self.venue1 = Venue.objects.create(order=1, name='Venue 1')
+        self.venue2 = Venue.objects.create(order=2, name='Venue 2')
+        self.venue1.days.add(self.day1, self.day2)
+        # Venue 2 is only available on day 1
+        self.venue2.days.add(self.day1)
+        self.users = [get_user_model().objects.create_user(
+            'user%d' % x, 'user%d@wafer.test' % x, 'password')
+            for x in range(4)]
+
+    def make_talk(self, title, *authors, **kwargs):
+        talk = Talk.objects.create(
+            title=title, status=kwargs.get('status', ACCEPTED),
+            corresponding_author=authors[0])
+        talk.authors.add(*authors)
+        return talk
+
+    def assert_placed(self, result):
+        """Check that placed talks don't break the schedule's rules."""
+        cells = set()
+        speaker_slots = set()
+        for talk, venue, slot in result.placed:
+            self.assertNotIn((venue, slot), cells)
+            cells.add((venue, slot))
+            self.assertIn(slot.get_day(), venue.days.all())
+            for author in talk.authors.all():
+                self.assertNotIn((author, slot), speaker_slots)
+                speaker_slots.add((author, slot))
+
+    def test_place(self):
+        slot1, slot2 = make_slots(self.day1, 2)
+        [slot3] = make_slots(self.day2, 1)
+        talks = [self.make_talk('Talk %d' % x, self.users[x])
+                 for x in range(4)]
+        pending = self.make_talk('Pending', self.users[0], status=PENDING)
+        result = ScheduleSolver().solve()
+        self.assertEqual(result.unplaced, [])
+        self.assertEqual(len(result.placed), 4)
+        self.assert_placed(result)
+        # Venue 2 isn't available on day 2
+        self.assertNotIn((self.venue2, slot3),
+                         [(venue, slot) for _, venue, slot in result.placed])
+
+        result.apply()
+        self.assertTrue(schedule_is_valid())
+        self.assertEqual(set(item.talk for item in
+                             ScheduleItem.objects.all()), set(talks))
+        self.assertFalse(ScheduleItem.objects.filter(talk=pending).exists())
+        # Everything is placed now
+        result = ScheduleSolver().solve()
+        self.assertEqual(result.placed, [])
+
+    def test_existing_items(self):
+        """Check that the solver works around the existing schedule."""
+        slot1, slot2, slot3 = make_slots(self.day1, 3)
+        talk = self.make_talk('Scheduled', self.users[0])
+        item = ScheduleItem.objects.create(venue=self.venue1, talk=talk)
+        item.slots.add(slot1)
+        # A break across all the venues
+        page = Page.objects.create(name='Lunch', slug='lunch')
+        item = ScheduleItem.objects.create(venue=self.venue1, page=page)
+        item.slots.add(slot2)
+        new_talk = self.make_talk('New', self.users[0])
+        others = [self.make_talk('Other %d' % x, self.users[1 + x])
+                  for x in range(2)]
+        result = ScheduleSolver().solve()
+        self.assert_placed(result)
+        placed = dict((talk, (venue, slot))
+                      for talk, venue, slot in result.placed)
+        # user0 is busy in slot1, and slot2 is for lunch
+        self.assertEqual(placed[new_talk][1], slot3)
+        self.assertEqual(len(placed), 3)
+        self.assertEqual(set(placed[other][1] for other in others),
+                         set([slot1, slot3]))
+
+    def test_repair(self):
+        """Check that placed talks are moved to make room."""
+        slot1, slot2 = make_slots(self.day2, 2)
+        # Only venue 1 is available, so each talk needs its own slot.
+        # Placing talk1 in slot1 first leaves talk2 nowhere to go, unless
+        # talk1 is moved.
+        talk1 = self.make_talk('Talk 1', self.users[0])
+        talk2 = self.make_talk('Talk 2', self.users[1])
+        busy = self.make_talk('Busy', self.users[1])
+        # user1 is busy in slot2 (in a venue that isn't available, so it
+        # doesn't use up a free cell)
+        item = ScheduleItem.objects.create(venue=self.venue2, talk=busy)
+        item.slots.add(slot2)
+        solver = ScheduleSolver()
+        solver.talks = [talk1, talk2]
+        # Force the greedy pass to put talk1 in slot1
+        solver.cells.sort(key=lambda cell: cell[1] != slot1)
+        result = solver.solve()
+        self.assertEqual(result.unplaced, [])
+        placed = dict((talk, slot) for talk, _, slot in result.placed)
+        self.assertEqual(placed, {talk1: slot2, talk2: slot1})
+
+    def test_unplaced(self):
+        make_slots(self.day2, 1)
+        talks = [self.make_talk('Talk %d' % x, self.users[0])
+                 for x in range(2)]
+        result = ScheduleSolver().solve()
+        self.assertEqual(len(result.placed), 1)
+        [(talk, reason)] = result.unplaced
+        self.assertIn(talk, talks)
+        self.assertEqual(reason, 'No free slots')
+
+    def test_benchmark(self):
+        """Check that a large conference is solved without a query or a
+           scan of all the free slots for each talk."""
+        venues = [self.venue1, self.venue2]
+        for x in range(4):
+            venue = Venue.objects.create(order=3 + x, name='V%d' % x)
+            venue.days.add(self.day1, self.day2)
+            venues.append(venue)
+        make_slots(self.day1, 20)
+        make_slots(self.day2, 20)
+        users = [get_user_model().objects.create_user(
+            'speaker%d' % x, 'speaker%d@wafer.test' % x, 'password')
+            for x in range(150)]
+        for x in range(200):
+            self.make_talk('Talk %d' % x, users[x % 150],
+                           users[(x * 7) % 150])
+        solver = ScheduleSolver()
+        fits = ScheduleSolver._fits
+        with mock.patch.object(ScheduleSolver, '_fits', autospec=True,
+                               side_effect=fits) as counter:
+            # Everything is loaded up front
+            with self.assertNumQueries(0):
+                result = solver.solve()
+        # A talk is checked against a handful of cells, rather than all
+        # 220 of them
+        self.assertEqual(len(solver.talks), 200)
+        self.assertLess(counter.call_count, 10 * len(solver.talks))
+        self.assertEqual(result.unplaced, [])
+        self.assert_placed(result)
+
+    def test_command(self):
+        make_slots(self.day1, 1)
+        talk = self.make_talk('Talk', self.users[0])
+        out = StringIO()
+        call_command('wafer_schedule_talks', dry_run=True, stdout=out)
+        self.assertIn('Placed 1 talks', out.getvalue())
+        self.assertFalse(ScheduleItem.objects.exists())
+        call_command('wafer_schedule_talks', stdout=out)
+        self.assertEqual(ScheduleItem.objects.get().talk, talk)
+
+    def test_admin_action(self):
+        make_slots(self.day1, 1)
+        talk1 = self.make_talk('Talk 1', self.users[0])
+        self.make_talk('Talk 2', self.users[1])
+        get_user_model().objects.create_superuser(
+            'admin', 'admin@wafer.test', 'password')
+        c = Client()
+        c.login(username='admin', password='password')
+        response = c.post('/admin/talks/talk/', {
+            'action': 'schedule_talks',
+            '_selected_action': [talk1.pk]})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(ScheduleItem.objects.get().talk, talk1)
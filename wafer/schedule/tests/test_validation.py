@@ -0,0 +1,275 @@
+import datetime as D
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from wafer.pages.models import Page
+from wafer.schedule.admin import check_schedule
+from wafer.schedule.models import (
+    Day, Venue, Slot, ScheduleItem, ScheduleFinding)
+from wafer.schedule.validation import (
+    get_schedule_errors, rebuild_findings, mark_stale, ScheduleIndex,
+    validate_schedule)
+from wafer.talks.models import Talk, ACCEPTED, REJECTED
+from wafer.utils import QueryTracker
+
+
+def stored_findings():
+    return set(ScheduleFinding.objects.values_list(
+        'rule', 'item_id', 'slot_id'))
+
+
+class IncrementalValidationTests(TestCase):
+
+    def setUp(self):
+        # Schedule is
+        #         Venue 1     Venue 2
+        # 10-11   Talk        Page
+        # 11-12   --          --
+        self.day1 = Day.objects.create(date=D.date(2013, 9, 22))
+        self.day2 = Day.objects.create(date=D.date(2013, 9, 23))
+        self.venue1 = Venue.objects.create(order=1, name='Venue 1')
+        self.venue2 = Venue.objects.create(order=2, name='Venue 2')
+        self.venue1.days.add(self.day1)
+        self.venue2.days.add(self.day1)
+
+        self.slot1 = Slot.objects.create(day=self.day1,
+                                         start_time=D.time(10, 0, 0),
+                                         end_time=D.time(11, 0, 0))
+        self.slot2 = Slot.objects.create(previous_slot=self.slot1,
+                                         end_time=D.time(12, 0, 0))
+
+        user = get_user_model().objects.create_user(
+            'john', 'best@wafer.test', 'johnpassword')
+        self.talk = Talk.objects.create(title="Test talk", status=ACCEPTED,
+                                        corresponding_author_id=user.id)
+        self.page = Page.objects.create(name="test page", slug="test")
+
+        self.item1 = ScheduleItem.objects.create(venue=self.venue1,
+                                                 talk=self.talk)
+        self.item1.slots.add(self.slot1)
+        self.item2 = ScheduleItem.objects.create(venue=self.venue2,
+                                                 page=self.page)
+        self.item2.slots.add(self.slot1)
+
+    def assert_matches_rebuild(self):
+        """The incrementally maintained findings should be the same as
+           validating the whole schedule."""
+        incremental = stored_findings()
+        rebuild_findings()
+        self.assertEqual(incremental, stored_findings())
+
+    def test_valid(self):
+        self.assertTrue(check_schedule())
+        self.assertEqual(stored_findings(), set())
+
+    def test_clash(self):
+        self.item2.venue = self.venue1
+        self.item2.save()
+        self.assertFalse(check_schedule())
+        self.assertEqual(stored_findings(), set([
+            ('clashes', self.item1.pk, self.slot1.pk),
+            ('clashes', self.item2.pk, self.slot1.pk)]))
+        errors = get_schedule_errors()
+        self.assertEqual(list(errors), ['clashes'])
+        self.assertEqual(set(errors['clashes'][(self.venue1, self.slot1)]),
+                         set([self.item1, self.item2]))
+        self.assert_matches_rebuild()
+
+        # Moving the item to the next slot resolves the clash
+        self.item2.slots.remove(self.slot1)
+        self.item2.slots.add(self.slot2)
+        self.assertTrue(check_schedule())
+        self.assert_matches_rebuild()
+
+        # As does deleting it, when it's moved back
+        self.slot2.scheduleitem_set.clear()
+        self.slot1.scheduleitem_set.add(self.item2)
+        self.assertFalse(check_schedule())
+        self.item2.delete()
+        self.assertTrue(check_schedule())
+        self.assert_matches_rebuild()
+
+    def test_duplicates(self):
+        item3 = ScheduleItem.objects.create(venue=self.venue2,
+                                            talk=self.talk)
+        item3.slots.add(self.slot2)
+        self.assertFalse(check_schedule())
+        self.assertEqual(stored_findings(), set([
+            ('duplicates', self.item1.pk, None),
+            ('duplicates', item3.pk, None)]))
+        self.assert_matches_rebuild()
+
+        # Changing the talk clears both items
+        item3.talk = None
+        item3.page = self.page
+        item3.save()
+        self.assertTrue(check_schedule())
+        self.assert_matches_rebuild()
+
+    def test_talk_status(self):
+        self.talk.status = REJECTED
+        self.talk.save()
+        self.assertFalse(check_schedule())
+        self.assertEqual(stored_findings(), set([
+            ('validation', self.item1.pk, None)]))
+        self.talk.status = ACCEPTED
+        self.talk.save()
+        self.assertTrue(check_schedule())
+
+    def test_slot_changes(self):
+        # Stretch the first slot, so it overlaps the second
+        self.slot1.end_time = D.time(11, 30, 0)
+        self.slot1.save()
+        slot2 = Slot.objects.create(day=self.day1,
+                                    start_time=D.time(11, 0, 0),
+                                    end_time=D.time(11, 15, 0))
+        self.assertFalse(check_schedule())
+        self.assertEqual(stored_findings(), set([
+            ('overlaps', None, self.slot1.pk),
+            ('overlaps', None, slot2.pk)]))
+        self.assert_matches_rebuild()
+        slot2.delete()
+        self.assertTrue(check_schedule())
+
+        # The items in the slot chain need to move with the slots
+        self.item1.slots.add(self.slot2)
+        self.slot1.day = self.day2
+        self.slot1.save()
+        self.assertFalse(check_schedule())
+        self.assertEqual(stored_findings(), set([
+            ('venues', self.item1.pk, None),
+            ('venues', self.item2.pk, None)]))
+        self.assert_matches_rebuild()
+
+        self.venue1.days.add(self.day2)
+        self.day2.venue_set.add(self.venue2)
+        self.assertTrue(check_schedule())
+        self.assert_matches_rebuild()
+
+        # Removing a slot from the middle of the item's slots
+        slot3 = Slot.objects.create(previous_slot=self.slot2,
+                                    end_time=D.time(13, 0, 0))
+        self.item1.slots.add(slot3)
+        self.assertTrue(check_schedule())
+        self.slot2.end_time = D.time(12, 30, 0)
+        self.slot2.save()
+        self.assertTrue(check_schedule())
+        self.item1.slots.remove(self.slot2)
+        self.assertFalse(check_schedule())
+        self.assertEqual(stored_findings(), set([
+            ('non_contiguous', self.item1.pk, None)]))
+        self.assert_matches_rebuild()
+
+    def test_speakers(self):
+        """Check that speakers with two talks at the same time are
+           found."""
+        user = self.talk.corresponding_author
+        self.talk.authors.add(user)
+        other = get_user_model().objects.create_user(
+            'jane', 'jane@wafer.test', 'janepassword')
+        talk2 = Talk.objects.create(title="Test talk 2", status=ACCEPTED,
+                                    corresponding_author_id=other.id)
+        talk2.authors.add(other)
+        venue3 = Venue.objects.create(order=3, name='Venue 3')
+        venue3.days.add(self.day1)
+        item3 = ScheduleItem.objects.create(venue=venue3, talk=talk2)
+        item3.slots.add(self.slot1)
+        self.assertTrue(check_schedule())
+
+        talk2.authors.add(user)
+        self.assertFalse(check_schedule())
+        double_booked = set([
+            ('speakers', self.item1.pk, user.pk),
+            ('speakers', item3.pk, user.pk)])
+        self.assertEqual(set(ScheduleFinding.objects.values_list(
+            'rule', 'item_id', 'person_id')), double_booked)
+        self.assertEqual(get_schedule_errors(), {
+            'speakers': {user: [self.item1, item3]}})
+        self.assert_matches_rebuild()
+
+        # Moving the talk to the next slot resolves it
+        item3.slots.remove(self.slot1)
+        item3.slots.add(self.slot2)
+        self.assertTrue(check_schedule())
+        item3.slots.add(self.slot1)
+        self.assertFalse(check_schedule())
+        self.assert_matches_rebuild()
+
+        # As does removing the speaker, from either side
+        talk2.authors.remove(user)
+        self.assertTrue(check_schedule())
+        user.talks.add(talk2)
+        self.assertFalse(check_schedule())
+        user.talks.remove(talk2)
+        self.assertTrue(check_schedule())
+        talk2.authors.add(user)
+        self.assertFalse(check_schedule())
+        talk2.authors.clear()
+        self.assertTrue(check_schedule())
+        self.assert_matches_rebuild()
+
+        # Or removing the clashing item
+        talk2.authors.add(user)
+        self.assertFalse(check_schedule())
+        self.item1.delete()
+        self.assertTrue(check_schedule())
+        self.assert_matches_rebuild()
+
+    def test_stale(self):
+        """Check that stale findings are rebuilt when the schedule is
+           checked."""
+        self.assertTrue(check_schedule())
+        ScheduleFinding.objects.create(rule=ScheduleFinding.CLASHES,
+                                       item=self.item1, slot=self.slot1)
+        mark_stale()
+        self.assertTrue(check_schedule())
+        self.assertEqual(stored_findings(), set())
+
+    def test_check_schedule_queries(self):
+        """Check that checking the schedule doesn't depend on the size of
+           the schedule."""
+        check_schedule.invalidate()
+        with QueryTracker() as tracker:
+            self.assertTrue(check_schedule())
+            num_queries = len(tracker.queries)
+        prev = self.slot2
+        for hour in range(13, 20):
+            prev = Slot.objects.create(previous_slot=prev,
+                                       end_time=D.time(hour, 0, 0))
+            item = ScheduleItem.objects.create(venue=self.venue1,
+                                               page=self.page)
+            item.slots.add(prev)
+        check_schedule.invalidate()
+        with QueryTracker() as tracker:
+            self.assertTrue(check_schedule())
+            self.assertEqual(len(tracker.queries), num_queries)
+
+    def test_single_pass_queries(self):
+        """Check that validating the schedule takes a fixed number of
+           queries."""
+        with QueryTracker() as tracker:
+            validate_schedule(ScheduleIndex())
+            num_queries = len(tracker.queries)
+        prev = self.slot2
+        for hour in range(13, 20):
+            prev = Slot.objects.create(previous_slot=prev,
+                                       end_time=D.time(hour, 0, 0))
+            item = ScheduleItem.objects.create(venue=self.venue1,
+                                               page=self.page)
+            item.slots.add(prev, self.slot1)
+        with QueryTracker() as tracker:
+            report = validate_schedule(ScheduleIndex())
+            self.assertEqual(len(tracker.queries), num_queries)
+        self.assertFalse(report.is_valid())
+
+    def test_report_matches_findings(self):
+        """Check that the report built from the stored findings matches
+           validating the schedule directly."""
+        item3 = ScheduleItem.objects.create(venue=self.venue1,
+                                            talk=self.talk)
+        item3.slots.add(self.slot1, self.slot2)
+        self.day2.venue_set.add(self.venue2)
+        report = validate_schedule()
+        self.assertEqual(sorted(report.errors()), ['clashes', 'duplicates'])
+        self.assertEqual(get_schedule_errors(), report.errors())
@@ -1,3 +1,5 @@
+import gzip
+import io
 import json
 import datetime as D
 
@@ -6,7 +8,9 @@ from django.contrib.auth import get_user_model
 
 from wafer.talks.models import Talk, ACCEPTED
 from wafer.pages.models import Page
-from wafer.schedule.models import Day, Venue, Slot, ScheduleItem
+from wafer.schedule.models import (
+    Day, Venue, Slot, ScheduleItem, bump_schedule_version)
+from wafer.schedule.views import DaySlotIndex
 from wafer.utils import QueryTracker
 
 
@@ -211,6 +215,51 @@ class ScheduleViewTests(TestCase):
         assert day1.rows[2].get_sorted_items()[1]['rowspan'] == 1
         assert day1.rows[2].get_sorted_items()[1]['colspan'] == 1
 
+    def test_query_count_flat(self):
+        """Check that the number of queries needed to render the schedule
+           doesn't grow with the number of slots"""
+        day1 = Day.objects.create(date=D.date(2013, 9, 22))
+        venue1 = Venue.objects.create(order=1, name='Venue 1')
+        venue1.days.add(day1)
+        venue2 = Venue.objects.create(order=2, name='Venue 2')
+        venue2.days.add(day1)
+        person = get_user_model().objects.create_user('person')
+
+        def add_slots(prev, n):
+            """Add n chained 10 minute slots after prev, with an item
+               in each venue"""
+            start = D.datetime.combine(day1.date, prev.end_time)
+            pages = make_pages(2 * n)
+            for page in pages:
+                page.people.add(person)
+            for x in range(n):
+                start += D.timedelta(minutes=10)
+                prev = Slot.objects.create(previous_slot=prev,
+                                           end_time=start.time())
+                items = make_items([venue1, venue2], pages[2 * x:])
+                for item in items:
+                    item.slots.add(prev)
+            return prev
+
+        def count_queries():
+            c = Client()
+            # Ensure the check_schedule result is cached
+            c.get('/schedule/')
+            # But not the rendered schedule
+            bump_schedule_version()
+            with QueryTracker() as tracker:
+                response = c.get('/schedule/')
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, 'by person')
+            return len(tracker.queries)
+
+        slot = Slot.objects.create(day=day1, start_time=D.time(8, 0, 0),
+                                   end_time=D.time(8, 10, 0))
+        slot = add_slots(slot, 5)
+        small = count_queries()
+        add_slots(slot, 20)
+        self.assertEqual(count_queries(), small)
+
     def test_multiple_days(self):
         """Create a multiple day table with 3 slots and 2 venues and
            check we get the expected results"""
@@ -914,6 +963,289 @@ class CurrentViewTests(TestCase):
                           'time': cur1.strftime('%H:%M')})
         assert response.context['active'] is False
 
+    def test_slot_index(self):
+        """Check finding the slots around a time, including gaps between
+           slots and times outside the day."""
+        day1 = Day.objects.create(date=D.date(2013, 9, 22))
+        slot1 = Slot.objects.create(day=day1, start_time=D.time(10, 0, 0),
+                                    end_time=D.time(11, 0, 0))
+        slot2 = Slot.objects.create(previous_slot=slot1,
+                                    end_time=D.time(12, 0, 0))
+        slot3 = Slot.objects.create(day=day1, start_time=D.time(13, 0, 0),
+                                    end_time=D.time(14, 0, 0))
+        index = DaySlotIndex(day1)
+        self.assertEqual(index.find_slots(D.time(9, 0)),
+                         (None, None, slot1))
+        self.assertEqual(index.find_slots(D.time(10, 0)),
+                         (None, slot1, slot2))
+        self.assertEqual(index.find_slots(D.time(11, 0)),
+                         (slot1, slot2, slot3))
+        self.assertEqual(index.find_slots(D.time(12, 30)),
+                         (slot2, None, slot3))
+        self.assertEqual(index.find_slots(D.time(13, 59)),
+                         (slot2, slot3, None))
+        self.assertEqual(index.find_slots(D.time(14, 0)),
+                         (slot3, None, None))
+
+    def test_current_view_query_count_flat(self):
+        """Check that the number of queries doesn't grow with the number
+           of slots in the day."""
+        day1 = Day.objects.create(date=D.date(2013, 9, 22))
+        venue1 = Venue.objects.create(order=1, name='Venue 1')
+        venue1.days.add(day1)
+        pages = make_pages(40)
+        slots = [Slot.objects.create(day=day1, start_time=D.time(8, 0, 0),
+                                     end_time=D.time(8, 10, 0))]
+
+        def count_queries(n):
+            for x in range(n):
+                end = D.datetime.combine(day1.date, slots[-1].end_time)
+                end += D.timedelta(minutes=10)
+                slot = Slot.objects.create(previous_slot=slots[-1],
+                                           end_time=end.time())
+                slots.append(slot)
+                [item] = make_items([venue1], [pages.pop()])
+                item.slots.add(slot)
+            c = Client()
+            params = {'day': '2013-09-22', 'time': '08:15'}
+            # Ensure the index is cached
+            c.get('/schedule/current/', params)
+            with QueryTracker() as tracker:
+                response = c.get('/schedule/current/', params)
+            self.assertEqual(len(response.context['slots']), 3)
+            return len(tracker.queries)
+
+        small = count_queries(5)
+        self.assertEqual(count_queries(30), small)
+
+
+class ScheduleCacheTests(TestCase):
+    def setUp(self):
+        self.venue = make_venue()
+        self.venue.days.add(Day.objects.create(date=D.date(2013, 9, 23)))
+        [self.page] = make_pages(1)
+        [self.item] = make_items([self.venue], [self.page])
+        self.slot = Slot.objects.create(day=self.venue.days.get(),
+                                        start_time=D.time(10, 0, 0),
+                                        end_time=D.time(11, 0, 0))
+        self.item.slots.add(self.slot)
+
+    def test_schedule_cached(self):
+        """Check that repeat hits use the cached schedule, and changes to
+           the schedule are picked up."""
+        c = Client()
+        for url in ('/schedule/', '/schedule/pentabarf.xml'):
+            response = c.get(url)
+            self.assertContains(response, 'Item 0')
+            with QueryTracker() as tracker:
+                response = c.get(url)
+                # Only the (database) cache is used
+                for query in tracker.queries:
+                    self.assertIn('wafer_cache_table', query['sql'])
+            self.assertContains(response, 'Item 0')
+
+        self.item.details = 'Changed item'
+        self.item.save()
+        for url in ('/schedule/', '/schedule/pentabarf.xml'):
+            self.assertContains(c.get(url), 'Changed item')
+
+        self.item.slots.clear()
+        self.assertNotContains(c.get('/schedule/'), 'Changed item')
+
+    def test_speaker_changes(self):
+        """Check that changes to the people shown on the schedule are
+           picked up."""
+        person = get_user_model().objects.create_user(
+            'person', first_name='Jane', last_name='Speaker')
+        c = Client()
+        self.assertNotContains(c.get('/schedule/'), 'Jane Speaker')
+        self.page.people.add(person)
+        self.assertContains(c.get('/schedule/'), 'Jane Speaker')
+
+        person.last_name = 'Renamed'
+        person.save()
+        response = c.get('/schedule/')
+        self.assertContains(response, 'Jane Renamed')
+        self.assertNotContains(response, 'Jane Speaker')
+
+    def test_per_day_cached(self):
+        """Check that each day is cached separately."""
+        self.venue.days.add(Day.objects.create(date=D.date(2013, 9, 24)))
+        c = Client()
+        self.assertContains(c.get('/schedule/', {'day': '2013-09-23'}),
+                            'Item 0')
+        self.assertNotContains(c.get('/schedule/', {'day': '2013-09-24'}),
+                               'Item 0')
+        self.assertContains(c.get('/schedule/', {'day': 'invalid'}),
+                            'Item 0')
+
+    def test_conditional_get(self):
+        """Check that unchanged schedules get a 304 without any of the
+           schedule being generated."""
+        c = create_client('super', superuser=True)
+        for url in ('/schedule/', '/schedule/pentabarf.xml',
+                    '/schedule/api/scheduleitems/'):
+            response = c.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            last_modified = response['Last-Modified']
+            with QueryTracker() as tracker:
+                response = c.get(url, HTTP_IF_NONE_MATCH=etag)
+                for query in tracker.queries:
+                    self.assertNotIn('"schedule_', query['sql'])
+            self.assertEqual(response.status_code, 304)
+            response = c.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 304)
+
+            self.item.details = 'Changed item'
+            self.item.save()
+            response = c.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_conditional_get_speaker_changes(self):
+        """Check that revalidating after a speaker's name changes gets
+           the new schedule, rather than a 304."""
+        person = get_user_model().objects.create_user(
+            'person', first_name='Jane', last_name='Speaker')
+        self.page.people.add(person)
+        c = Client()
+        for n, url in enumerate(('/schedule/', '/schedule/pentabarf.xml')):
+            response = c.get(url)
+            self.assertContains(response, person.get_full_name())
+            etag = response['ETag']
+
+            person.last_name = 'Renamed%d' % n
+            person.save()
+            response = c.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, 'Jane Renamed%d' % n)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_per_user(self):
+        """Check that users don't get responses rendered for others."""
+        response = Client().get('/schedule/pentabarf.xml')
+        c = create_client('super', superuser=True)
+        response = c.get('/schedule/pentabarf.xml',
+                         HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_json(self):
+        """Check the JSON schedule, and that it's served from the cache."""
+        user = get_user_model().objects.create_user(
+            'john', 'best@wafer.test', 'johnpassword')
+        talk = Talk.objects.create(title="Test talk", status=ACCEPTED,
+                                   corresponding_author_id=user.id)
+        talk.authors.add(user)
+        item = ScheduleItem.objects.create(venue=self.venue, talk=talk)
+        next_slot = Slot.objects.create(previous_slot=self.slot,
+                                        end_time=D.time(12, 0, 0))
+        item.slots.add(next_slot)
+
+        c = Client()
+        response = c.get('/schedule/schedule.json')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        schedule = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(schedule['days'], [
+            {'date': '2013-09-23', 'venues': [self.venue.pk]}])
+        self.assertEqual(schedule['venues'], [
+            {'id': self.venue.pk, 'name': 'Venue 1',
+             'url': self.venue.get_absolute_url()}])
+        self.assertEqual(schedule['slots'], [
+            {'id': self.slot.pk, 'day': '2013-09-23',
+             'start_time': '10:00:00', 'end_time': '11:00:00'},
+            {'id': next_slot.pk, 'day': '2013-09-23',
+             'start_time': '11:00:00', 'end_time': '12:00:00'}])
+        self.assertEqual(schedule['items'], [
+            {'id': self.item.pk, 'venue': self.venue.pk,
+             'slots': [self.slot.pk], 'title': 'Item 0', 'speakers': [],
+             'url': self.page.get_absolute_url(), 'css_class': ''},
+            {'id': item.pk, 'venue': self.venue.pk, 'slots': [next_slot.pk],
+             'title': 'Test talk', 'speakers': ['john'],
+             'url': talk.get_absolute_url(), 'css_class': ''}])
+
+        with QueryTracker() as tracker:
+            response = c.get('/schedule/schedule.json',
+                             HTTP_ACCEPT_ENCODING='gzip, deflate')
+            for query in tracker.queries:
+                self.assertIn('wafer_cache_table', query['sql'])
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        content = gzip.GzipFile(fileobj=io.BytesIO(response.content)).read()
+        self.assertEqual(json.loads(content.decode('utf-8')), schedule)
+
+
+class ScheduleEditViewTests(TestCase):
+    def setUp(self):
+        self.day1 = Day.objects.create(date=D.date(2013, 9, 22))
+        self.day2 = Day.objects.create(date=D.date(2013, 9, 23))
+        self.venues = []
+        for x in range(3):
+            venue = Venue.objects.create(order=x, name='Venue %d' % x)
+            venue.days.add(self.day1, self.day2)
+            self.venues.append(venue)
+        self.user = get_user_model().objects.create_user(
+            'john', 'best@wafer.test', 'johnpassword')
+        self.client = create_client('super', superuser=True)
+
+    def add_slots(self, day, n):
+        """Add n slots to the day, with a talk in the first venue and a
+           page in the second."""
+        start = D.datetime.combine(day.date, D.time(8, 0, 0))
+        slots = []
+        for x in range(n):
+            slot = Slot.objects.create(
+                day=day, start_time=start.time(),
+                end_time=(start + D.timedelta(minutes=10)).time())
+            start += D.timedelta(minutes=10)
+            talk = Talk.objects.create(title='Talk %s %d' % (day.pk, x),
+                                       status=ACCEPTED,
+                                       corresponding_author=self.user)
+            item = ScheduleItem.objects.create(venue=self.venues[0],
+                                               talk=talk)
+            item.slots.add(slot)
+            page = Page.objects.create(name='Page %s %d' % (day.pk, x),
+                                       slug='page-%s-%d' % (day.pk, x))
+            item = ScheduleItem.objects.create(venue=self.venues[1],
+                                               page=page)
+            item.slots.add(slot)
+            slots.append(slot)
+        return slots
+
+    def get(self, day):
+        return self.client.get('/admin/schedule/scheduleitem/edit/%d'
+                               % day.pk)
+
+    def test_context(self):
+        [slot] = self.add_slots(self.day2, 1)
+        self.add_slots(self.day1, 2)
+        response = self.get(self.day2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['day'], self.day2)
+        [slot_context] = response.context['slots']
+        self.assertEqual(slot_context['id'], slot.pk)
+        self.assertEqual(slot_context['start_time'], D.time(8, 0, 0))
+        talk_venue, page_venue, empty_venue = slot_context['venues']
+        talk = Talk.objects.get(title='Talk %s 0' % self.day2.pk)
+        self.assertEqual(talk_venue['talk'], talk)
+        self.assertEqual(talk_venue['scheduleitem_id'], talk.talk_id)
+        self.assertEqual(page_venue['title'], 'Page %s 0' % self.day2.pk)
+        self.assertEqual(empty_venue, {'name': 'Venue 2',
+                                       'id': self.venues[2].pk})
+
+    def test_query_count_flat(self):
+        """Check that the number of queries doesn't depend on the number
+           of slots and items."""
+        self.add_slots(self.day2, 2)
+        with QueryTracker() as tracker:
+            response = self.get(self.day1)
+            self.assertEqual(len(response.context['slots']), 0)
+            small = len(tracker.queries)
+        self.add_slots(self.day1, 12)
+        with QueryTracker() as tracker:
+            response = self.get(self.day1)
+            self.assertEqual(len(response.context['slots']), 12)
+            self.assertEqual(len(tracker.queries), small)
+
 
 class ScheduleItemViewSetTests(TestCase):
     def test_unauthorized_users_are_forbidden(self):
@@ -1025,3 +1357,137 @@ class ScheduleItemViewSetTests(TestCase):
         self.assertEqual(response.status_code, 204)
         self.assertEqual(response.data, None)
         self.assertEqual(ScheduleItem.objects.count(), 0)
+
+    def batch(self, client, operations):
+        return client.post(
+            '/schedule/api/scheduleitems/batch/',
+            data=json.dumps({'operations': operations}),
+            content_type='application/json')
+
+    def test_batch(self):
+        venue1 = make_venue()
+        venue2 = Venue.objects.create(order=2, name='Venue 2')
+        slot1 = make_slot()
+        venue1.days.add(slot1.day)
+        venue2.days.add(slot1.day)
+        slot2 = Slot.objects.create(previous_slot=slot1,
+                                    end_time=D.time(16, 0, 0))
+        pages = make_pages(3)
+        [item1, item2] = make_items([venue1, venue1], pages)
+        item1.slots.add(slot1)
+        item2.slots.add(slot2)
+        c = create_client('super', superuser=True)
+        with QueryTracker() as tracker:
+            response = self.batch(c, [
+                # Replaces the page in item1
+                {'action': 'assign', 'venue': venue1.pk,
+                 'slots': [slot1.pk], 'page': pages[2].pk, 'talk': '',
+                 'replace': True},
+                {'action': 'assign', 'venue': venue2.pk,
+                 'slots': [slot1.pk, slot2.pk], 'page': pages[0].pk},
+                {'action': 'move', 'id': item2.pk, 'venue': venue2.pk},
+                {'action': 'remove', 'id': item2.pk},
+            ])
+            # The validation is only updated once
+            updates = [query for query in tracker.queries
+                       if 'DELETE FROM "schedule_schedulefinding"' in
+                       query['sql'] and '"rule" = \'clashes\'' in
+                       query['sql']]
+            self.assertEqual(len(updates), 1)
+        self.assertEqual(response.status_code, 200)
+        item3 = ScheduleItem.objects.get(venue=venue2)
+        self.assertEqual(response.data['items'], [
+            {'id': item1.pk, 'venue': venue1.pk, 'slots': [slot1.pk],
+             'talk': None, 'page': pages[2].pk},
+            {'id': item3.pk, 'venue': venue2.pk,
+             'slots': [slot1.pk, slot2.pk], 'talk': None,
+             'page': pages[0].pk},
+        ])
+        self.assertEqual(response.data['valid'], True)
+        self.assertEqual(response.data['findings'], [])
+        self.assertEqual(ScheduleItem.objects.count(), 2)
+
+        # Clash item3 with itself and a new item
+        response = self.batch(c, [
+            {'action': 'assign', 'venue': venue1.pk, 'slots': [slot2.pk],
+             'page': pages[1].pk},
+            {'action': 'move', 'id': item3.pk, 'venue': venue1.pk,
+             'slots': [slot2.pk]},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['valid'], False)
+        self.assertEqual(
+            sorted(finding['rule'] for finding in response.data['findings']),
+            ['clashes', 'clashes'])
+
+    def test_batch_assign_occupied(self):
+        """Check that assigning to an occupied venue and slot only replaces
+           the item's talk or page when asked to."""
+        venue = make_venue()
+        slot = make_slot()
+        venue.days.add(slot.day)
+        pages = make_pages(2)
+        [item] = make_items([venue], pages)
+        item.slots.add(slot)
+        c = create_client('super', superuser=True)
+        assign = {'action': 'assign', 'venue': venue.pk,
+                  'slots': [slot.pk], 'page': pages[1].pk}
+        response = self.batch(c, [assign])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('item %d is already in venue %d' % (item.pk, venue.pk),
+                      response.data[0])
+        self.assertEqual(ScheduleItem.objects.get().page, pages[0])
+
+        # Assigning the same page again is fine
+        response = self.batch(c, [dict(assign, page=pages[0].pk)])
+        self.assertEqual(response.status_code, 200)
+
+        response = self.batch(c, [dict(assign, replace=True)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['items'], [
+            {'id': item.pk, 'venue': venue.pk, 'slots': [slot.pk],
+             'talk': None, 'page': pages[1].pk}])
+
+    def test_batch_bulk_updates(self):
+        """Check that the changed items are updated in bulk."""
+        venue1 = make_venue()
+        venue2 = Venue.objects.create(order=2, name='Venue 2')
+        slots = [make_slot()]
+        for x in range(9):
+            slots.append(Slot.objects.create(
+                previous_slot=slots[-1], end_time=D.time(11 + x, 0, 0)))
+        pages = make_pages(10)
+        items = make_items([venue1] * 10, pages)
+        for item, slot in zip(items, slots):
+            item.slots.add(slot)
+        c = create_client('super', superuser=True)
+        with QueryTracker() as tracker:
+            response = self.batch(c, [
+                {'action': 'move', 'id': item.pk, 'venue': venue2.pk}
+                for item in items])
+            updates = [query for query in tracker.queries
+                       if query['sql'].startswith(
+                           'UPDATE "schedule_scheduleitem"')]
+            self.assertEqual(len(updates), 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ScheduleItem.objects.filter(venue=venue2).count(),
+                         10)
+        for item, slot in zip(items, slots):
+            self.assertEqual(list(item.slots.all()), [slot])
+
+    def test_batch_invalid(self):
+        venue = make_venue()
+        slot = make_slot()
+        c = create_client('super', superuser=True)
+        for operations in (
+                [{'action': 'explode'}],
+                [{'action': 'assign', 'venue': venue.pk}],
+                [{'action': 'assign', 'venue': venue.pk,
+                  'slots': [slot.pk + 1]}],
+                [{'action': 'remove', 'id': 'one'}]):
+            response = self.batch(c, operations)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(ScheduleItem.objects.count(), 0)
+        c = create_client('ordinary', superuser=False)
+        response = self.batch(c, [])
+        self.assertEqual(response.status_code, 403)
@@ -3,7 +3,8 @@ from rest_framework import routers
 
 
 from wafer.schedule.views import (
-    CurrentView, ScheduleView, ScheduleItemViewSet, ScheduleXmlView, VenueView)
+    CurrentView, ScheduleView, ScheduleIcalView, ScheduleItemViewSet,
+    ScheduleJsonView, ScheduleXmlView, VenueView)
 
 router = routers.DefaultRouter()
 router.register(r'scheduleitems', ScheduleItemViewSet)
@@ -12,8 +13,16 @@ urlpatterns = patterns(
     '',
     url(r'^$', ScheduleView.as_view(), name='wafer_full_schedule'),
     url(r'^venue/(?P<pk>\d+)/$', VenueView.as_view(), name='wafer_venue'),
+    url(r'^venue/(?P<venue_pk>\d+)/schedule\.ics$',
+        ScheduleIcalView.as_view(), name='wafer_venue_ical'),
+    url(r'^speaker/(?P<username>[\w.@+-]+)/schedule\.ics$',
+        ScheduleIcalView.as_view(), name='wafer_speaker_ical'),
     url(r'^current/$', CurrentView.as_view(), name='wafer_current'),
     url(r'^pentabarf\.xml$', ScheduleXmlView.as_view(),
         name='wafer_pentabarf_xml'),
+    url(r'^schedule\.json$', ScheduleJsonView.as_view(),
+        name='wafer_schedule_json'),
+    url(r'^schedule\.ics$', ScheduleIcalView.as_view(),
+        name='wafer_schedule_ical'),
     url(r'^api/', include(router.urls)),
 )
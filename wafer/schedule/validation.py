@@ -0,0 +1,664 @@
+"""Validation of the schedule.
+
+The rules are run by validate_schedule() over a ScheduleIndex, which
+loads the part of the schedule being checked in a fixed number of
+queries. All the rules run in a single pass, and the results are
+returned as a ValidationReport.
+
+The problems found are also stored as ScheduleFinding objects. These are
+updated incrementally when the schedule changes, by re-running the rules
+only over the neighbourhood of the changed object (the items in the same
+slots, the items for the same talk, the talks by the same speakers, the
+slots on the same day), so checking if the schedule is valid is a single
+query.
+
+The find_* functions check for a single kind of problem. They are kept
+to simplify testing.
+"""
+
+import datetime
+import heapq
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save)
+
+from wafer.schedule.models import (
+    ScheduleFinding, ScheduleItem, Slot, Venue, deferred_updates,
+    invalidate_check_schedule)
+from wafer.talks.models import Talk, ACCEPTED
+
+
+class ScheduleIndex(object):
+    """The schedule items and slots to validate, indexed for the rules.
+
+       items is a queryset or list of schedule items (all items by
+       default). overlap_slots is a queryset or list of the slots to
+       check for overlaps (all slots by default)."""
+
+    def __init__(self, items=None, overlap_slots=None):
+        links = ScheduleItem.slots.through.objects.all()
+        if items is None:
+            items = ScheduleItem.objects.order_by('pk')
+        else:
+            links = None
+        if not isinstance(items, list):
+            items = list(items.select_related('talk', 'page', 'venue'))
+        if links is None:
+            links = ScheduleItem.slots.through.objects.filter(
+                scheduleitem__in=[item.pk for item in items])
+        if overlap_slots is None:
+            overlap_slots = Slot.objects.select_related('effective_day')
+        self.items = items
+        self.overlap_slots = list(overlap_slots)
+
+        links = list(links.values_list('scheduleitem_id', 'slot_id'))
+        slots = dict((slot.pk, slot) for slot in self.overlap_slots)
+        missing = set(slot_id for _, slot_id in links) - set(slots)
+        if missing:
+            slots.update((slot.pk, slot) for slot in Slot.objects
+                         .select_related('effective_day')
+                         .filter(pk__in=missing))
+
+        # item pk -> the item's slots, ordered by end time
+        self.item_slots = dict((item.pk, []) for item in items)
+        for item_id, slot_id in links:
+            self.item_slots[item_id].append(slots[slot_id])
+        for item_slots in self.item_slots.values():
+            item_slots.sort(key=lambda slot: slot.end_time)
+
+        # (venue, slot) -> items, in order
+        self.by_position = {}
+        # talk -> items
+        self.by_talk = {}
+        for item in items:
+            for slot in self.item_slots[item.pk]:
+                self.by_position.setdefault((item.venue, slot), [])
+                self.by_position[(item.venue, slot)].append(item)
+            if item.talk_id is not None:
+                self.by_talk.setdefault(item.talk_id, []).append(item)
+
+        # talk pk -> authors
+        self.talk_authors = dict((talk_id, []) for talk_id in self.by_talk)
+        if self.talk_authors:
+            for link in Talk.authors.through.objects.filter(
+                    talk__in=list(self.talk_authors)).select_related('user'):
+                self.talk_authors[link.talk_id].append(link.user)
+
+        # venue pk -> set of day pks
+        self.venue_days = dict((item.venue_id, set()) for item in items)
+        for venue_id, day_id in Venue.days.through.objects.filter(
+                venue__in=list(self.venue_days)).values_list(
+                'venue_id', 'day_id'):
+            self.venue_days[venue_id].add(day_id)
+
+    def get_slots(self, item):
+        return self.item_slots[item.pk]
+
+
+class ValidationReport(object):
+    """The problems found in the schedule.
+
+       The attributes match the structure returned by the find_*
+       functions."""
+
+    def __init__(self):
+        # (venue, slot) -> items
+        self.clashes = {}
+        self.duplicates = []
+        self.validation = []
+        self.overlaps = set()
+        self.non_contiguous = []
+        # venue -> items
+        self.venues = {}
+        # person -> items
+        self.speakers = {}
+
+    def is_valid(self):
+        return not self.errors()
+
+    def errors(self):
+        """Return the problems found, keyed by rule, leaving out the
+           rules with no problems."""
+        errors = {}
+        for rule in ('clashes', 'duplicates', 'validation', 'overlaps',
+                     'non_contiguous', 'venues', 'speakers'):
+            if getattr(self, rule):
+                errors[rule] = getattr(self, rule)
+        return errors
+
+    def get_findings(self):
+        """Return the problems as (unsaved) ScheduleFinding objects."""
+        findings = []
+        for (venue, slot), items in self.clashes.items():
+            findings.extend(ScheduleFinding(rule=ScheduleFinding.CLASHES,
+                                            item=item, slot=slot)
+                            for item in items)
+        for rule in (ScheduleFinding.DUPLICATES, ScheduleFinding.VALIDATION,
+                     ScheduleFinding.NON_CONTIGUOUS):
+            findings.extend(ScheduleFinding(rule=rule, item=item)
+                            for item in getattr(self, rule))
+        for items in self.venues.values():
+            findings.extend(ScheduleFinding(rule=ScheduleFinding.VENUES,
+                                            item=item)
+                            for item in items)
+        for person, items in self.speakers.items():
+            findings.extend(ScheduleFinding(rule=ScheduleFinding.SPEAKERS,
+                                            item=item, person=person)
+                            for item in items)
+        findings.extend(ScheduleFinding(rule=ScheduleFinding.OVERLAPS,
+                                        slot=slot)
+                        for slot in self.overlaps)
+        return findings
+
+    def add_finding(self, finding):
+        """Add a stored finding to the report."""
+        if finding.rule == ScheduleFinding.CLASHES:
+            pos = (finding.item.venue, finding.slot)
+            self.clashes.setdefault(pos, []).append(finding.item)
+        elif finding.rule == ScheduleFinding.VENUES:
+            venue = finding.item.venue
+            self.venues.setdefault(venue, []).append(finding.item)
+        elif finding.rule == ScheduleFinding.SPEAKERS:
+            self.speakers.setdefault(finding.person, []).append(finding.item)
+        elif finding.rule == ScheduleFinding.OVERLAPS:
+            self.overlaps.add(finding.slot)
+        elif finding.rule != ScheduleFinding.STALE:
+            getattr(self, finding.rule).append(finding.item)
+
+
+def validate_schedule(index=None):
+    """Run all the validation rules over the index, and return a
+       ValidationReport."""
+    if index is None:
+        index = ScheduleIndex()
+    report = ValidationReport()
+    for item in index.items:
+        slots = index.get_slots(item)
+        # pending / rejected talks in the schedule, items with both
+        # talks and pages assigned and items with neither
+        if item.talk_id is not None and item.page_id is not None:
+            report.validation.append(item)
+        elif item.talk_id is None and item.page_id is None:
+            report.validation.append(item)
+        elif item.talk_id is not None and item.talk.status != ACCEPTED:
+            report.validation.append(item)
+        # items that have slots that aren't contiguous
+        for prev, slot in zip(slots, slots[1:]):
+            if prev.end_time != slot.get_start_time():
+                report.non_contiguous.append(item)
+                break
+        # venues assigned slots that aren't on the allowed list of days
+        days = index.venue_days[item.venue_id]
+        if not any(slot.effective_day_id in days for slot in slots):
+            report.venues.setdefault(item.venue, []).append(item)
+    for pos, items in index.by_position.items():
+        if len(items) > 1:
+            report.clashes[pos] = items
+    for items in index.by_talk.values():
+        # We currently allow duplicate pages for cases were we need
+        # disjoint schedule items, like multiple open space sessions on
+        # different days and similar cases. This may be revisited later
+        if len(items) > 1:
+            report.duplicates.extend(items)
+    report.speakers = _find_speaker_clashes(index)
+    report.overlaps = find_overlapping_slots(index.overlap_slots)
+    return report
+
+
+def _find_speaker_clashes(index):
+    """Find speakers with talks in the index at the same time.
+
+       We collect the times each speaker is busy, and sweep through them
+       in order of start time, keeping the intervals that haven't ended
+       yet. Any of those from a different item is a clash."""
+    # person -> [(start, end, item)]
+    intervals = {}
+    for talk_id, items in index.by_talk.items():
+        for item in items:
+            times = []
+            for slot in index.get_slots(item):
+                start = slot.get_start_time()
+                if slot.effective_day is None or start is None:
+                    continue
+                date = slot.effective_day.date
+                times.append((datetime.datetime.combine(date, start),
+                              datetime.datetime.combine(date,
+                                                        slot.end_time)))
+            for person in index.talk_authors[talk_id]:
+                intervals.setdefault(person, []).extend(
+                    (start, end, item) for start, end in times)
+    speakers = {}
+    for person, person_intervals in intervals.items():
+        person_intervals.sort(key=lambda interval: interval[:2])
+        booked = set()
+        active = []
+        for start, end, item in person_intervals:
+            active = [(other_end, other) for other_end, other in active
+                      if other_end > start]
+            for _, other in active:
+                if other != item:
+                    booked.update([item, other])
+            active.append((end, item))
+        if booked:
+            speakers[person] = sorted(booked, key=lambda item: item.pk)
+    return speakers
+
+
+def find_overlapping_slot_pairs(all_slots=None):
+    """Find all the pairs of slots that overlap.
+
+       For each day, we sort the slots by start time and sweep through
+       them, keeping a heap of the slots that haven't ended yet. Every
+       slot still in the heap when a new slot starts overlaps it, so this
+       is O(n log n) in the number of slots (plus the number of pairs
+       found)."""
+    if all_slots is None:
+        all_slots = Slot.objects.select_related('effective_day').all()
+    days = {}
+    for slot in all_slots:
+        if slot.get_start_time() is None or slot.end_time is None:
+            # Incomplete slots can't be placed on the timeline
+            continue
+        days.setdefault(slot.effective_day_id, []).append(slot)
+    pairs = []
+    for day_slots in days.values():
+        day_slots.sort(key=lambda slot: (slot.get_start_time(),
+                                         slot.end_time))
+        # Entries are (end_time, counter, slot). The counter avoids
+        # comparing slots when the end times match
+        active = []
+        for counter, slot in enumerate(day_slots):
+            start = slot.get_start_time()
+            while active and active[0][0] <= start:
+                heapq.heappop(active)
+            pairs.extend((other, slot) for _, _, other in active)
+            heapq.heappush(active, (slot.end_time, counter, slot))
+    return pairs
+
+
+def find_overlapping_slots(all_slots=None):
+    """Find any slots that overlap"""
+    overlaps = set([])
+    for slot, other_slot in find_overlapping_slot_pairs(all_slots):
+        overlaps.add(slot)
+        overlaps.add(other_slot)
+    return overlaps
+
+
+def _validate_items(all_items):
+    # The item rules don't need the slots checked for overlaps
+    return validate_schedule(ScheduleIndex(all_items, overlap_slots=[]))
+
+
+def find_non_contiguous(all_items=None):
+    """Find any items that have slots that aren't contiguous"""
+    return _validate_items(all_items).non_contiguous
+
+
+def validate_items(all_items=None):
+    """Find errors in the schedule. Check for:
+         - pending / rejected talks in the schedule
+         - items with both talks and pages assigned
+         - items with neither talks nor pages assigned
+         """
+    return _validate_items(all_items).validation
+
+
+def find_duplicate_schedule_items(all_items=None):
+    """Find talks / pages assigned to mulitple schedule items"""
+    return _validate_items(all_items).duplicates
+
+
+def find_clashes(all_items=None):
+    """Find schedule items which clash (common slot and venue)"""
+    return _validate_items(all_items).clashes
+
+
+def find_invalid_venues(all_items=None):
+    """Find venues assigned slots that aren't on the allowed list
+       of days."""
+    return _validate_items(all_items).venues
+
+
+def find_double_booked_speakers(all_items=None):
+    """Find speakers with talks scheduled at the same time.
+
+       Returns a dictionary of person -> the clashing items."""
+    return _validate_items(all_items).speakers
+
+
+def prefetch_schedule_items(queryset=None):
+    """Prefetch all schedule items (or the items in the given queryset)
+       and related objects."""
+    if queryset is None:
+        queryset = ScheduleItem.objects.all()
+    return list(queryset
+                .select_related(
+                    'talk', 'page', 'venue')
+                .prefetch_related(
+                    'slots', 'slots__previous_slot', 'slots__day'))
+
+
+def _filter_in(field, values):
+    """Q object for field in values, where values may include None"""
+    values = set(values)
+    query = Q(**{'%s__in' % field: [x for x in values if x is not None]})
+    if None in values:
+        query |= Q(**{'%s__isnull' % field: True})
+    return query
+
+
+def rebuild_findings():
+    """Validate the whole schedule, replacing all the stored findings.
+
+       Returns the number of problems found."""
+    with transaction.atomic():
+        ScheduleFinding.objects.all().delete()
+        findings = validate_schedule().get_findings()
+        ScheduleFinding.objects.bulk_create(findings)
+    invalidate_check_schedule()
+    return len(findings)
+
+
+def update_findings(items=(), slots=(), talks=(), days=(), people=()):
+    """Re-run the validation rules over the neighbourhood of a change.
+
+       items: primary keys of items to re-check the per-item rules for
+              (talk / page validation, contiguity and venue days).
+       slots: primary keys of slots to re-check for clashes.
+       talks: primary keys of talks to re-check for duplicates.
+       days: primary keys of days to re-check for overlapping slots. The
+             items scheduled on those days are re-checked as well, since
+             the slot times may have changed.
+       people: primary keys of people to re-check for double-booking.
+               The speakers of the items and talks are always
+               re-checked."""
+    items = set(items)
+    slots = set(slots)
+    talks = set(talk for talk in talks if talk is not None)
+    days = set(days)
+    people = set(people)
+    if getattr(deferred_updates, 'depth', 0):
+        scope = deferred_updates.scope
+        scope['items'].update(items)
+        scope['slots'].update(slots)
+        scope['talks'].update(talks)
+        scope['days'].update(days)
+        scope['people'].update(people)
+        return
+    with transaction.atomic():
+        day_slots = []
+        if days:
+            day_slots = list(Slot.objects.select_related('effective_day')
+                             .filter(_filter_in('effective_day', days)))
+            day_slot_pks = [slot.pk for slot in day_slots]
+            items.update(ScheduleItem.objects.filter(
+                slots__in=day_slot_pks).values_list('pk', flat=True))
+            ScheduleFinding.objects.filter(
+                rule=ScheduleFinding.OVERLAPS, slot__in=day_slot_pks).delete()
+        if slots:
+            ScheduleFinding.objects.filter(
+                rule=ScheduleFinding.CLASHES, slot__in=slots).delete()
+        if talks or items:
+            # Items without a talk can't be duplicates
+            ScheduleFinding.objects.filter(
+                Q(item__talk__in=talks) |
+                Q(item__in=items, item__talk__isnull=True),
+                rule=ScheduleFinding.DUPLICATES).delete()
+        if items:
+            ScheduleFinding.objects.filter(
+                rule__in=[ScheduleFinding.VALIDATION,
+                          ScheduleFinding.NON_CONTIGUOUS,
+                          ScheduleFinding.VENUES],
+                item__in=items).delete()
+        # All the talks of the affected speakers are re-checked
+        if talks or items:
+            people.update(Talk.authors.through.objects.filter(
+                Q(talk__in=talks) | Q(talk__scheduleitem__in=items)
+            ).values_list('user_id', flat=True))
+        speaker_items = set()
+        if people:
+            speaker_items.update(ScheduleItem.objects.filter(
+                talk__authors__in=people).values_list('pk', flat=True))
+            ScheduleFinding.objects.filter(
+                rule=ScheduleFinding.SPEAKERS, person__in=people).delete()
+
+        # One index covers the whole neighbourhood. The report is then
+        # restricted to the problems the neighbourhood is responsible for,
+        # since the index only sees part of the schedule.
+        index = ScheduleIndex(
+            ScheduleItem.objects.filter(
+                Q(pk__in=items | speaker_items) | Q(slots__in=slots) |
+                Q(talk__in=talks)
+            ).distinct(),
+            overlap_slots=day_slots)
+        report = validate_schedule(index)
+        report.clashes = dict((pos, clashing)
+                              for pos, clashing in report.clashes.items()
+                              if pos[1].pk in slots)
+        report.duplicates = [item for item in report.duplicates
+                             if item.talk_id in talks]
+        for rule in ('validation', 'non_contiguous'):
+            setattr(report, rule, [item for item in getattr(report, rule)
+                                   if item.pk in items])
+        for venue in list(report.venues):
+            report.venues[venue] = [item for item in report.venues[venue]
+                                    if item.pk in items]
+        report.speakers = dict((person, booked)
+                               for person, booked in report.speakers.items()
+                               if person.pk in people)
+        ScheduleFinding.objects.bulk_create(report.get_findings())
+    invalidate_check_schedule()
+
+
+def mark_stale():
+    """Flag the findings as needing a full rebuild."""
+    if getattr(deferred_updates, 'depth', 0):
+        deferred_updates.stale = True
+        return
+    ScheduleFinding.objects.get_or_create(rule=ScheduleFinding.STALE)
+    invalidate_check_schedule()
+
+
+@contextmanager
+def deferred_validation():
+    """Defer re-validating the schedule, and invalidating the cached
+       schedule, until the end of the block.
+
+       This is used when making many changes at once, so the rules are
+       only run once, over all the parts of the schedule that changed.
+       It should be used inside a transaction, since nothing is updated
+       if the block raises an exception."""
+    depth = getattr(deferred_updates, 'depth', 0)
+    if depth == 0:
+        deferred_updates.scope = {
+            'items': set(), 'slots': set(), 'talks': set(), 'days': set(),
+            'people': set()}
+        deferred_updates.stale = False
+        deferred_updates.invalidate = False
+    deferred_updates.depth = depth + 1
+    try:
+        yield
+    finally:
+        deferred_updates.depth = depth
+    if depth > 0:
+        return
+    if deferred_updates.stale:
+        mark_stale()
+    elif any(deferred_updates.scope.values()):
+        update_findings(**deferred_updates.scope)
+    elif deferred_updates.invalidate:
+        invalidate_check_schedule()
+
+
+def _ensure_current():
+    if ScheduleFinding.objects.filter(rule=ScheduleFinding.STALE).exists():
+        rebuild_findings()
+
+
+def schedule_is_valid():
+    """Return True if no problems have been found in the schedule."""
+    _ensure_current()
+    return not ScheduleFinding.objects.exists()
+
+
+def get_schedule_report():
+    """Return a ValidationReport for the stored findings."""
+    _ensure_current()
+    report = ValidationReport()
+    findings = ScheduleFinding.objects.select_related(
+        'item', 'item__venue', 'item__talk', 'item__page',
+        'slot', 'slot__effective_day', 'person').order_by('item__pk', 'pk')
+    for finding in findings:
+        report.add_finding(finding)
+    return report
+
+
+def get_schedule_errors():
+    """Return the stored problems, keyed by rule."""
+    return get_schedule_report().errors()
+
+
+# Signal handlers that keep the findings up to date. Where the
+# neighbourhood of a change depends on the old state of an object, we
+# record it on the instance in the pre_* handler.
+
+def _item_pre_save(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    instance._validation_old_talk = ScheduleItem.objects.filter(
+        pk=instance.pk).values_list('talk_id', flat=True).first()
+
+
+def _item_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        mark_stale()
+        return
+    update_findings(
+        items=[instance.pk],
+        slots=instance.slots.values_list('pk', flat=True),
+        talks=[instance.talk_id,
+               getattr(instance, '_validation_old_talk', None)])
+
+
+def _item_pre_delete(sender, instance, **kwargs):
+    instance._validation_old_slots = list(
+        instance.slots.values_list('pk', flat=True))
+
+
+def _item_deleted(sender, instance, **kwargs):
+    update_findings(slots=getattr(instance, '_validation_old_slots', ()),
+                    talks=[instance.talk_id])
+
+
+def _item_slots_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        related = instance.scheduleitem_set
+    else:
+        related = instance.slots
+    if action == 'pre_clear':
+        instance._validation_cleared = list(
+            related.values_list('pk', flat=True))
+        return
+    elif action == 'post_clear':
+        pk_set = getattr(instance, '_validation_cleared', ())
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if reverse:
+        update_findings(items=pk_set, slots=[instance.pk])
+    else:
+        update_findings(items=[instance.pk], slots=pk_set)
+
+
+def _slot_pre_save(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    instance._validation_old_day = Slot.objects.filter(
+        pk=instance.pk).values_list('effective_day_id', flat=True).first()
+
+
+def _slot_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        mark_stale()
+        return
+    update_findings(days=[instance.effective_day_id,
+                          getattr(instance, '_validation_old_day', None)])
+
+
+def _slot_pre_delete(sender, instance, **kwargs):
+    instance._validation_old_items = list(
+        instance.scheduleitem_set.values_list('pk', flat=True))
+
+
+def _slot_deleted(sender, instance, **kwargs):
+    update_findings(items=getattr(instance, '_validation_old_items', ()),
+                    days=[instance.effective_day_id])
+
+
+def _venue_days_changed(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    if action == 'pre_clear':
+        if reverse:
+            instance._validation_cleared = list(
+                instance.venue_set.values_list('pk', flat=True))
+        return
+    elif action == 'post_clear':
+        pk_set = getattr(instance, '_validation_cleared', ())
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if reverse:
+        items = ScheduleItem.objects.filter(venue__in=pk_set)
+    else:
+        items = ScheduleItem.objects.filter(venue=instance)
+    update_findings(items=items.values_list('pk', flat=True))
+
+
+def _talk_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        mark_stale()
+        return
+    items = instance.scheduleitem_set.values_list('pk', flat=True)
+    if items:
+        update_findings(items=items)
+
+
+def _talk_authors_changed(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    if reverse:
+        related = instance.talks
+    else:
+        related = instance.authors
+    if action == 'pre_clear':
+        instance._validation_cleared = list(
+            related.values_list('pk', flat=True))
+        return
+    elif action == 'post_clear':
+        pk_set = getattr(instance, '_validation_cleared', ())
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if reverse:
+        talks, people = pk_set, [instance.pk]
+    else:
+        talks, people = [instance.pk], pk_set
+    # Talks that aren't in the schedule can't double-book anyone
+    if ScheduleItem.objects.filter(talk__in=talks).exists():
+        update_findings(talks=talks, people=people)
+
+
+pre_save.connect(_item_pre_save, sender=ScheduleItem)
+post_save.connect(_item_saved, sender=ScheduleItem)
+pre_delete.connect(_item_pre_delete, sender=ScheduleItem)
+post_delete.connect(_item_deleted, sender=ScheduleItem)
+m2m_changed.connect(_item_slots_changed, sender=ScheduleItem.slots.through)
+
+pre_save.connect(_slot_pre_save, sender=Slot)
+post_save.connect(_slot_saved, sender=Slot)
+pre_delete.connect(_slot_pre_delete, sender=Slot)
+post_delete.connect(_slot_deleted, sender=Slot)
+
+m2m_changed.connect(_venue_days_changed, sender=Venue.days.through)
+post_save.connect(_talk_saved, sender=Talk)
+m2m_changed.connect(_talk_authors_changed, sender=Talk.authors.through)
@@ -1,13 +1,36 @@
+import bisect
 import datetime
-
-from django.views.generic import DetailView, TemplateView
+import gzip
+import hashlib
+import io
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.contrib.auth import get_user_model
+from django.contrib.sites.shortcuts import get_current_site
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
+from django.utils.decorators import method_decorator
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
+from django.views.decorators.http import condition
+from django.views.generic import DetailView, TemplateView, View
 
 from rest_framework import viewsets
+from rest_framework.decorators import list_route
+from rest_framework.response import Response
 from wafer.pages.models import Page
-from wafer.schedule.models import Venue, Slot, Day
+from wafer.schedule.models import (
+    Venue, Slot, Day, get_schedule_version, get_schedule_last_modified)
 from wafer.schedule.admin import check_schedule
-from wafer.schedule.models import ScheduleItem
-from wafer.schedule.serializers import ScheduleItemSerializer
+from wafer.schedule.ical import CalendarEvents
+from wafer.schedule.pentabarf import PentabarfExporter
+from wafer.schedule.models import ScheduleItem, ScheduleFinding
+from wafer.schedule.serializers import (
+    ScheduleBatchSerializer, ScheduleItemSerializer)
+from wafer.schedule.validation import schedule_is_valid
 from wafer.talks.models import ACCEPTED
 from wafer.talks.models import Talk
 
@@ -33,9 +56,11 @@ class ScheduleRow(object):
 
 class ScheduleDay(object):
     """A helpful container for information a days in a schedule view."""
-    def __init__(self, day):
+    def __init__(self, day, venues=None):
         self.day = day
-        self.venues = list(day.venue_set.all())
+        if venues is None:
+            venues = day.venue_set.all()
+        self.venues = list(venues)
         self.rows = []
 
 
@@ -44,13 +69,17 @@ class VenueView(DetailView):
     model = Venue
 
 
-def make_schedule_row(schedule_day, slot, seen_items):
-    """Create a row for the schedule table."""
+def make_schedule_row(schedule_day, slot, seen_items, all_items=None):
+    """Create a row for the schedule table.
+
+       all_items is the list of schedule items in the slot. If it isn't
+       given, it is fetched from the database."""
     row = ScheduleRow(schedule_day, slot)
     skip = []
-    all_items = list(slot.scheduleitem_set
-                     .select_related('talk', 'page', 'venue')
-                     .all())
+    if all_items is None:
+        all_items = list(slot.scheduleitem_set
+                         .select_related('talk', 'page', 'venue')
+                         .all())
 
     for item in all_items:
         if item in seen_items:
@@ -81,47 +110,371 @@ def make_schedule_row(schedule_day, slot, seen_items):
     return row
 
 
+class ScheduleGrid(object):
+    """All the information needed to lay out the schedule table.
+
+       The days, venues, slots and schedule items are loaded in a fixed
+       number of queries, independent of the size of the schedule, so
+       the rows, rowspans and colspans can be computed in memory."""
+
+    def __init__(self, today=None, slots=None):
+        """If slots is given, the grid is restricted to those slots
+           (which should all be on today)."""
+        self.today = today
+
+        self.venues = {}
+        for venue in Venue.objects.prefetch_related('days').all():
+            for day in venue.days.all():
+                self.venues.setdefault(day.pk, []).append(venue)
+
+        items = ScheduleItem.objects.all()
+        slot_links = ScheduleItem.slots.through.objects.all()
+        if slots is None:
+            slots = Slot.objects.select_related('effective_day')
+            if today is not None:
+                slots = slots.filter(effective_day=today)
+            self.slots = list(slots.order_by('end_time', 'start_time', 'day'))
+        else:
+            self.slots = list(slots)
+            items = items.filter(slots__in=self.slots).distinct()
+            slot_links = slot_links.filter(slot__in=self.slots)
+
+        items = dict((item.pk, item) for item in items
+                     .select_related('talk', 'page', 'venue',
+                                     'talk__corresponding_author',
+                                     'talk__talk_type')
+                     .prefetch_related('talk__authors__userprofile',
+                                       'page__people__userprofile'))
+        self.items = {}
+        slot_links = slot_links.values_list(
+            'slot_id', 'scheduleitem_id').order_by('scheduleitem_id')
+        for slot_id, item_id in slot_links:
+            self.items.setdefault(slot_id, []).append(items[item_id])
+
+    def get_schedule_day(self, day):
+        """Return an empty ScheduleDay for the given day."""
+        return ScheduleDay(day, self.venues.get(day.pk, []))
+
+    def get_items(self, slot):
+        """Return the schedule items in the given slot."""
+        return self.items.get(slot.pk, [])
+
+    def make_row(self, schedule_day, slot, seen_items):
+        return make_schedule_row(schedule_day, slot, seen_items,
+                                 self.get_items(slot))
+
+    def get_schedule_days(self):
+        """Return the ordered list of schedule days."""
+        schedule_days = {}
+        seen_items = {}
+        for slot in self.slots:
+            day = slot.get_day()
+            schedule_day = schedule_days.get(day)
+            if schedule_day is None:
+                schedule_day = schedule_days[day] = self.get_schedule_day(day)
+            row = self.make_row(schedule_day, slot, seen_items)
+            schedule_day.rows.append(row)
+        return sorted(schedule_days.values(), key=lambda x: x.day.date)
+
+
 def generate_schedule(today=None):
     """Helper function which creates an ordered list of schedule days"""
-    # We create a list of slots and schedule items
-    schedule_days = {}
-    seen_items = {}
-    for slot in Slot.objects.all().order_by('end_time', 'start_time', 'day'):
-        day = slot.get_day()
-        if today and day != today:
-            # Restrict ourselves to only today
-            continue
-        schedule_day = schedule_days.get(day)
-        if schedule_day is None:
-            schedule_day = schedule_days[day] = ScheduleDay(day)
-        row = make_schedule_row(schedule_day, slot, seen_items)
-        schedule_day.rows.append(row)
-    return sorted(schedule_days.values(), key=lambda x: x.day.date)
+    return ScheduleGrid(today).get_schedule_days()
+
+
+SCHEDULE_CACHE_TIMEOUT = 60 * 60
+
+
+def _schedule_cache_key(prefix, *parts):
+    """Cache key for something rendered from the current version of the
+       schedule."""
+    parts = (prefix, get_schedule_version(), get_language()) + parts
+    return ':'.join(str(part) for part in parts)
+
+
+def schedule_etag(request, *args, **kwargs):
+    """ETag for a response rendered from the current version of the
+       schedule.
+
+       The response may also depend on the query, the requested format,
+       the language and the user, so these are included too."""
+    parts = (get_schedule_version(), get_language(),
+             request.get_full_path(), request.META.get('HTTP_ACCEPT', ''),
+             request.META.get('HTTP_ACCEPT_ENCODING', ''),
+             request.user.pk, request.user.is_staff)
+    key = ':'.join(str(part) for part in parts)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def schedule_last_modified(request, *args, **kwargs):
+    return get_schedule_last_modified()
+
+
+# Answer conditional requests before generating the schedule
+schedule_condition = method_decorator(condition(
+    etag_func=schedule_etag, last_modified_func=schedule_last_modified))
+
+
+def _get_schedule_day(day):
+    """Return the Day for the given date string, or None if there isn't
+       one."""
+    dates = dict([(x.date.strftime('%Y-%m-%d'), x) for x in
+                  Day.objects.all()])
+    return dates.get(day, None)
 
 
 class ScheduleView(TemplateView):
     template_name = 'wafer.schedule/full_schedule.html'
+    table_template_name = 'wafer.schedule/schedule_table.html'
+
+    def get_schedule_html(self, day):
+        """Render the schedule table, caching the result until the
+           schedule changes."""
+        try:
+            datetime.datetime.strptime(day, '%Y-%m-%d')
+        except (TypeError, ValueError):
+            # We choose to return the full schedule if given an invalid
+            # date
+            day = None
+        cache = caches[settings.WAFER_CACHE]
+        key = _schedule_cache_key('wafer_schedule_html', day)
+        html = cache.get(key)
+        if html is None:
+            context = {'schedule_days': []}
+            # Check if the schedule is valid
+            if check_schedule():
+                context['schedule_days'] = generate_schedule(
+                    _get_schedule_day(day))
+            html = render_to_string(self.table_template_name, context)
+            cache.set(key, html, SCHEDULE_CACHE_TIMEOUT)
+        return mark_safe(html)
+
+    @schedule_condition
+    def get(self, request, *args, **kwargs):
+        return super(ScheduleView, self).get(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
         context = super(ScheduleView, self).get_context_data(**kwargs)
-        # Check if the schedule is valid
-        context['active'] = False
-        if not check_schedule():
-            return context
-        context['active'] = True
-        day = self.request.GET.get('day', None)
-        dates = dict([(x.date.strftime('%Y-%m-%d'), x) for x in
-                      Day.objects.all()])
-        # We choose to return the full schedule if given an invalid date
-        day = dates.get(day, None)
-        context['schedule_days'] = generate_schedule(day)
+        context['schedule_html'] = self.get_schedule_html(
+            self.request.GET.get('day', None))
         return context
 
 
-class ScheduleXmlView(ScheduleView):
-    template_name = 'wafer.schedule/penta_schedule.xml'
+class ScheduleXmlView(View):
     content_type = 'application/xml'
 
+    def _cache_content(self, key, chunks):
+        content = []
+        for chunk in chunks:
+            content.append(chunk)
+            yield chunk
+        cache = caches[settings.WAFER_CACHE]
+        cache.set(key, b''.join(content), SCHEDULE_CACHE_TIMEOUT)
+
+    @schedule_condition
+    def get(self, request, *args, **kwargs):
+        # Staff see the speakers' contact details
+        cache = caches[settings.WAFER_CACHE]
+        key = _schedule_cache_key('wafer_schedule_xml',
+                                  request.user.is_staff)
+        content = cache.get(key)
+        if content is not None:
+            return HttpResponse(content, content_type=self.content_type)
+        grid = None
+        if check_schedule():
+            grid = ScheduleGrid()
+        exporter = PentabarfExporter(grid, get_current_site(request),
+                                     include_contact=request.user.is_staff)
+        return StreamingHttpResponse(
+            self._cache_content(key, exporter.generate()),
+            content_type=self.content_type)
+
+
+def _get_speakers(item):
+    if item.talk:
+        authors = list(item.talk.authors.all())
+        # Corresponding authors first, as for the schedule page
+        authors.sort(key=lambda author: (
+            author != item.talk.corresponding_author,
+            author.userprofile.display_name()))
+        return [author.userprofile.display_name() for author in authors]
+    elif item.page:
+        return [person.userprofile.display_name()
+                for person in item.page.people.all()]
+    return []
+
+
+def generate_schedule_json():
+    """Return the schedule as a dictionary, ready to be serialized as
+       JSON."""
+    grid = ScheduleGrid()
+    days = grid.get_schedule_days()
+    venues = {}
+    slots = []
+    items = {}
+    for schedule_day in days:
+        for venue in schedule_day.venues:
+            venues[venue.pk] = {
+                'id': venue.pk,
+                'name': venue.name,
+                'url': venue.get_absolute_url(),
+            }
+        for row in schedule_day.rows:
+            slots.append({
+                'id': row.slot.pk,
+                'day': schedule_day.day.date.isoformat(),
+                'start_time': row.slot.get_start_time().isoformat(),
+                'end_time': row.slot.end_time.isoformat(),
+            })
+            for item in grid.get_items(row.slot):
+                if item.pk in items:
+                    items[item.pk]['slots'].append(row.slot.pk)
+                    continue
+                items[item.pk] = {
+                    'id': item.pk,
+                    'venue': item.venue_id,
+                    'slots': [row.slot.pk],
+                    'title': item.get_details(),
+                    'speakers': _get_speakers(item),
+                    'url': item.get_url(),
+                    'css_class': item.css_class,
+                }
+    return {
+        'days': [{
+            'date': schedule_day.day.date.isoformat(),
+            'venues': [venue.pk for venue in schedule_day.venues],
+        } for schedule_day in days],
+        'venues': sorted(venues.values(), key=lambda x: x['id']),
+        'slots': slots,
+        'items': sorted(items.values(), key=lambda x: x['id']),
+    }
+
+
+class ScheduleJsonView(View):
+    """The schedule as JSON.
+
+       The JSON is only generated once for each version of the schedule,
+       and cached (both as is and gzipped), so requests just return the
+       cached bytes."""
+
+    def get_payload(self):
+        cache = caches[settings.WAFER_CACHE]
+        key = _schedule_cache_key('wafer_schedule_json')
+        payload = cache.get(key)
+        if payload is None:
+            schedule = {'days': [], 'venues': [], 'slots': [], 'items': []}
+            if check_schedule():
+                schedule = generate_schedule_json()
+            content = json.dumps(schedule, separators=(',', ':'))
+            content = content.encode('utf-8')
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+                f.write(content)
+            payload = (content, buf.getvalue())
+            cache.set(key, payload, SCHEDULE_CACHE_TIMEOUT)
+        return payload
+
+    @schedule_condition
+    def get(self, request, *args, **kwargs):
+        content, gzipped = self.get_payload()
+        use_gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        response = HttpResponse(gzipped if use_gzip else content,
+                                content_type='application/json')
+        if use_gzip:
+            response['Content-Encoding'] = 'gzip'
+        response['Vary'] = 'Accept-Encoding'
+        return response
+
+
+def get_calendar_events(request):
+    """Return the CalendarEvents for the current version of the schedule,
+       generating them if needed."""
+    cache = caches[settings.WAFER_CACHE]
+    key = _schedule_cache_key('wafer_schedule_ical_events')
+    events = cache.get(key)
+    if events is None:
+        grid = None
+        if check_schedule():
+            grid = ScheduleGrid()
+        events = CalendarEvents(grid, get_current_site(request),
+                                get_schedule_last_modified())
+        cache.set(key, events, SCHEDULE_CACHE_TIMEOUT)
+    return events
+
+
+class ScheduleIcalView(View):
+    """The schedule as an iCalendar feed.
+
+       The feed may be restricted to a venue or a speaker. Each feed is
+       generated once for each version of the schedule."""
+
+    content_type = 'text/calendar; charset=utf-8'
+
+    def get_feed(self, venue_pk=None, username=None):
+        name, venue = None, None
+        if venue_pk is not None:
+            venue = get_object_or_404(Venue, pk=venue_pk)
+            name = venue.name
+            venue = venue.pk
+        if username is not None:
+            user = get_object_or_404(get_user_model(), username=username)
+            name = user.userprofile.display_name()
+        return get_calendar_events(self.request).render(
+            name, venue=venue, speaker=username)
+
+    @schedule_condition
+    def get(self, request, venue_pk=None, username=None):
+        cache = caches[settings.WAFER_CACHE]
+        key = _schedule_cache_key('wafer_schedule_ical', venue_pk,
+                                  username)
+        content = cache.get(key)
+        if content is None:
+            content = self.get_feed(venue_pk, username)
+            cache.set(key, content, SCHEDULE_CACHE_TIMEOUT)
+        return HttpResponse(content, content_type=self.content_type)
+
+
+class DaySlotIndex(object):
+    """The slots on a day, sorted by time, for finding the slots around a
+       given time with a binary search.
+
+       This assumes the schedule is valid, so none of the slots overlap."""
+
+    def __init__(self, day):
+        self.slots = list(Slot.objects.select_related('effective_day')
+                          .filter(effective_day=day)
+                          .order_by('end_time', 'start_time', 'day'))
+        self.end_times = [slot.end_time for slot in self.slots]
+
+    @classmethod
+    def get(cls, day):
+        """Return the index for the day, caching it until the schedule
+           changes."""
+        cache = caches[settings.WAFER_CACHE]
+        key = _schedule_cache_key('wafer_schedule_slot_index', day.pk)
+        index = cache.get(key)
+        if index is None:
+            index = cls(day)
+            cache.set(key, index, SCHEDULE_CACHE_TIMEOUT)
+        return index
+
+    def find_slots(self, time):
+        """Return the previous, current and next slots at the given time.
+
+           Any of these may be None."""
+        prev_slot, cur_slot, next_slot = None, None, None
+        # The slots before pos have finished
+        pos = bisect.bisect_right(self.end_times, time)
+        if pos > 0:
+            prev_slot = self.slots[pos - 1]
+        if pos < len(self.slots):
+            if self.slots[pos].get_start_time() <= time:
+                cur_slot = self.slots[pos]
+                pos += 1
+        if pos < len(self.slots):
+            next_slot = self.slots[pos]
+        return prev_slot, cur_slot, next_slot
+
 
 class CurrentView(TemplateView):
     template_name = 'wafer.schedule/current.html'
@@ -131,9 +484,7 @@ class CurrentView(TemplateView):
             day = str(datetime.date.today())
         dates = dict([(x.date.strftime('%Y-%m-%d'), x) for x in
                       Day.objects.all()])
-        if day not in dates:
-            return None
-        return ScheduleDay(dates[day])
+        return dates.get(day, None)
 
     def _parse_time(self, time):
         now = datetime.datetime.now().time()
@@ -153,30 +504,24 @@ class CurrentView(TemplateView):
                 # Must overlap with current slot
                 item['note'] = overlap_note
 
-    def _current_slots(self, schedule_day, time):
-        today = schedule_day.day
-        cur_slot, prev_slot, next_slot = None, None, None
-        for slot in Slot.objects.all():
-            if slot.get_day() != today:
-                continue
-            if slot.get_start_time() <= time and slot.end_time > time:
-                cur_slot = slot
-            elif slot.end_time <= time:
-                if not prev_slot or prev_slot.end_time < slot.end_time:
-                    prev_slot = slot
-            elif slot.get_start_time() >= time:
-                if not next_slot or next_slot.end_time > slot.end_time:
-                    next_slot = slot
+    def _current_slots(self, today, time):
+        prev_slot, cur_slot, next_slot = DaySlotIndex.get(today).find_slots(
+            time)
+        # We only need the items in the slots we show
+        grid = ScheduleGrid(today, [slot for slot in
+                                    (prev_slot, cur_slot, next_slot) if slot])
+        schedule_day = grid.get_schedule_day(today)
         cur_rows = self._current_rows(
-            schedule_day, cur_slot, prev_slot, next_slot)
-        return cur_slot, cur_rows
+            grid, schedule_day, cur_slot, prev_slot, next_slot)
+        return schedule_day, cur_slot, cur_rows
 
-    def _current_rows(self, schedule_day, cur_slot, prev_slot, next_slot):
+    def _current_rows(self, grid, schedule_day, cur_slot, prev_slot,
+                      next_slot):
         seen_items = {}
         rows = []
         for slot in (prev_slot, cur_slot, next_slot):
             if slot:
-                row = make_schedule_row(schedule_day, slot, seen_items)
+                row = grid.make_row(schedule_day, slot, seen_items)
             else:
                 row = None
             rows.append(row)
@@ -202,14 +547,15 @@ class CurrentView(TemplateView):
         # Allow refresh time to be overridden
         context['refresh'] = self.request.GET.get('refresh', None)
         # If there are no items scheduled for today, return an empty slots list
-        schedule_day = self._parse_today(self.request.GET.get('day', None))
-        if schedule_day is None:
+        today = self._parse_today(self.request.GET.get('day', None))
+        if today is None:
             return context
-        context['schedule_day'] = schedule_day
         # Allow current time to be overridden
         time = self._parse_time(self.request.GET.get('time', None))
 
-        cur_slot, current_rows = self._current_slots(schedule_day, time)
+        schedule_day, cur_slot, current_rows = self._current_slots(today,
+                                                                   time)
+        context['schedule_day'] = schedule_day
         context['cur_slot'] = cur_slot
         context['slots'].extend(current_rows)
 
@@ -223,11 +569,45 @@ class ScheduleItemViewSet(viewsets.ModelViewSet):
     queryset = ScheduleItem.objects.all()
     serializer_class = ScheduleItemSerializer
 
+    @schedule_condition
+    def list(self, request, *args, **kwargs):
+        return super(ScheduleItemViewSet, self).list(request, *args, **kwargs)
+
+    @schedule_condition
+    def retrieve(self, request, *args, **kwargs):
+        return super(ScheduleItemViewSet, self).retrieve(
+            request, *args, **kwargs)
+
+    @list_route(methods=['post'])
+    def batch(self, request):
+        """Apply a list of changes to the schedule in one transaction.
+
+           Returns the changed schedule items and the problems found in
+           the resulting schedule."""
+        serializer = ScheduleBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        changed = [item.pk for item in serializer.save()]
+        items = ScheduleItem.objects.filter(
+            pk__in=changed).prefetch_related('slots').order_by('pk')
+        valid = schedule_is_valid()
+        findings = ScheduleFinding.objects.values(
+            'rule', 'item', 'slot').order_by('pk')
+        return Response({
+            'items': ScheduleItemSerializer(
+                items, many=True, context={'request': request}).data,
+            'valid': valid,
+            'findings': list(findings),
+        })
+
 
 class ScheduleEditView(TemplateView):
     template_name = 'wafer.schedule/edit_schedule.html'
 
-    def _slot_context(self, slot, venues):
+    def _slot_context(self, slot, venues, slot_items):
+        """Build the context for a slot.
+
+           slot_items maps venue ids to the schedule items in the slot in
+           that venue."""
         slot_context = {
             'name': slot.name,
             'start_time': slot.get_start_time(),
@@ -240,19 +620,18 @@ class ScheduleEditView(TemplateView):
                 'name': venue.name,
                 'id': venue.id,
             }
-            for schedule_item in slot.scheduleitem_set.all():
-                if schedule_item.venue.name == venue.name:
-                    if schedule_item.talk:
-                        talk = schedule_item.talk
-                        venue_context['title'] = talk.title
-                        venue_context['talk'] = talk
-                        venue_context['scheduleitem_id'] = talk.talk_id
-                    if (schedule_item.page and
-                            not schedule_item.page.exclude_from_static):
-                        page = schedule_item.page
-                        venue_context['title'] = page.name
-                        venue_context['page'] = page
-                        venue_context['scheduleitem_id'] = page.id
+            for schedule_item in slot_items.get(venue.id, []):
+                if schedule_item.talk:
+                    talk = schedule_item.talk
+                    venue_context['title'] = talk.title
+                    venue_context['talk'] = talk
+                    venue_context['scheduleitem_id'] = talk.talk_id
+                if (schedule_item.page and
+                        not schedule_item.page.exclude_from_static):
+                    page = schedule_item.page
+                    venue_context['title'] = page.name
+                    venue_context['page'] = page
+                    venue_context['scheduleitem_id'] = page.id
             slot_context['venues'].append(venue_context)
         return slot_context
 
@@ -266,17 +645,25 @@ class ScheduleEditView(TemplateView):
             day = days.first()
 
         accepted_talks = Talk.objects.filter(status=ACCEPTED)
-        venues = Venue.objects.filter(days__in=[day])
-        slots = Slot.objects.all().select_related(
-            'day', 'previous_slot').prefetch_related(
-            'scheduleitem_set', 'slot_set').order_by(
-                'end_time', 'start_time', 'day')
-        aggregated_slots = []
+        venues = list(Venue.objects.filter(days__in=[day]))
+        slots = Slot.objects.filter(effective_day=day).select_related(
+            'effective_day').order_by('end_time', 'start_time', 'day')
+
+        # (slot id, venue id) -> items, for all the items on the day
+        items = {}
+        links = ScheduleItem.slots.through.objects.filter(
+            slot__effective_day=day).select_related(
+            'scheduleitem', 'scheduleitem__talk',
+            'scheduleitem__page').order_by('scheduleitem_id')
+        for link in links:
+            item = link.scheduleitem
+            items.setdefault(link.slot_id, {}).setdefault(
+                item.venue_id, []).append(item)
 
+        aggregated_slots = []
         for slot in slots:
-            if day != slot.get_day():
-                continue
-            aggregated_slots.append(self._slot_context(slot, venues))
+            aggregated_slots.append(
+                self._slot_context(slot, venues, items.get(slot.pk, {})))
 
         context['day'] = day
         context['venues'] = venues
@@ -1,18 +1,39 @@
 from django_medusa.renderers import StaticSiteRenderer
-from wafer.sponsors.models import Sponsor
+from wafer.sponsors.models import File, Sponsor, SponsorshipPackage
+from wafer.utils import reverse_formatter
 from django.core.urlresolvers import reverse
 
 
 class SponsorRenderer(StaticSiteRenderer):
+    def _get_list_paths(self):
+        return ["/sponsors/", reverse('wafer_sponsors'),
+                reverse('wafer_sponsorship_packages')]
+
+    def _iter_sponsors(self):
+        """Yield (url, sponsor id) for the sponsors, without loading
+           them."""
+        sponsor_url = reverse_formatter('wafer_sponsor')
+        items = Sponsor.objects.values_list('id', flat=True)
+        for sponsor_id in items.iterator():
+            yield sponsor_url(str(sponsor_id)), sponsor_id
+
+    def iter_paths(self):
+        paths = self._get_list_paths()
+        yield paths[0]
+        for url, _ in self._iter_sponsors():
+            yield url
+        for path in paths[1:]:
+            yield path
+
     def get_paths(self):
-        paths = ["/sponsors/", ]
-
-        items = Sponsor.objects.all()
-        for item in items:
-            paths.append(item.get_absolute_url())
-        paths.append(reverse('wafer_sponsors'))
-        paths.append(reverse('wafer_sponsorship_packages'))
-        return paths
+        return list(self.iter_paths())
+
+    def get_dependencies(self):
+        list_deps = [Sponsor, SponsorshipPackage, File]
+        deps = dict((path, list_deps) for path in self._get_list_paths())
+        for url, sponsor_id in self._iter_sponsors():
+            deps[url] = [(Sponsor, sponsor_id)]
+        return deps
 
 
 renderers = [SponsorRenderer, ]
@@ -1,4 +1,4 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.utils.translation import ugettext_lazy as _
 
 from wafer.talks.models import TalkType, Talk, TalkUrl
@@ -14,10 +14,29 @@ class ScheduleListFilter(admin.SimpleListFilter):
             )
 
     def queryset(self, request, queryset):
+        # The queryset is annotated by TalkAdmin.get_queryset
         if self.value() == 'in':
-            return queryset.filter(scheduleitem__isnull=False)
+            return queryset.filter(num_schedule_items__gt=0)
         elif self.value() == 'out':
-            return queryset.filter(scheduleitem__isnull=True)
+            return queryset.filter(num_schedule_items=0)
+        return queryset
+
+
+class UrlListFilter(admin.SimpleListFilter):
+    title = _('has url')
+    parameter_name = 'url'
+
+    def lookups(self, request, model_admin):
+        return (
+            ('yes', _('Has urls')),
+            ('no', _('No urls')),
+            )
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.filter(num_urls__gt=0)
+        elif self.value() == 'no':
+            return queryset.filter(num_urls=0)
         return queryset
 
 class TalkUrlAdmin(admin.ModelAdmin):
@@ -32,12 +51,33 @@ class TalkAdmin(admin.ModelAdmin):
                     'get_corresponding_author_contact', 'talk_type',
                     'get_in_schedule', 'has_url', 'status')
     list_editable = ('status',)
-    list_filter = ('status', 'talk_type', ScheduleListFilter)
+    list_filter = ('status', 'talk_type', ScheduleListFilter, UrlListFilter)
+    list_select_related = ('corresponding_author',
+                           'corresponding_author__userprofile', 'talk_type')
+    actions = ['schedule_talks']
 
     inlines = [
               TalkUrlInline,
               ]
 
+    def get_queryset(self, request):
+        qs = super(TalkAdmin, self).get_queryset(request)
+        return qs.with_counts()
+
+    def schedule_talks(self, request, queryset):
+        from wafer.schedule.solver import ScheduleSolver
+
+        result = ScheduleSolver(queryset).solve()
+        result.apply()
+        self.message_user(request, _('Placed %d talks in the schedule')
+                          % len(result.placed))
+        for talk, reason in result.unplaced:
+            self.message_user(request, _('Could not place %(talk)s: '
+                                         '%(reason)s') % {
+                'talk': talk.title, 'reason': reason}, messages.WARNING)
+    schedule_talks.short_description = _(
+        'Place selected accepted talks in free schedule slots')
+
 
 admin.site.register(Talk, TalkAdmin)
 admin.site.register(TalkType)
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('talks', '0004_edit_private_notes_permission'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='talk',
+            name='status',
+            field=models.CharField(default='P', max_length=1, db_index=True, choices=[('A', 'Accepted'), ('R', 'Not Accepted'), ('P', 'Under Consideration')]),
+        ),
+    ]
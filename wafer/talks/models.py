@@ -23,6 +23,22 @@ class TalkType(models.Model):
         return u'%s' % (self.name,)
 
 
+class TalkQuerySet(models.QuerySet):
+
+    def with_counts(self):
+        """Annotate the talks with the number of schedule items
+           (num_schedule_items) and urls (num_urls), so get_in_schedule
+           and has_url don't need a query per talk."""
+        return self.annotate(
+            num_schedule_items=models.Count('scheduleitem', distinct=True),
+            num_urls=models.Count('talkurl', distinct=True))
+
+    def prefetch_authors(self):
+        """Prefetch the authors and their profiles, so
+           get_authors_display_name doesn't need any queries per talk."""
+        return self.prefetch_related('authors__userprofile')
+
+
 @python_2_unicode_compatible
 class Talk(models.Model):
 
@@ -59,7 +75,7 @@ class Talk(models.Model):
                     "to submitter)"))
 
     status = models.CharField(max_length=1, choices=TALK_STATUS,
-                              default=PENDING)
+                              default=PENDING, db_index=True)
 
     corresponding_author = models.ForeignKey(
         settings.AUTH_USER_MODEL, related_name='contact_talks',
@@ -72,6 +88,8 @@ class Talk(models.Model):
         help_text=_(
             "The speakers presenting the talk."))
 
+    objects = TalkQuerySet.as_manager()
+
     def __str__(self):
         return u'%s: %s' % (self.corresponding_author, self.title)
 
@@ -97,31 +115,35 @@ class Talk(models.Model):
     get_corresponding_author_name.short_description = 'Corresponding Author'
 
     def get_authors_display_name(self):
-        authors = list(self.authors.all())
+        # Compare primary keys, so we don't need to load the
+        # corresponding author
+        names = [(author.pk, author.userprofile.display_name())
+                 for author in self.authors.all()]
         # Corresponding authors first
-        authors.sort(
-            key=lambda author: u'' if author == self.corresponding_author
-                               else author.userprofile.display_name())
-        names = [author.userprofile.display_name() for author in authors]
+        names.sort(key=lambda name: u'' if name[0] ==
+                   self.corresponding_author_id else name[1])
+        names = [name for _, name in names]
         if len(names) <= 2:
             return u' & '.join(names)
         return u'%s, et al.' % names[0]
 
     def get_in_schedule(self):
-        if self.scheduleitem_set.all():
-            return True
-        return False
+        if hasattr(self, 'num_schedule_items'):
+            return self.num_schedule_items > 0
+        return self.scheduleitem_set.exists()
 
     get_in_schedule.short_description = 'Added to schedule'
     get_in_schedule.boolean = True
+    get_in_schedule.admin_order_field = 'num_schedule_items'
 
     def has_url(self):
         """Test if the talk has urls associated with it"""
-        if self.talkurl_set.all():
-            return True
-        return False
+        if hasattr(self, 'num_urls'):
+            return self.num_urls > 0
+        return self.talkurl_set.exists()
 
     has_url.boolean = True
+    has_url.admin_order_field = 'num_urls'
 
     # Helpful properties for the templates
     accepted = property(fget=lambda x: x.status == ACCEPTED)
@@ -1,16 +1,15 @@
 from django_medusa.renderers import StaticSiteRenderer
-from wafer.talks.models import Talk, ACCEPTED
+from wafer.talks.models import Talk, TalkType, TalkUrl, ACCEPTED
 from wafer.talks.views import UsersTalks
+from wafer.users.models import UserProfile
+from wafer.utils import reverse_formatter
+from django.contrib.auth import get_user_model
 from django.core.urlresolvers import reverse
 
 
 class TalksRenderer(StaticSiteRenderer):
-    def get_paths(self):
+    def _get_list_paths(self):
         paths = ["/talks/", ]
-
-        items = Talk.objects.filter(status=ACCEPTED)
-        for item in items:
-            paths.append(item.get_absolute_url())
         view = UsersTalks()
         view.request = None
         queryset = view.get_queryset()
@@ -21,4 +20,43 @@ class TalksRenderer(StaticSiteRenderer):
                                  kwargs={'page': page}))
         return paths
 
+    def _iter_talks(self):
+        """Yield (url, talk id) for the accepted talks, without loading
+           them."""
+        talk_url = reverse_formatter('wafer_talk')
+        items = (Talk.objects.filter(status=ACCEPTED)
+                 .values_list('talk_id', flat=True))
+        for talk_id in items.iterator():
+            yield talk_url(str(talk_id)), talk_id
+
+    def iter_paths(self):
+        paths = self._get_list_paths()
+        yield paths[0]
+        for url, _ in self._iter_talks():
+            yield url
+        for path in paths[1:]:
+            yield path
+
+    def get_paths(self):
+        return list(self.iter_paths())
+
+    def get_dependencies(self):
+        User = get_user_model()
+        # The lists show every talk and its authors' names
+        list_deps = [Talk, TalkType, User, UserProfile]
+        deps = dict((path, list_deps) for path in self._get_list_paths())
+        profiles = dict(UserProfile.objects.values_list('user_id', 'id'))
+        authors = {}
+        for talk_id, user_id in Talk.authors.through.objects.values_list(
+                'talk_id', 'user_id'):
+            authors.setdefault(talk_id, []).append(user_id)
+        for url, talk_id in self._iter_talks():
+            talk_deps = [(Talk, talk_id), TalkType, TalkUrl]
+            for user_id in authors.get(talk_id, []):
+                talk_deps.append((User, user_id))
+                if user_id in profiles:
+                    talk_deps.append((UserProfile, profiles[user_id]))
+            deps[url] = talk_deps
+        return deps
+
 renderers = [TalksRenderer, ]
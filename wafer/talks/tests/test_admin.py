@@ -0,0 +1,75 @@
+"""Tests for wafer.talk admin."""
+
+import datetime as D
+
+from django.test import Client, TestCase
+
+from wafer.schedule.models import Day, Venue, Slot, ScheduleItem
+from wafer.talks.models import Talk, TalkUrl, ACCEPTED
+from wafer.talks.tests.test_views import create_user, create_talk
+from wafer.utils import QueryTracker
+
+
+class TalkAdminTests(TestCase):
+
+    def setUp(self):
+        create_user('admin', superuser=True)
+        self.client = Client()
+        self.client.login(username='admin', password='admin_password')
+        day = Day.objects.create(date=D.date(2013, 9, 22))
+        self.venue = Venue.objects.create(order=1, name='Venue 1')
+        self.venue.days.add(day)
+        self.slot = Slot.objects.create(day=day, start_time=D.time(10, 0),
+                                        end_time=D.time(11, 0))
+        self.count = 0
+        self.talk = self.add_talk(scheduled=True, urls=2)
+        self.other = self.add_talk()
+
+    def add_talk(self, scheduled=False, urls=0):
+        self.count += 1
+        talk = create_talk('Talk %d' % self.count, ACCEPTED,
+                           'author%d' % self.count)
+        if scheduled:
+            item = ScheduleItem.objects.create(venue=self.venue, talk=talk)
+            item.slots.add(self.slot)
+        for x in range(urls):
+            TalkUrl.objects.create(talk=talk, description='Url %d' % x,
+                                   url='http://example.com/%d' % x)
+        return talk
+
+    def changelist(self, **params):
+        response = self.client.get('/admin/talks/talk/', params)
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['cl'].result_list)
+
+    def test_annotations(self):
+        talks = Talk.objects.with_counts().order_by('talk_id')
+        self.assertEqual([(talk.get_in_schedule(), talk.has_url())
+                          for talk in talks], [(True, True), (False, False)])
+        # Without the annotations, the same answers need a query
+        self.assertTrue(self.talk.get_in_schedule())
+        self.assertFalse(self.other.has_url())
+
+    def test_changelist_queries(self):
+        """Check that the changelist doesn't need a query per talk."""
+        # The first request caches the site and the menus
+        self.changelist()
+        with QueryTracker() as tracker:
+            self.changelist()
+            num_queries = len(tracker.queries)
+        for x in range(5):
+            self.add_talk(scheduled=x % 2, urls=x % 3)
+        with QueryTracker() as tracker:
+            self.assertEqual(len(self.changelist()), 7)
+            self.assertEqual(len(tracker.queries), num_queries)
+
+    def test_filters(self):
+        self.assertEqual(self.changelist(schedule='in'), [self.talk])
+        self.assertEqual(self.changelist(schedule='out'), [self.other])
+        self.assertEqual(self.changelist(url='yes'), [self.talk])
+        self.assertEqual(self.changelist(url='no'), [self.other])
+
+    def test_ordering(self):
+        # Sorting on the in schedule and has url columns
+        self.assertEqual(self.changelist(o='4'), [self.other, self.talk])
+        self.assertEqual(self.changelist(o='-5'), [self.talk, self.other])
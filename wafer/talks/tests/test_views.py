@@ -6,7 +6,8 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission
 from django.core.urlresolvers import reverse
 from django.test import Client, TestCase
-from wafer.talks.models import Talk, ACCEPTED, REJECTED, PENDING
+from wafer.talks.models import Talk, TalkType, ACCEPTED, REJECTED, PENDING
+from wafer.utils import QueryTracker, STATIC_SITE_HEADER
 
 
 def create_user(username, superuser=False, perms=()):
@@ -71,6 +72,77 @@ class UsersTalksTests(TestCase):
         self.assertEqual(set(response.context['talk_list']),
                          set([self.talk_a, self.talk_r, self.talk_p]))
 
+    def test_query_count_flat(self):
+        """Test that listing the talks doesn't need queries per talk."""
+        # The first request caches the site and the menus
+        self.client.get('/talks/')
+        with QueryTracker() as tracker:
+            response = self.client.get('/talks/')
+            num_queries = len(tracker.queries)
+        for i in range(5):
+            talk = create_talk("Talk %d" % i, ACCEPTED, "author_%d" % i)
+            talk.authors.add(create_user("coauthor_%d" % i))
+        with QueryTracker() as tracker:
+            response = self.client.get('/talks/')
+            self.assertEqual(len(tracker.queries), num_queries)
+        self.assertContains(response, 'author_0 &amp; coauthor_0')
+
+    def test_filters(self):
+        """Test filtering the talks by status and type."""
+        talk_type = TalkType.objects.create(name='Workshop')
+        self.talk_p.talk_type = talk_type
+        self.talk_p.save()
+        create_user('reviewer', perms=['view_all_talks'])
+        self.client.login(username='reviewer', password='reviewer_password')
+        response = self.client.get('/talks/', {'status': REJECTED})
+        self.assertEqual(list(response.context['talk_list']), [self.talk_r])
+        response = self.client.get('/talks/', {'type': talk_type.pk})
+        self.assertEqual(list(response.context['talk_list']), [self.talk_p])
+        response = self.client.get('/talks/', {'type': 'x'})
+        self.assertEqual(response.status_code, 404)
+        # Other users can't see talks that aren't accepted
+        self.client.logout()
+        response = self.client.get('/talks/', {'status': REJECTED})
+        self.assertEqual(list(response.context['talk_list']), [self.talk_a])
+
+    def test_keyset_pagination(self):
+        """Test following the next page links."""
+        talks = [self.talk_a] + [
+            create_talk("Talk %d" % i, ACCEPTED, "author_%d" % i)
+            for i in range(30)]
+        response = self.client.get('/talks/', {'after': 0})
+        self.assertEqual(list(response.context['talk_list']), talks[:25])
+        next_query = 'after=%d' % talks[24].talk_id
+        self.assertEqual(response.context['next_page_query'], next_query)
+        self.assertContains(response, '/talks/?%s' % next_query)
+        with QueryTracker() as tracker:
+            response = self.client.get('/talks/?%s' % next_query)
+            # No count query is needed
+            self.assertFalse([query for query in tracker.queries
+                              if 'COUNT' in query['sql']])
+        self.assertEqual(list(response.context['talk_list']), talks[25:])
+        self.assertNotIn('next_page_query', response.context)
+        response = self.client.get('/talks/', {'after': 'x'})
+        self.assertEqual(response.status_code, 404)
+        # The unfiltered list links to the next page in the same way
+        response = self.client.get('/talks/')
+        self.assertEqual(list(response.context['talk_list']), talks[:25])
+        self.assertEqual(response.context['next_page_query'], next_query)
+        self.assertFalse(response.context['is_paginated'])
+
+    def test_numbered_pages(self):
+        """Test the numbered pages, used by the static site."""
+        talks = [self.talk_a] + [
+            create_talk("Talk %d" % i, ACCEPTED, "author_%d" % i)
+            for i in range(30)]
+        response = self.client.get('/talks/page/2')
+        self.assertEqual(list(response.context['talk_list']), talks[25:])
+        response = self.client.get('/talks/', **{STATIC_SITE_HEADER: '1'})
+        self.assertEqual(list(response.context['talk_list']), talks[:25])
+        self.assertTrue(response.context['is_paginated'])
+        self.assertNotIn('next_page_query', response.context)
+        self.assertContains(response, '/talks/page/2')
+
 
 class TalkViewTests(TestCase):
     def setUp(self):
@@ -1,16 +1,18 @@
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied, ValidationError
 from django.core.urlresolvers import reverse_lazy
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect
 from django.utils.decorators import method_decorator
+from django.utils.http import urlencode
 from django.views.generic import DetailView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.views.generic.list import ListView
 from django.conf import settings
 
-from wafer.talks.models import Talk, ACCEPTED
+from wafer.talks.models import Talk, TalkType, ACCEPTED
 from wafer.talks.forms import TalkForm
 from wafer.users.models import UserProfile
+from wafer.utils import STATIC_SITE_HEADER
 
 
 class EditOwnTalksMixin(object):
@@ -32,15 +34,77 @@ class LoginRequiredMixin(object):
 
 
 class UsersTalks(ListView):
+    """List the talks.
+
+       The talks can be filtered by status (for users who can view all
+       the talks) and type, with the status and type query parameters.
+       The list uses keyset pagination, with the after query parameter
+       (the last talk_id on the previous page), which stays fast however
+       deep the page. The numbered pages are kept for the static site,
+       which can't use query parameters."""
     template_name = 'wafer.talks/talks.html'
     paginate_by = 25
+    next_after = None
 
-    def get_queryset(self):
+    def _get_params(self):
         # self.request will be None when we come here via the static site
         # renderer
+        if self.request is None:
+            return {}
+        return self.request.GET
+
+    def get_queryset(self):
+        params = self._get_params()
         if (self.request and Talk.can_view_all(self.request.user)):
-            return Talk.objects.all()
-        return Talk.objects.filter(status=ACCEPTED)
+            talks = Talk.objects.all()
+            if params.get('status'):
+                talks = talks.filter(status=params['status'])
+        else:
+            talks = Talk.objects.filter(status=ACCEPTED)
+        if params.get('type'):
+            try:
+                talks = talks.filter(talk_type=int(params['type']))
+            except ValueError:
+                raise Http404
+        return (talks.select_related('corresponding_author', 'talk_type')
+                .prefetch_authors().order_by('talk_id'))
+
+    def _use_numbered_pages(self):
+        if self.request is None or 'page' in self.kwargs:
+            return True
+        return bool(self.request.META.get(STATIC_SITE_HEADER))
+
+    def paginate_queryset(self, queryset, page_size):
+        if self._use_numbered_pages():
+            return super(UsersTalks, self).paginate_queryset(queryset,
+                                                             page_size)
+        params = self._get_params()
+        try:
+            after = int(params.get('after', 0))
+        except ValueError:
+            raise Http404
+        # Fetch an extra talk, to tell if there's a next page
+        talks = list(queryset.filter(talk_id__gt=after)[:page_size + 1])
+        if len(talks) > page_size:
+            talks = talks[:page_size]
+            self.next_after = talks[-1].talk_id
+        return (None, None, talks, False)
+
+    def get_context_data(self, **kwargs):
+        context = super(UsersTalks, self).get_context_data(**kwargs)
+        params = self._get_params()
+        filters = dict((param, params[param]) for param in ('status', 'type')
+                       if params.get(param))
+        context['filters'] = filters
+        # The filter form is for reviewers, and isn't part of the static
+        # site
+        if self.request and Talk.can_view_all(self.request.user):
+            context['talk_types'] = TalkType.objects.all()
+            context['talk_statuses'] = Talk.TALK_STATUS
+        if self.next_after is not None:
+            filters = dict(filters, after=self.next_after)
+            context['next_page_query'] = urlencode(filters)
+        return context
 
 
 class TalkView(DetailView):
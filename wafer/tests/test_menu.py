@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.test import TestCase
+
+from wafer import menu
+from wafer.menu import get_cached_menus
+from wafer.pages.models import Page
+
+
+def menu_labels():
+    return [item['label'] for item in get_cached_menus().items]
+
+
+class MenuCacheTests(TestCase):
+
+    def setUp(self):
+        self.page = Page.objects.create(name='About', slug='about',
+                                        include_in_menu=True)
+
+    def test_cached(self):
+        self.assertEqual(menu_labels(), ['About'])
+        # Only the version is checked
+        with self.assertNumQueries(1):
+            self.assertEqual(menu_labels(), ['About'])
+
+    def test_copied(self):
+        """Check that changing the menus doesn't change them for later
+           callers."""
+        for x in range(2):
+            menus = get_cached_menus()
+            menus.items[0]['label'] = 'Changed'
+            menus.items.append({'label': 'Added'})
+            self.assertEqual(menu_labels(), ['About'])
+
+    def test_refresh(self):
+        menu_labels()
+        self.page.name = 'About us'
+        self.page.save()
+        self.assertEqual(menu_labels(), ['About us'])
+        self.page.delete()
+        self.assertEqual(menu_labels(), [])
+
+    def test_other_process(self):
+        """Check that changes made by another process are seen."""
+        menu_labels()
+        # Another process changes the page, and generates the new menus
+        Page.objects.filter(pk=self.page.pk).update(name='Changed')
+        local_menus = menu._local_menus
+        menu.refresh_menu_cache()
+        self.assertEqual(menu_labels(), ['Changed'])
+        # Back in this process, the new menus are fetched from the cache,
+        # rather than being generated again
+        menu._local_menus = local_menus
+        with self.assertNumQueries(2):
+            self.assertEqual(menu_labels(), ['Changed'])
+
+    def test_version_lost(self):
+        menu_labels()
+        caches[settings.WAFER_CACHE].clear()
+        Page.objects.filter(pk=self.page.pk).update(name='Changed')
+        self.assertEqual(menu_labels(), ['Changed'])
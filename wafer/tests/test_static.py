@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import skipIf
+
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+
+from wafer.management.compress import compress_output
+from wafer.pages.models import Page
+from wafer.schedule.models import Venue
+from wafer.sponsors.models import Sponsor
+from wafer.talks.tests.test_views import create_talk
+from wafer.talks.models import Talk, ACCEPTED
+from wafer.utils import QueryTracker
+
+try:
+    from wafer.management.build import StaticSiteBuilder
+    from wafer.pages.renderers import PagesRenderer
+    from wafer.schedule.renderers import ScheduleRenderer
+    from wafer.sponsors.renderers import SponsorRenderer
+    from wafer.talks.renderers import TalksRenderer
+    from wafer.users.renderers import UserRenderer
+except ImportError:
+    # django_medusa doesn't work with all the Django versions we support
+    StaticSiteBuilder = None
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+
+
+def read_tree(root):
+    """Return a dictionary of path -> contents for the files under root."""
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, root)] = f.read()
+    return files
+
+
+@skipIf(StaticSiteBuilder is None, "django_medusa is not available")
+class StaticSiteBuilderTests(TestCase):
+
+    def setUp(self):
+        Page.objects.create(name='Index', slug='index', content='Welcome')
+        # A container page, for the menus
+        about = Page.objects.create(name='About', slug='about',
+                                    content='About us',
+                                    exclude_from_static=True)
+        Page.objects.create(name='Venue', slug='venue', content='Here',
+                            parent=about)
+        for i in range(6):
+            create_talk('Talk %d' % i, ACCEPTED, 'author_%d' % i)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def build(self, jobs, name=None, incremental=False, compress=False):
+        deploy_dir = os.path.join(self.tmpdir, name or 'jobs%d' % jobs)
+        out = StringIO()
+        with override_settings(MEDUSA_DEPLOY_DIR=deploy_dir):
+            StaticSiteBuilder([PagesRenderer, TalksRenderer], jobs=jobs,
+                              stdout=out, incremental=incremental,
+                              compress=compress).build()
+        return read_tree(deploy_dir), out.getvalue()
+
+    def test_parallel_matches_serial(self):
+        serial, out = self.build(1)
+        self.assertIn('about/venue', serial)
+        self.assertIn('talks/index.html', serial)
+        self.assertIn('PagesRenderer: rendered 2 paths', out)
+        parallel, out = self.build(2)
+        self.assertEqual(sorted(serial), sorted(parallel))
+        self.assertEqual(serial, parallel)
+        self.assertIn('PagesRenderer: rendered 2 paths', out)
+        self.assertIn('TalksRenderer: rendered', out)
+
+    def test_incremental(self):
+        self.build(1, 'site')
+        tree, out = self.build(1, 'site', incremental=True)
+        self.assertIn('PagesRenderer: rendered 0 paths', out)
+        self.assertIn('TalksRenderer: rendered 0 paths', out)
+
+        # Changing a talk renders it, and the talk lists
+        talk = Talk.objects.get(title='Talk 0')
+        talk.title = 'Changed'
+        talk.save()
+        tree, out = self.build(1, 'site', incremental=True)
+        self.assertIn('PagesRenderer: rendered 0 paths', out)
+        self.assertIn('TalksRenderer: rendered 3 paths', out)
+        self.assertIn(b'Changed', tree['talks/%d/index.html' % talk.pk])
+        self.assertIn(b'Changed', tree['talks/index.html'])
+
+        # Deleted talks are removed from the mirror
+        deleted = Talk.objects.get(title='Talk 1')
+        deleted_path = 'talks/%d/index.html' % deleted.pk
+        self.assertIn(deleted_path, tree)
+        deleted.delete()
+        tree, out = self.build(1, 'site', incremental=True)
+        self.assertNotIn(deleted_path, tree)
+        self.assertIn('TalksRenderer: rendered 2 paths', out)
+
+        # Modified output is replaced
+        path = os.path.join(self.tmpdir, 'site', 'index.html')
+        with open(path, 'wb') as f:
+            f.write(b'Broken')
+        tree, out = self.build(1, 'site', incremental=True)
+        self.assertIn('PagesRenderer: rendered 1 paths', out)
+
+        full, out = self.build(1, 'full')
+        self.assertEqual(tree, full)
+
+    def test_compress(self):
+        tree, out = self.build(2, 'site', compress=True)
+        self.assertIn('Compressed 11 files', out)
+        self.assertEqual(gunzip(tree['talks/index.html.gz']),
+                         tree['talks/index.html'])
+        self.assertIn('hashes.json', tree)
+        site = os.path.join(self.tmpdir, 'site')
+        self.assertTrue(os.path.samefile(os.path.join(site, 'index'),
+                                         os.path.join(site, 'index.html')))
+        tree, out = self.build(1, 'site', incremental=True, compress=True)
+        self.assertIn('Compressed 0 files', out)
+        self.assertIn('(11 unchanged)', out)
+
+
+@skipIf(StaticSiteBuilder is None, "django_medusa is not available")
+class RendererPathTests(TestCase):
+
+    def test_paths(self):
+        """Check the bulk generated paths match the reversed urls."""
+        Page.objects.create(name='Index', slug='index', content='Welcome')
+        about = Page.objects.create(name='About', slug='about',
+                                    content='About us',
+                                    exclude_from_static=True)
+        venue = Page.objects.create(name='Venue', slug='venue',
+                                    content='Here', parent=about)
+        Page.objects.create(name='Map', slug='map', content='Map',
+                            parent=venue)
+        self.assertEqual(sorted(PagesRenderer().get_paths()),
+                         ['/', '/about/venue', '/about/venue/map'])
+
+        talk = create_talk('Talk', ACCEPTED, 'author')
+        get_user_model().objects.create_user(u'\xfcser.name+x@y', None,
+                                             'password')
+        paths = TalksRenderer().get_paths()
+        self.assertEqual(paths[:2], ['/talks/', talk.get_absolute_url()])
+        users = get_user_model().objects.all()
+        self.assertEqual(
+            sorted(UserRenderer().get_paths()[1:len(users) + 1]),
+            sorted(reverse('wafer_user_profile',
+                           kwargs={'username': user.username})
+                   for user in users))
+
+        sponsor = Sponsor.objects.create(name='Sponsor', description='')
+        self.assertIn(sponsor.get_absolute_url(),
+                      SponsorRenderer().get_paths())
+        venue = Venue.objects.create(order=1, name='Venue')
+        paths = ScheduleRenderer().get_paths()
+        self.assertIn(venue.get_absolute_url(), paths)
+        self.assertIn(reverse('wafer_venue_ical',
+                              kwargs={'venue_pk': venue.pk}), paths)
+
+    def test_page_paths_benchmark(self):
+        roots = [Page(name='Root %d' % x, slug='root-%d' % x, content='')
+                 for x in range(100)]
+        Page.objects.bulk_create(roots)
+        children = [Page(name='Page %d' % x, slug='page-%d' % x,
+                         content='', parent_id=root_id)
+                    for root_id in Page.objects.values_list('id', flat=True)
+                    for x in range(100)]
+        Page.objects.bulk_create(children)
+        with QueryTracker() as tracker:
+            paths = list(PagesRenderer().iter_paths())
+        # The paths are built from one query for the page ids, and the
+        # page path map (which is rebuilt, since bulk_create doesn't
+        # send post_save), rather than a query per page
+        self.assertLess(len(tracker.queries), 10)
+        self.assertEqual(len(paths), 10100)
+        self.assertIn('/root-5/page-7', paths)
+
+
+class CompressTests(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmpdir, 'sub'))
+        self.write('a.html', b'Same')
+        self.write('b.html', b'Same')
+        self.write('sub/c.json', b'{}')
+        self.write('image.png', b'PNG')
+        self.write('release.tar.gz', b'Archive')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        with open(os.path.join(self.tmpdir, name), 'wb') as f:
+            f.write(data)
+
+    def read(self, name):
+        with open(os.path.join(self.tmpdir, name), 'rb') as f:
+            return f.read()
+
+    def compress(self, jobs=1):
+        with override_settings(MEDUSA_DEPLOY_DIR=self.tmpdir):
+            return compress_output(jobs)
+
+    def test_compress(self):
+        self.assertEqual(self.compress(jobs=2), (3, 0))
+        self.assertEqual(gunzip(self.read('a.html.gz')), b'Same')
+        self.assertEqual(gunzip(self.read('sub/c.json.gz')), b'{}')
+        # Identical files share their compressed copies
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.tmpdir, 'a.html.gz'),
+            os.path.join(self.tmpdir, 'b.html.gz')))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tmpdir, 'image.png.gz')))
+        hashes = json.loads(self.read('hashes.json').decode('utf-8'))
+        self.assertEqual(sorted(hashes), ['a.html', 'b.html', 'image.png',
+                                          'release.tar.gz', 'sub/c.json'])
+        self.assertEqual(hashes['a.html'], hashes['b.html'])
+
+        self.assertEqual(self.compress(), (0, 3))
+
+        # Changing one of the files leaves the other's copy alone
+        self.write('a.html', b'Changed')
+        os.unlink(os.path.join(self.tmpdir, 'sub/c.json'))
+        self.assertEqual(self.compress(), (1, 1))
+        self.assertEqual(gunzip(self.read('a.html.gz')),
+                         b'Changed')
+        self.assertEqual(gunzip(self.read('b.html.gz')), b'Same')
+        # The copies of deleted files are removed
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tmpdir, 'sub/c.json.gz')))
+        # But other compressed files are left alone
+        self.assertEqual(self.read('release.tar.gz'), b'Archive')
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tickets', '0002_auto_20150813_1926'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ticket',
+            name='email',
+            field=models.EmailField(max_length=75, db_index=True, blank=True),
+        ),
+    ]
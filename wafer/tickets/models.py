@@ -17,7 +17,7 @@ class TicketType(models.Model):
 @python_2_unicode_compatible
 class Ticket(models.Model):
     barcode = models.IntegerField(primary_key=True)
-    email = models.EmailField(blank=True)
+    email = models.EmailField(blank=True, db_index=True)
     type = models.ForeignKey(TicketType)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='ticket',
                              blank=True, null=True, on_delete=models.SET_NULL)
@@ -2,18 +2,15 @@ from django_medusa.renderers import StaticSiteRenderer
 from django.core.urlresolvers import reverse
 from django.contrib.auth import get_user_model
 
+from wafer.talks.models import Talk
+from wafer.users.models import UserProfile
 from wafer.users.views import UsersView
+from wafer.utils import reverse_formatter
 
 
 class UserRenderer(StaticSiteRenderer):
-    def get_paths(self):
+    def _get_list_paths(self):
         paths = ["/users/", ]
-
-        items = get_user_model().objects.all()
-        for item in items:
-            paths.append(reverse('wafer_user_profile',
-                                 kwargs={'username': item.username}))
-
         view = UsersView()
         queryset = view.get_queryset()
         paginator = view.get_paginator(queryset,
@@ -23,4 +20,36 @@ class UserRenderer(StaticSiteRenderer):
                                  kwargs={'page': page}))
         return paths
 
+    def _iter_users(self):
+        """Yield (profile url, user id) for the users, without loading
+           them."""
+        profile_url = reverse_formatter('wafer_user_profile', 'username')
+        items = get_user_model().objects.values_list('id', 'username')
+        for user_id, username in items.iterator():
+            yield profile_url(username), user_id
+
+    def iter_paths(self):
+        paths = self._get_list_paths()
+        yield paths[0]
+        for url, _ in self._iter_users():
+            yield url
+        for path in paths[1:]:
+            yield path
+
+    def get_paths(self):
+        return list(self.iter_paths())
+
+    def get_dependencies(self):
+        User = get_user_model()
+        list_deps = [User, UserProfile]
+        deps = dict((path, list_deps) for path in self._get_list_paths())
+        profiles = dict(UserProfile.objects.values_list('user_id', 'id'))
+        for url, user_id in self._iter_users():
+            # The profiles list the user's accepted talks
+            user_deps = [(User, user_id), Talk]
+            if user_id in profiles:
+                user_deps.append((UserProfile, profiles[user_id]))
+            deps[url] = user_deps
+        return deps
+
 renderers = [UserRenderer, ]
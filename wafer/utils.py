@@ -1,7 +1,10 @@
 import functools
+import string
 import unicodedata
 from django.core.cache import caches
+from django.core.urlresolvers import reverse
 from django.conf import settings
+from django.utils.http import RFC3986_SUBDELIMS, urlquote
 
 
 def normalize_unicode(u):
@@ -41,10 +44,10 @@ class QueryTracker(object):
 
     def __enter__(self):
         from django.conf import settings
-        from django.db import connection
+        from django.db import reset_queries
         self._debug = settings.DEBUG
         settings.DEBUG = True
-        del connection.queries[:]
+        reset_queries()
         return self
 
     def __exit__(self, *args, **kw):
@@ -55,3 +58,38 @@ class QueryTracker(object):
     def queries(self):
         from django.db import connection
         return connection.queries[:]
+
+
+# Sent with the requests made when building the static site, so views
+# can avoid links the static site can't serve, such as ones relying on
+# query parameters
+STATIC_SITE_HEADER = 'HTTP_X_WAFER_STATIC_SITE'
+
+
+# Stands in for the argument when reversing urls for reverse_formatter.
+# It has to match the argument's pattern.
+URL_PLACEHOLDER = '1234567890'
+
+
+def reverse_formatter(viewname, kwarg=None):
+    """Reverse the url of a view which takes a single argument (named
+       kwarg, if given) once, and return a function building the url for
+       any value of the argument.
+
+       This avoids the cost of reversing every url when generating a lot
+       of them."""
+    if kwarg:
+        url = reverse(viewname, kwargs={kwarg: URL_PLACEHOLDER})
+    else:
+        url = reverse(viewname, args=(URL_PLACEHOLDER,))
+    prefix, _, suffix = url.partition(URL_PLACEHOLDER)
+    # The same quoting as reverse
+    safe = RFC3986_SUBDELIMS + '/~:@'
+    unquoted = frozenset(string.ascii_letters + string.digits + '_.-' + safe)
+
+    def format_url(value):
+        # Quoting is relatively slow, and rarely needed
+        if not unquoted.issuperset(value):
+            value = urlquote(value, safe=safe)
+        return prefix + value + suffix
+    return format_url